@@ -0,0 +1,89 @@
+"""批量判断基准：在桩模型上比较逐条调用和合并调用判断拜年信息的吞吐
+
+桩模型的耗时 = 每次请求的固定开销 + prompt 长度 × 预填充耗时 + 输出token数 × 生成耗时，
+合并调用省下的是每次请求的固定开销和重复的判断说明。本地分类器关闭，所有消息都交给模型。
+
+运行: python -m benchmarks.bench_batch
+"""
+import argparse
+
+from src.handlers.rule_index import NEW_YEAR
+from src.services.classification_cache import ClassificationCache
+from src.services.llm_service import LLMService
+from src.simulator.stub_llm import StubLLMClient
+from src.utils.clock import Clock
+
+from .bench_classifier import LABELED
+from .common import expected_failures, quiet_logging
+
+BATCH_SIZES = (1, 2, 4, 8, 16, 32, 64)
+
+
+class FailingBatchClient(StubLLMClient):
+    """批量判断请求总是出错的桩模型"""
+
+    def generate(self, model: str, prompt: str, stream: bool = False, **kwargs):
+        if '逐条回答' in prompt:
+            raise RuntimeError('模拟批量请求出错')
+        return super().generate(model, prompt, stream, **kwargs)
+
+
+def build_messages(count: int, service: LLMService):
+    """关键词规则无法判定的消息，加上序号避免互相命中缓存"""
+    candidates = [message for message, _ in LABELED if not service.rules.matches(message, NEW_YEAR)]
+    return [f"{candidates[i % len(candidates)]}（{i + 1}）" for i in range(count)]
+
+
+def run(args, batch_size: int, per_item: bool = False, omit_every: int = 0, client_class=StubLLMClient,
+        local_classifier: bool = False):
+    """判断 args.messages 条消息，返回 (模拟秒数, 模型调用次数, 准确率)"""
+    clock = Clock(args.scale)
+    llm = client_class(clock, prompt_latency=args.request_latency, prompt_char_interval=args.prefill_interval,
+                       token_interval=args.token_interval, think_tokens=0, tail_tokens=0, omit_every=omit_every)
+    service = LLMService(llm, ClassificationCache(path=None, clock=clock), clock=clock)
+    if not local_classifier:
+        service.local_classifier = None
+    service.batch_size = batch_size
+    messages = build_messages(args.messages, service)
+
+    start = clock.monotonic()
+    if per_item:
+        verdicts = [service.is_new_year_greeting(message) for message in messages]
+    else:
+        verdicts = service.classify_messages(messages)
+    elapsed = clock.monotonic() - start
+    accuracy = sum(v == llm.is_greeting(m) for m, v in zip(messages, verdicts)) / len(messages)
+    return elapsed, llm.calls, accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=64, help='每组判断的消息数')
+    parser.add_argument('--request-latency', type=float, default=0.3, help='桩模型每次请求的固定开销(秒)')
+    parser.add_argument('--prefill-interval', type=float, default=0.003, help='桩模型处理prompt每个字的耗时(秒)')
+    parser.add_argument('--token-interval', type=float, default=0.03, help='桩模型每个输出token的耗时(秒)')
+    parser.add_argument('--omit-every', type=int, default=5, help='部分失败场景中每几条漏答一条')
+    parser.add_argument('--scale', type=float, default=200, help='模拟时钟加速倍数')
+    args = parser.parse_args()
+
+    quiet_logging()
+    baseline, calls, accuracy = run(args, 1, per_item=True)
+    print(f"{args.messages} 条消息，逐条调用: {baseline:.1f} 秒，{args.messages / baseline:.2f} 条/秒，"
+          f"模型调用 {calls} 次，准确率 {accuracy:.0%}")
+    print(f"{'批大小':<8}{'耗时(s)':>10}{'条/秒':>10}{'加速':>8}{'调用次数':>10}{'准确率':>8}")
+    for batch_size in BATCH_SIZES:
+        elapsed, calls, accuracy = run(args, batch_size)
+        print(f"{batch_size:<8}{elapsed:>10.1f}{args.messages / elapsed:>10.2f}{baseline / elapsed:>8.1f}"
+              f"{calls:>10}{accuracy:>8.0%}")
+
+    elapsed, calls, accuracy = run(args, 16, omit_every=args.omit_every)
+    print(f"批大小16，每 {args.omit_every} 条漏答一条（漏答的逐条补判）: {elapsed:.1f} 秒，"
+          f"模型调用 {calls} 次，准确率 {accuracy:.0%}")
+    with expected_failures():
+        elapsed, calls, accuracy = run(args, 16, client_class=FailingBatchClient, local_classifier=True)
+    print(f"批大小16，批量请求全部出错（本地分类器兜底）: {elapsed:.1f} 秒，"
+          f"模型调用 {calls} 次，准确率 {accuracy:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""拜年判断缓存基准：比较缓存命中与桩模型调用的单次判断耗时
+
+运行: python -m benchmarks.bench_cache
+"""
+import argparse
+import time
+
+from src.services.classification_cache import ClassificationCache
+from src.services.llm_service import LLMService
+from src.simulator.stub_llm import StubLLMClient
+
+from .common import quiet_logging
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=10000, help='重复判断的次数')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='桩模型的prompt处理耗时(秒)')
+    args = parser.parse_args()
+
+    quiet_logging()
+    llm = StubLLMClient(prompt_latency=args.llm_latency, token_interval=0, think_tokens=0)
+    service = LLMService(llm, ClassificationCache(path=None))
+    # 本地分类器在缓存未命中时先于模型判断，关闭后才能测到缓存命中与模型调用
+    service.local_classifier = None
+    message = '心想事成，阖家安康'
+
+    start = time.perf_counter()
+    service.is_new_year_greeting(message)
+    miss_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        service.is_new_year_greeting(f" {message}！")
+    hit_time = (time.perf_counter() - start) / args.repeats
+
+    print(f"未命中(调用模型): {miss_time * 1000:.1f} 毫秒")
+    print(f"命中缓存: {hit_time * 1e6:.1f} 微秒/次")
+    stats = service.classification_cache.stats()
+    print(f"模型调用次数: {llm.calls}，缓存统计: {stats}")
+    assert llm.calls == 1 and stats['hits'] == args.repeats, "缓存未生效，测到的不是缓存命中的耗时"
+
+
+if __name__ == '__main__':
+    main()
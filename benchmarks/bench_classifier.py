@@ -0,0 +1,113 @@
+"""本地意图分类器基准：统计交给模型判断的比例和在标注集上的准确率
+
+标注集随机分成两半：一半当作历史上模型的判断记录(拜年判断缓存)用于训练，另一半用于评估。
+标注集与训练分类器的种子样本(SEED_SAMPLES)归一化后没有重复，评估不会用到训练数据。
+经过模型判断的消息按标注计为正确（即假设模型判断正确），本地判断与标注对比。
+
+运行: python -m benchmarks.bench_classifier
+"""
+import argparse
+import random
+import time
+
+from src.handlers.rule_index import NEW_YEAR
+from src.services.classification_cache import ClassificationCache
+from src.services.intent_classifier import SEED_SAMPLES
+from src.services.llm_service import LLMService
+from src.simulator.stub_llm import StubLLMClient
+
+from .common import quiet_logging
+
+LABELED = [
+    *((message, True) for message in (
+        '新年快乐哦，天天开心', '祝您蛇年大吉', '恭喜发财，红包拿来', '春节快乐，万事如意', '心想事成，阖家安康',
+        '给您拜年啦', '蛇年行大运', '祝福您和家人平安喜乐', '过年好呀', '新春快乐', '愿你所求皆如愿',
+        '阖家幸福，万事顺意', '蛇年吉祥', '恭喜恭喜', '财源滚滚来', '步步高升，前程似锦', '岁岁平安，年年有余',
+        '祝您福寿安康', '祝老板生意兴隆', '新的一年心想事成', '家人们除夕快乐', '大吉大利，今晚吃鸡', '如意吉祥，福气满满',
+        '鸿运当头，蛇来运转', '笑口常开，身体健康', '愿你新岁胜旧年', '给叔叔阿姨拜个早年', '诸事顺遂',
+        '金蛇献瑞，福满人间', '新春愉快，阖家欢乐', '恭贺新禧', '万事如意，心想事成', '平安顺遂',
+        '前程似锦，万事胜意', '愿您阖家安康', '新年新气象', '祝您日进斗金', '鸿运亨通', '龙去蛇来，好运常在',
+        '瑞雪兆丰年', '新岁安康',
+    )),
+    *((message, False) for message in (
+        '人呢', '已收到', '没得问题', '[位置]', '周五有空吗', '好哒', '[名片]', '笑死我了', '在吗？', '收到收到',
+        'okk', '好的好的', '嗯呢', '哈哈哈哈', '[语音通话]', '[视频号]', '今天加班吗', '吃了吗', '我到了', '你在哪',
+        '发个定位', '方案改好了吗', '下午三点开会', '好滴', '行吧', '知道啦', '马上', '稍等一下', '周一见',
+        '晚上一起吃饭吗', '这个多少钱', '快递到了', '多谢啦', '麻烦了', '辛苦了', '好嘞', '没事', '可以的',
+        '在开车', '回头聊', '[小程序]', '[聊天记录]', '报告发你邮箱了', '几点到', '路上堵车', '请假一天',
+        '帮我看下这个', '收到，谢谢',
+    )),
+]
+
+
+def classify(service: LLMService, message: str) -> str:
+    """返回判断经过的路径"""
+    if service.rules.matches(message, NEW_YEAR):
+        return 'keyword'
+    if service.local_classifier:
+        local = service.local_classifier.predict(message)
+        if local is not None:
+            return 'accept' if local else 'reject'
+    return 'llm'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--train-fraction', type=float, default=0.5, help='用作历史判断记录的比例')
+    parser.add_argument('--repeats', type=int, default=10000, help='测量本地判断耗时的重复次数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    quiet_logging()
+    labeled = [ClassificationCache.normalize(message) for message, _ in LABELED]
+    assert len(set(labeled)) == len(labeled), "标注集中有重复的消息"
+    overlap = set(labeled) & {ClassificationCache.normalize(message) for message, _ in SEED_SAMPLES}
+    assert not overlap, f"标注集与种子样本重复: {sorted(overlap)}"
+    samples = list(LABELED)
+    random.Random(args.seed).shuffle(samples)
+    split = int(len(samples) * args.train_fraction)
+    history, evaluation = samples[:split], samples[split:]
+
+    cache = ClassificationCache(path=None)
+    for message, label in history:
+        cache.put(message, label)
+    service = LLMService(StubLLMClient(), cache)
+    # 评估集不能命中缓存
+    service.classification_cache = ClassificationCache(path=None)
+
+    routes = {'keyword': [], 'accept': [], 'reject': [], 'llm': []}
+    for message, label in evaluation:
+        routes[classify(service, message)].append((message, label))
+
+    total = len(evaluation)
+    correct = {
+        'keyword': sum(label for _, label in routes['keyword']),
+        'accept': sum(label for _, label in routes['accept']),
+        'reject': sum(not label for _, label in routes['reject']),
+        'llm': len(routes['llm']),
+    }
+    local_decided = len(routes['accept']) + len(routes['reject'])
+    no_keyword = total - len(routes['keyword'])
+
+    print(f"训练样本: {len(history)} 条历史判断 + 种子样本，评估样本: {total} 条")
+    print(f"{'路径':<10}{'条数':>6}{'正确':>6}")
+    for route, items in routes.items():
+        print(f"{route:<10}{len(items):>6}{correct[route]:>6}")
+    print(f"关键词未命中的消息中交给模型判断: {len(routes['llm'])}/{no_keyword} "
+          f"({len(routes['llm']) / max(no_keyword, 1):.0%})，未启用本地分类器时为 100%")
+    print(f"本地判断准确率: {(correct['accept'] + correct['reject']) / max(local_decided, 1):.1%} "
+          f"({local_decided} 条)")
+    print(f"总体准确率: {sum(correct.values()) / total:.1%}")
+    errors = [m for m, label in routes['accept'] if not label] + [m for m, label in routes['reject'] if label]
+    for message in errors:
+        print(f"  本地误判: {message}")
+
+    messages = [message for message, _ in evaluation]
+    start = time.perf_counter()
+    for i in range(args.repeats):
+        service.local_classifier.score(messages[i % len(messages)])
+    print(f"本地判断耗时: {(time.perf_counter() - start) / args.repeats * 1e6:.1f} 微秒/次")
+
+
+if __name__ == '__main__':
+    main()
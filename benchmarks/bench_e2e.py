@@ -0,0 +1,104 @@
+"""端到端延迟基准：在模拟器上重放脚本化的消息，统计吞吐和各阶段延迟
+
+运行: python -m benchmarks.bench_e2e --messages 20 --windows 2
+"""
+import argparse
+
+from src.services.reply_pool import ReplyPool
+from src.utils.config import IMAGE_MODEL, MESSAGE_DEADLINE, TEXT_MODEL
+from src.utils.metrics import metrics
+
+from .common import (StageRecorder, build_bot, instrument, percentile, quiet_logging,
+                     reply_latencies, run_bot, schedule_burst, unanswered_greetings)
+
+# 桩模型不需要下载模型，基准中使用带小模型档位的配置，以测试按截止时间降档
+BENCH_TIERS = {
+    'classify': ['qwen2.5:1.5b', 'qwen2.5:0.5b'],
+    'reply': [TEXT_MODEL, 'qwen2.5:1.5b'],
+    'vision': [IMAGE_MODEL],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20, help='投递的消息数')
+    parser.add_argument('--windows', type=int, default=1, help='微信窗口数')
+    parser.add_argument('--contacts', type=int, default=None, help='发消息的联系人数（默认每条消息来自不同联系人）')
+    parser.add_argument('--arrival-window', type=float, default=60, help='消息在多少(模拟)秒内到达')
+    parser.add_argument('--max-seconds', type=float, default=3600, help='最长运行(模拟)秒数')
+    parser.add_argument('--scale', type=float, default=20, help='模拟时钟加速倍数')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='桩模型的prompt处理耗时(秒)')
+    parser.add_argument('--token-interval', type=float, default=0.03, help='桩模型每个token的耗时(秒)')
+    parser.add_argument('--no-stream', action='store_true', help='关闭流式生成')
+    parser.add_argument('--serial', action='store_true', help='关闭流水线，串行处理')
+    parser.add_argument('--first-only', action='store_true', help='串行模式下每轮只处理第一个会话')
+    parser.add_argument('--input-mode', choices=('paste', 'type'), default='paste', help='回复输入方式')
+    parser.add_argument('--no-events', action='store_true', help='关闭界面变化事件，只按间隔轮询')
+    parser.add_argument('--round-robin', action='store_true', help='每轮轮流切换一个窗口，不做多窗口只读扫描')
+    parser.add_argument('--pool', action='store_true', help='开启预生成回复池（默认按配置，配置中默认关闭）')
+    parser.add_argument('--warmup', type=float, default=0, help='消息到达前的空闲(模拟)秒数，用于预生成回复')
+    parser.add_argument('--deadline', type=float, default=MESSAGE_DEADLINE, help='每条消息的回复截止时间(模拟秒)')
+    parser.add_argument('--single-model', action='store_true', help='每个任务只用首选模型，不按截止时间降档')
+    parser.add_argument('--small-model-speed', type=float, default=0.3,
+                        help='桩模型中非首选模型的耗时倍数（模拟更小的模型）')
+    parser.add_argument('--last-only', action='store_true', help='每个会话只读取最后一条消息，不合并未读消息')
+    parser.add_argument('--metrics', action='store_true', help='输出 Prometheus 文本格式的指标')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    quiet_logging()
+    primary = {models[0] for models in BENCH_TIERS.values()}
+    model_speed = {model: args.small_model_speed
+                   for models in BENCH_TIERS.values() for model in models if model not in primary}
+    bot, wechat, llm = build_bot(args.scale, args.windows, prompt_latency=args.llm_latency,
+                                 token_interval=args.token_interval, model_speed=model_speed)
+    bot.llm_service.streaming = not args.no_stream
+    if args.serial:
+        bot.pipeline = None
+    bot.cycle_mode = not args.first_only
+    bot.input_mode = args.input_mode
+    bot.ui_automation.events_enabled = not args.no_events
+    bot.multi_window_scan = not args.round_robin
+    if args.pool and not bot.reply_pool:
+        bot.reply_pool = ReplyPool(bot.llm_service, clock=bot.clock)
+    bot.message_deadline = args.deadline
+    if args.last_only:
+        bot.max_unread_messages = 1
+    if args.single_model:
+        bot.llm_service.router.tiers = {task: models[:1] for task, models in BENCH_TIERS.items()}
+    else:
+        bot.llm_service.router.tiers = BENCH_TIERS
+    recorder = StageRecorder(bot.clock)
+    instrument(bot, recorder)
+    greetings, conversations = schedule_burst(wechat, args.messages, args.arrival_window, seed=args.seed,
+                                              start=args.warmup, contacts=args.contacts)
+
+    elapsed = run_bot(bot, wechat, conversations, args.max_seconds)
+
+    latencies = reply_latencies(wechat)
+    print(f"消息: {len(wechat.arrivals)} 条（拜年 {greetings} 条，来自 {conversations} 个会话），回复: {len(wechat.sent)} 条，"
+          f"LLM调用: {llm.calls} 次（生成 {llm.tokens_generated} 个token），丢失按键: {wechat.dropped_keys}")
+    print(f"未获回复的拜年消息: {unanswered_greetings(wechat)} 条")
+    active = max(elapsed - args.warmup, 1e-9)
+    print(f"运行时长: {elapsed:.1f} 秒，吞吐: {len(wechat.sent) / active * 60:.2f} 条/分钟（不含预热）")
+    print(f"端到端延迟 p50: {percentile(latencies, 50):.1f} 秒，p99: {percentile(latencies, 99):.1f} 秒")
+    print(f"UI操作: {wechat.ui_calls} 次，窗口焦点切换: {wechat.focus_changes} 次")
+    if bot.reply_pool:
+        print(f"回复池: {bot.reply_pool.stats()}")
+    print(f"模型调用: {llm.model_calls}")
+    for route, outcome in bot.llm_service.router.stats().items():
+        print(f"模型路由 {route}: {outcome['count']} 次，超时 {outcome['late']} 次，"
+              f"失败 {outcome['failed']} 次，平均 {outcome['avg']:.1f} 秒")
+    print(f"会话列表定位缓存: {bot.ui_automation.locator_stats()}")
+    print()
+    waits = {f"wait:{step}": values for step, values in bot.ui_automation.wait_times.items()}
+    for line in recorder.report(waits):
+        print(line)
+    print()
+    print(f"指标汇总: {metrics.summary()}")
+    if args.metrics:
+        print(metrics.render())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""图片拜年识别基准：转发的贺卡按感知哈希命中缓存的比例，以及视觉模型较慢时文字消息的回复延迟
+
+运行: python -m benchmarks.bench_image --cards 10 --forwards 50
+"""
+import argparse
+import os
+import random
+import tempfile
+
+from src.services.image_greeting import CapturedImage, ImageGreetingDetector, ImageVerdictCache
+from src.services.llm_service import LLMService
+from src.services.classification_cache import ClassificationCache
+from src.simulator.stub_llm import StubLLMClient, is_red_card
+from src.utils.clock import Clock
+
+from .common import CONTACTS, GREETINGS, build_bot, percentile, quiet_logging, run_bot
+
+GREETING_COLORS = (0xC8102E, 0xE02020, 0xB22222)   # 红底贺卡
+OTHER_COLORS = (0x2E86C1, 0x28B463, 0x7F8C8D, 0xF4F6F7)
+SHAPE_COLORS = (0xFFD700, 0x000000, 0xFFFFFF, 0x8E44AD)
+
+
+def make_card(rng: random.Random, greeting: bool, width: int = 240, height: int = 320) -> CapturedImage:
+    """纯色底上随机画几个色块，拜年贺卡为红底"""
+    background = rng.choice(GREETING_COLORS if greeting else OTHER_COLORS)
+    pixels = [background] * (width * height)
+    for _ in range(6):
+        w, h = rng.randint(width // 8, width // 3), rng.randint(height // 8, height // 3)
+        left, top = rng.randint(0, width - w), rng.randint(0, height - h)
+        color = rng.choice(SHAPE_COLORS)
+        for y in range(top, top + h):
+            pixels[y * width + left:y * width + left + w] = [color] * w
+    return CapturedImage(width, height, pixels)
+
+
+def forward(rng: random.Random, card: CapturedImage) -> CapturedImage:
+    """模拟转发：缩放到原来的 70%~100%，并给每个像素加上轻微噪声（重新压缩）"""
+    image = card.resized(int(max(card.width, card.height) * rng.uniform(0.7, 1.0)))
+
+    def jitter(color: int) -> int:
+        channels = [min(255, max(0, ((color >> shift) & 0xFF) + rng.randint(-8, 8))) for shift in (16, 8, 0)]
+        return (channels[0] << 16) | (channels[1] << 8) | channels[2]
+
+    return CapturedImage(image.width, image.height, [jitter(color) for color in image.pixels])
+
+
+def cache_benchmark(args):
+    """同一批贺卡被多次转发，统计视觉模型调用次数和缓存命中，再从持久化文件重新加载"""
+    rng = random.Random(args.seed)
+    cards = [make_card(rng, i % 2 == 0) for i in range(args.cards)]
+    forwards = [(card, forward(rng, card)) for card in (rng.choice(cards) for _ in range(args.forwards))]
+
+    clock = Clock(args.scale)
+    llm = StubLLMClient(clock, vision_latency=args.vision_latency)
+    path = os.path.join(tempfile.mkdtemp(), 'image_cache.json')
+    service = LLMService(llm, ClassificationCache(path=None, clock=clock), clock=clock)
+    service.image_detector = ImageGreetingDetector(
+        service.is_greeting_image, ImageVerdictCache(path=path, clock=clock), clock=clock,
+        deadline=args.vision_latency * (args.cards + 2))
+
+    correct = 0
+    for original, image in forwards:
+        marker = service.image_detector.register(image)
+        correct += service.classify_messages([marker]) == [is_red_card(original)]
+    stats = service.image_detector.stats()
+    service.close()
+    print(f"贺卡 {args.cards} 张，转发 {args.forwards} 次：视觉模型调用 {llm.vision_calls} 次，"
+          f"缓存命中 {stats['hits']} 次（其中相近哈希 {stats['near_hits']} 次），判断正确 {correct}/{args.forwards}")
+
+    reloaded = ImageGreetingDetector(lambda image: None, ImageVerdictCache(path=path, clock=clock), clock=clock)
+    markers = [reloaded.register(forward(rng, card)) for card in cards]
+    verdicts = reloaded.classify(markers)
+    hits = reloaded.stats()['hits']
+    reloaded.close()
+    print(f"重启后重新加载缓存：{len(cards)} 张贺卡命中 {hits} 张，"
+          f"判断正确 {sum(v == is_red_card(c) for v, c in zip(verdicts, cards))}/{len(cards)}")
+
+
+def latency_run(args, detect_images: bool, vision_latency: float):
+    """文字拜年消息与图片消息同时到达，返回文字消息的回复延迟、回复数、总回复数和视觉模型调用次数
+
+    detect_images 为False时不截图识别（图片消息按不是拜年处理），作为同样消息量下的对照；
+    识别图片时比较视觉模型很快和较慢两种情况，文字消息的延迟不应随视觉模型变慢而增加。
+    """
+    rng = random.Random(args.seed)
+    bot, wechat, llm = build_bot(args.scale, prompt_latency=0.5, token_interval=0.03,
+                                 vision_latency=vision_latency)
+    if not detect_images:
+        bot.llm_service.image_detector = bot.ui_automation.image_detector = None
+    text_contacts = CONTACTS[:args.messages]
+    for contact in text_contacts:
+        wechat.schedule_message(rng.uniform(0, 30), contact, rng.choice(GREETINGS))
+    for i, contact in enumerate(CONTACTS[args.messages:args.messages * 2]):
+        wechat.schedule_image(rng.uniform(0, 30), contact, make_card(rng, i % 2 == 0))
+    greeting_cards = (args.messages + 1) // 2 if detect_images else 0
+    run_bot(bot, wechat, args.messages + greeting_cards, args.max_seconds)
+    arrivals = {a.contact: a.time for a in wechat.arrivals if a.contact in text_contacts}
+    replied = {}
+    for record in wechat.sent:
+        replied.setdefault(record.contact, record.time)
+    latencies = [replied[contact] - arrivals[contact] for contact in arrivals if contact in replied]
+    return latencies, len(latencies), len(wechat.sent), llm.vision_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cards', type=int, default=10, help='不同贺卡的数量（一半为拜年贺卡）')
+    parser.add_argument('--forwards', type=int, default=50, help='转发的次数（每次随机缩放并加噪声）')
+    parser.add_argument('--messages', type=int, default=10, help='延迟测试中文字拜年消息数（另有同样数量的图片消息）')
+    parser.add_argument('--vision-latency', type=float, default=8.0, help='桩视觉模型每张图的耗时(秒)')
+    parser.add_argument('--max-seconds', type=float, default=1800, help='最长运行(模拟)秒数')
+    parser.add_argument('--scale', type=float, default=20, help='模拟时钟加速倍数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    quiet_logging()
+    cache_benchmark(args)
+    runs = (('不识别图片', False, args.vision_latency),
+            ('识别图片，视觉模型 0.1s', True, 0.1),
+            (f'识别图片，视觉模型 {args.vision_latency:g}s', True, args.vision_latency))
+    for label, detect_images, vision_latency in runs:
+        latencies, text_replies, replies, vision_calls = latency_run(args, detect_images, vision_latency)
+        print(f"{label}: 文字消息回复 {text_replies}/{args.messages} 条（共发出 {replies} 条，视觉模型调用 {vision_calls} 次），"
+              f"文字回复延迟 p50 {percentile(latencies, 50):.1f}s p99 {percentile(latencies, 99):.1f}s")
+
+
+if __name__ == '__main__':
+    main()
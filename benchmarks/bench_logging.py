@@ -0,0 +1,113 @@
+"""日志基准：比较同步写入和队列异步写入时调用方的单次日志耗时、吞吐和丢弃数
+
+控制台写入用每次写入固定延迟的流模拟（Windows 控制台每次写入通常需要零点几毫秒）。
+每 WARNING_EVERY 条中有一条 WARNING，队列满时只丢弃 INFO，WARNING 应全部写入文件。
+
+运行: python -m benchmarks.bench_logging --records 20000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from src.utils import log
+from src.utils.log import setup_logging, stop_logging
+from src.utils.metrics import metrics
+
+from .common import CONTACTS, GREETINGS, percentile
+
+WARNING_EVERY = 100
+
+
+class SlowStream:
+    """每次写入耗时 latency 秒的输出流"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.writes = 0
+
+    def write(self, text: str):
+        self.writes += 1
+        time.sleep(self.latency)
+
+    def flush(self):
+        pass
+
+
+def emit(records: int):
+    """按扫描循环中常见的日志产生 records 条记录，返回每次调用的耗时(秒)"""
+    samples = []
+    for i in range(records):
+        contact = CONTACTS[i % len(CONTACTS)]
+        message = GREETINGS[i % len(GREETINGS)]
+        start = time.perf_counter()
+        if i % WARNING_EVERY == WARNING_EVERY - 1:
+            logging.warning("发送回复失败，联系人: %s", contact)
+        elif i % 3 == 0:
+            logging.info("发现新消息，联系人: %s", contact)
+        elif i % 3 == 1:
+            logging.info("LLM判断结果 - 消息：%s - 清理后的结果：%s", message, '是')
+        else:
+            logging.info("跳过 %s 的消息（还需等待 %s 秒）", contact, i % 60)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_mode(args, directory: str, name: str, async_mode: bool, json_format: bool = False):
+    stream = SlowStream(args.console_latency)
+    path = os.path.join(directory, f"{name}.log")
+    metrics.reset()
+    setup_logging(async_mode=async_mode, path=path, json_format=json_format, stream=stream)
+    queue_handler = next((h for h in logging.getLogger().handlers if isinstance(h, log.AsyncQueueHandler)), None)
+    start = time.perf_counter()
+    samples = emit(args.records)
+    emitted = time.perf_counter() - start
+    stop_logging()
+    total = time.perf_counter() - start
+    dropped = queue_handler.dropped if queue_handler else 0
+    with open(path, encoding='utf-8') as f:
+        warnings = sum(1 for line in f if 'WARNING' in line)
+    print(f"{name:<12}{percentile(samples, 50) * 1e6:>10.1f}{percentile(samples, 99) * 1e6:>10.1f}"
+          f"{args.records / emitted:>14.0f}{(args.records - dropped) / total:>14.0f}{dropped:>8}"
+          f"{warnings:>6}/{args.records // WARNING_EVERY:<6}{os.path.getsize(path) / args.records:>6.0f}")
+    return metrics.counter('log_records_dropped')
+
+
+def lazy_overhead(records: int):
+    """级别被过滤的 DEBUG 日志：f-string 先格式化 vs 延迟格式化"""
+    logging.getLogger().setLevel(logging.INFO)
+    messages = GREETINGS * 2
+    start = time.perf_counter()
+    for i in range(records):
+        logging.debug(f"批量判断 {len(messages)} 条消息：{messages}")
+    eager = (time.perf_counter() - start) / records
+    start = time.perf_counter()
+    for i in range(records):
+        logging.debug("批量判断 %s 条消息：%s", len(messages), messages)
+    lazy = (time.perf_counter() - start) / records
+    print(f"被过滤的DEBUG日志: f-string {eager * 1e6:.2f} 微秒/次，延迟格式化 {lazy * 1e6:.2f} 微秒/次")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=20000, help='每种模式写入的日志条数')
+    parser.add_argument('--console-latency', type=float, default=0.0003, help='模拟控制台每次写入的耗时(秒)')
+    args = parser.parse_args()
+
+    print(f"{'模式':<10}{'p50(us)':>10}{'p99(us)':>10}{'调用方(条/秒)':>11}{'写完(条/秒)':>11}{'丢弃':>6}"
+          f"{'WARNING':>10}{'字节/条':>6}")
+    dropped = {}
+    with tempfile.TemporaryDirectory() as directory:
+        dropped['sync'] = run_mode(args, directory, 'sync', async_mode=False)
+        dropped['async'] = run_mode(args, directory, 'async', async_mode=True)
+        dropped['async-json'] = run_mode(args, directory, 'async-json', async_mode=True, json_format=True)
+        setup_logging(async_mode=False, path=None, stream=SlowStream(0))
+        lazy_overhead(args.records)
+        stop_logging()
+    print(f"log_records_dropped: {', '.join(f'{name}={count:g}' for name, count in dropped.items())}"
+          f"（队列上限 {log.LOG_QUEUE_SIZE} 条）")
+
+
+if __name__ == '__main__':
+    main()
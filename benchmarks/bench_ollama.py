@@ -0,0 +1,99 @@
+"""Ollama客户端基准：在本地桩HTTP服务上测量预加载、连接复用、超时和熔断的效果
+
+运行: python -m benchmarks.bench_ollama
+"""
+import argparse
+import time
+
+from src.services.classification_cache import ClassificationCache
+from src.services.llm_service import LLMService
+from src.services.ollama_client import CircuitBreaker, OllamaClient
+from src.simulator.stub_llm import StubLLMClient
+from src.simulator.stub_ollama_server import StubOllamaServer
+
+from .common import expected_failures, quiet_logging
+
+MODEL = 'deepseek-r1:8b'
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception:
+        pass
+    return time.perf_counter() - start
+
+
+def first_call(load_time: float, warm: bool) -> float:
+    """模型未加载时第一条消息的耗时"""
+    with StubOllamaServer(load_time=load_time) as server:
+        client = OllamaClient(server.url)
+        if warm:
+            client.warm_up([MODEL])
+        elapsed = timed(lambda: client.generate(MODEL, '你好'))
+        client.close()
+        return elapsed
+
+
+def sequential_calls(calls: int, pool_size: int):
+    """连续调用的平均耗时和服务端建立的连接数"""
+    llm = StubLLMClient(prompt_latency=0, token_interval=0, think_tokens=0, tail_tokens=0)
+    with StubOllamaServer(llm) as server:
+        client = OllamaClient(server.url, pool_size=pool_size)
+        elapsed = sum(timed(lambda: client.generate(MODEL, '你好')) for _ in range(calls))
+        client.close()
+        return elapsed / calls, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--load-time', type=float, default=2.0, help='桩服务加载模型的耗时(秒)')
+    parser.add_argument('--calls', type=int, default=200, help='测量连接复用的调用次数')
+    parser.add_argument('--timeout', type=float, default=0.5, help='卡死场景下单次调用的截止时间(秒)')
+    args = parser.parse_args()
+
+    quiet_logging()
+    print(f"空闲后第一条消息: 未预加载 {first_call(args.load_time, False):.2f} 秒，"
+          f"预加载后 {first_call(args.load_time, True):.2f} 秒")
+
+    for pool_size in (0, 4):
+        latency, connections = sequential_calls(args.calls, pool_size)
+        print(f"连接池大小 {pool_size}: 平均 {latency * 1000:.2f} 毫秒/次，建立连接 {connections} 个")
+
+    with expected_failures(), StubOllamaServer() as server:
+        client = OllamaClient(server.url, timeout=args.timeout,
+                              breaker=CircuitBreaker(failure_threshold=3, reset_timeout=1))
+        service = LLMService(client, ClassificationCache(path=None))
+        server.hang = True
+        hung = [timed(lambda: client.generate(MODEL, '你好')) for _ in range(3)]
+        print(f"服务卡死: 前3次调用各 {', '.join(f'{t:.2f}' for t in hung)} 秒后超时，熔断状态: {client.breaker.state}")
+        start = time.perf_counter()
+        reply = service.generate_greeting_reply('心想事成')
+        print(f"熔断期间生成回复: {(time.perf_counter() - start) * 1e6:.0f} 微秒，返回兜底回复: {reply}")
+        server.hang = False
+        time.sleep(1)
+        reply = service.generate_greeting_reply('心想事成')
+        print(f"服务恢复后试探请求成功，熔断状态: {client.breaker.state}，回复: {reply}")
+        client.close()
+
+        # 调用方按剩余时间预算传入更短的超时：超时只说明预算不够，不应熔断
+        client = OllamaClient(server.url, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=1))
+        server.hang = True
+        for _ in range(3):
+            timed(lambda: client.generate(MODEL, '你好', timeout=args.timeout))
+        print(f"时间预算不足导致的超时 3 次，熔断状态: {client.breaker.state}")
+        server.hang = False
+        client.close()
+
+    server = StubOllamaServer().start()
+    url = server.url
+    server.stop()
+    client = OllamaClient(url)
+    with expected_failures():
+        down = [timed(lambda: client.generate(MODEL, '你好')) for _ in range(5)]
+    print(f"服务未启动: 每次调用 {', '.join(f'{t * 1000:.1f}' for t in down)} 毫秒，熔断状态: {client.breaker.state}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""规则匹配基准：比较逐条 any(x in s) 扫描与编译后的规则索引在不同规则数下的耗时
+
+运行: python -m benchmarks.bench_rules --sizes 20 1000 5000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from src.handlers.rule_index import BUILTIN_RULE_SETS, EXACT, NEW_YEAR, RuleIndex
+
+from .common import CONTACTS, GREETINGS, OTHER_MESSAGES, quiet_logging
+
+CHARS = '的一是不了人我在有他这中大来上国个到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可她里后小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已老从动两长知民样现'
+
+
+def list_scan(rule_sets, text):
+    """原来的写法：每个规则集逐条判断"""
+    labels = set()
+    for label, (match, patterns) in rule_sets.items():
+        if match == EXACT:
+            if text in patterns:
+                labels.add(label)
+        elif any(pattern in text for pattern in patterns):
+            labels.add(label)
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 100, 1000, 5000], help='每个规则集追加的用户规则数')
+    parser.add_argument('--repeats', type=int, default=2000, help='每种方式的匹配次数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    quiet_logging()
+    rng = random.Random(args.seed)
+    texts = CONTACTS + GREETINGS + OTHER_MESSAGES
+    print(f"{'规则数':>8}{'逐条扫描(微秒)':>16}{'规则索引(微秒)':>16}{'编译(毫秒)':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'rules.json')
+        for size in args.sizes:
+            user_rules = {
+                label: [''.join(rng.choice(CHARS) for _ in range(rng.randint(2, 6))) for _ in range(size)]
+                for label in BUILTIN_RULE_SETS
+            }
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(user_rules, f, ensure_ascii=False)
+            rule_sets = {label: (match, list(patterns) + user_rules[label])
+                         for label, (match, patterns) in BUILTIN_RULE_SETS.items()}
+
+            start = time.perf_counter()
+            index = RuleIndex(path)
+            compile_time = time.perf_counter() - start
+            for text in texts:
+                assert index.labels(text) == list_scan(rule_sets, text), text
+
+            start = time.perf_counter()
+            for i in range(args.repeats):
+                list_scan(rule_sets, texts[i % len(texts)])
+            scan_time = (time.perf_counter() - start) / args.repeats
+
+            start = time.perf_counter()
+            for i in range(args.repeats):
+                index.labels(texts[i % len(texts)])
+            index_time = (time.perf_counter() - start) / args.repeats
+
+            total = sum(len(patterns) for _, patterns in rule_sets.values())
+            print(f"{total:>8}{scan_time * 1e6:>16.1f}{index_time * 1e6:>16.1f}{compile_time * 1000:>12.1f}")
+
+        # 热加载：修改规则文件后，下一次检查时生效
+        index = RuleIndex(path, reload_interval=0)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({NEW_YEAR: ['蛇来运转']}, f, ensure_ascii=False)
+        os.utime(path, (time.time() + 1, time.time() + 1))
+        print(f"热加载后 '蛇来运转' 命中: {sorted(index.labels('蛇来运转'))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""会话列表扫描基准：比较批量读取与逐项读取在不同会话数下的扫描耗时
+
+运行: python -m benchmarks.bench_scan --sizes 10 100 500
+"""
+import argparse
+
+from src.simulator.fake_wechat import FakeUIBackend
+
+from .common import CONTACTS, build_bot, quiet_logging
+
+
+def scan_time(size: int, batch: bool, scale: float, unread: int) -> float:
+    bot, wechat, _ = build_bot(scale)
+    bot.ui_automation.backend = bot.backend = FakeUIBackend(wechat, batch=batch)
+    for i in range(size):
+        wechat.add_contact(f"{CONTACTS[i % len(CONTACTS)]}{'甲乙丙丁戊己庚辛壬癸'[i // len(CONTACTS) % 10]}")
+    for i in range(unread):
+        wechat.schedule_message(0, f"{CONTACTS[i]}甲", '新年快乐')
+    window = bot.ui_automation.find_all_wechat_windows()[0]
+    bot.ui_automation.find_chat_list_panel(window)
+
+    start = bot.clock.monotonic()
+    pending = bot.collect_pending_conversations(window)
+    elapsed = bot.clock.monotonic() - start
+    assert len(pending) == min(unread, size)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 200, 500], help='会话列表长度')
+    parser.add_argument('--unread', type=int, default=5, help='有新消息的会话数')
+    parser.add_argument('--scale', type=float, default=10, help='模拟时钟加速倍数')
+    args = parser.parse_args()
+
+    quiet_logging()
+    print(f"{'会话数':>8}{'逐项读取(s)':>14}{'批量读取(s)':>14}")
+    for size in args.sizes:
+        per_item = scan_time(size, False, args.scale, args.unread)
+        batched = scan_time(size, True, args.scale, args.unread)
+        print(f"{size:>8}{per_item:>14.3f}{batched:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""回复状态存储基准：数据库中有大量记录时的启动、查询、写入和过期清理耗时
+
+运行: python -m benchmarks.bench_state --entries 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from src.services.reply_state import ReplyStateStore
+from src.utils.clock import Clock
+
+from .common import CONTACTS, GREETINGS, quiet_logging
+
+
+def populate(path: str, entries: int, ttl: float, clock: Clock):
+    """直接写入 entries 条已处理记录，其中一半已过期"""
+    store = ReplyStateStore(path, ttl=ttl, clock=clock)
+    now = clock.time()
+    rows = ((i - entries // 2, now - ttl * 2 if i % 2 else now) for i in range(entries))
+    store._db.execute('BEGIN')
+    store._db.executemany('INSERT OR REPLACE INTO handled (hash, handled_at) VALUES (?, ?)', rows)
+    store._db.executemany('INSERT OR REPLACE INTO replies (contact, replied_at) VALUES (?, ?)',
+                          ((f"联系人{i}", now) for i in range(min(entries, 100000))))
+    store._db.execute('COMMIT')
+    store.close()
+
+
+def per_call(func, repeats: int) -> float:
+    start = time.perf_counter()
+    for i in range(repeats):
+        func(i)
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=1000000, help='数据库中的已处理消息记录数')
+    parser.add_argument('--repeats', type=int, default=10000, help='每项测量的重复次数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    quiet_logging()
+    rng = random.Random(args.seed)
+    clock = Clock()
+    ttl = 24 * 3600
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'reply_state.db')
+        start = time.perf_counter()
+        populate(path, args.entries, ttl, clock)
+        print(f"写入 {args.entries} 条记录: {time.perf_counter() - start:.1f} 秒，"
+              f"数据库 {os.path.getsize(path) / 1e6:.1f} MB")
+
+        start = time.perf_counter()
+        store = ReplyStateStore(path, ttl=ttl, clock=clock)
+        print(f"启动(打开数据库): {(time.perf_counter() - start) * 1000:.1f} 毫秒")
+
+        messages = [(rng.choice(CONTACTS), f"{rng.choice(GREETINGS)}{i}") for i in range(args.repeats)]
+        cold = per_call(lambda i: store.unhandled(messages[i][0], [messages[i][1]]), args.repeats)
+        hot = per_call(lambda i: store.unhandled(messages[i][0], [messages[i][1]]), args.repeats)
+        mark = per_call(lambda i: store.mark_handled(messages[i][0], [messages[i][1]]), args.repeats)
+        reply = per_call(lambda i: store.last_reply_time(f"联系人{i}"), args.repeats)
+        print(f"查询消息是否已处理: 冷 {cold * 1e6:.1f} 微秒/次，热 {hot * 1e6:.1f} 微秒/次")
+        print(f"记录已处理消息: {mark * 1e6:.1f} 微秒/次，查询最后回复时间(冷): {reply * 1e6:.1f} 微秒/次")
+        done = all(not store.unhandled(contact, [text]) for contact, text in messages[:100])
+        print(f"已记录的消息再次查询均视为已处理: {done}")
+
+        start = time.perf_counter()
+        removed = store.evict_expired()
+        print(f"清理过期记录 {removed} 条: {time.perf_counter() - start:.1f} 秒")
+        print(f"统计: {store.stats()}")
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
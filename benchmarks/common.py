@@ -0,0 +1,187 @@
+import contextlib
+import functools
+import io
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from src import WeChatAutoReply
+from src.services.classification_cache import ClassificationCache
+from src.services.image_greeting import ImageVerdictCache
+from src.services.reply_state import ReplyStateStore
+from src.simulator.fake_wechat import FakeUIBackend, FakeWeChat
+from src.simulator.stub_llm import StubLLMClient
+from src.utils.clock import Clock
+from src.utils.metrics import metrics
+
+CONTACTS = [
+    f"{surname}{given}"
+    for surname in '张王李赵刘陈杨黄周吴'
+    for given in ('伟', '芳', '娜', '敏', '静', '强', '磊', '洋', '艳', '勇')
+]
+
+GREETINGS = [
+    '新年快乐！', '祝您蛇年大吉', '恭喜发财，红包拿来', '春节快乐，万事如意',
+    '心想事成，阖家安康', '给您拜年啦', '蛇年行大运', '祝福您和家人平安喜乐',
+]
+
+OTHER_MESSAGES = ['在吗', '收到', 'ok', '[动画表情]', '明天开会吗', '好的', '[图片]', '哈哈']
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class StageRecorder:
+    """记录各阶段耗时(模拟时钟下的秒数)"""
+
+    def __init__(self, clock: Clock):
+        self.clock = clock
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def wrap(self, owner, attr: str, stage: Optional[str] = None):
+        """用计时包装 owner 上的方法"""
+        func = getattr(owner, attr)
+        stage = stage or attr
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = self.clock.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples[stage].append(self.clock.monotonic() - start)
+
+        setattr(owner, attr, timed)
+
+    def report(self, extra: Optional[Dict[str, List[float]]] = None) -> List[str]:
+        lines = [f"{'阶段':<16}{'次数':>8}{'p50(s)':>10}{'p99(s)':>10}"]
+        for stage, values in {**self.samples, **(extra or {})}.items():
+            values = list(values)
+            lines.append(f"{stage:<16}{len(values):>8}{percentile(values, 50):>10.3f}{percentile(values, 99):>10.3f}")
+        return lines
+
+
+def instrument(bot: WeChatAutoReply, recorder: StageRecorder):
+    """为机器人的各个阶段加上计时"""
+    recorder.wrap(bot.ui_automation, 'find_all_wechat_windows', 'find_windows')
+    recorder.wrap(bot, 'switch_to_next_window', 'switch_window')
+    recorder.wrap(bot.ui_automation, 'find_chat_list_panel', 'find_panel')
+    recorder.wrap(bot, 'check_new_message', 'scan')
+    recorder.wrap(bot, 'click_chat_item', 'click')
+    recorder.wrap(bot.ui_automation, 'get_unread_messages', 'read')
+    recorder.wrap(bot.llm_service, 'classify_messages', 'classify')
+    recorder.wrap(bot.llm_service, 'generate_greeting_reply', 'generate')
+    recorder.wrap(bot, 'send_auto_reply', 'send')
+    recorder.wrap(bot, 'dispatch_new_messages', 'dispatch')
+    recorder.wrap(bot, 'deliver_reply', 'deliver')
+    recorder.wrap(bot, 'type_and_send', 'type')
+    recorder.wrap(bot, 'compose_reply', 'compose')
+    if bot.pipeline:
+        bot.pipeline.deliver = bot.deliver_reply
+        bot.pipeline.compose_reply = bot.compose_reply
+
+
+def schedule_burst(wechat: FakeWeChat, count: int, duration: float, greeting_ratio: float = 0.8,
+                   seed: int = 0, start: float = 0, contacts: Optional[int] = None) -> Tuple[int, int]:
+    """在 start 秒之后的 duration 秒内随机投递 count 条消息，分给 contacts 个联系人（默认每人一条）
+
+    返回 (拜年消息数, 收到拜年消息的会话数)。
+    """
+    rng = random.Random(seed)
+    contacts = min(contacts or count, len(CONTACTS))
+    greetings = 0
+    greeted = set()
+    for i in range(count):
+        contact = CONTACTS[i % contacts]
+        window_index = i % contacts % len(wechat.windows)
+        if rng.random() < greeting_ratio:
+            text = rng.choice(GREETINGS)
+            greetings += 1
+            greeted.add((window_index, contact))
+        else:
+            text = rng.choice(OTHER_MESSAGES)
+        wechat.schedule_message(start + rng.uniform(0, duration), contact, text, window_index)
+    return greetings, len(greeted)
+
+
+def build_bot(scale: float = 20.0, windows: int = 1, latency: Optional[dict] = None, **llm_options):
+    """创建连接到模拟器和桩模型的机器人"""
+    clock = Clock(scale)
+    wechat = FakeWeChat(clock, window_count=windows, latency=latency)
+    llm = StubLLMClient(clock, **llm_options)
+    bot = WeChatAutoReply(ui_backend=FakeUIBackend(wechat), llm_client=llm, clock=clock,
+                          reply_state=ReplyStateStore(path=None, clock=clock))
+    bot.llm_service.classification_cache = ClassificationCache(path=None, clock=clock)
+    if bot.llm_service.image_detector:
+        bot.llm_service.image_detector.cache = ImageVerdictCache(path=None, clock=clock)
+    bot.metrics_exporter = None
+    metrics.reset()
+    return bot, wechat, llm
+
+
+def run_bot(bot: WeChatAutoReply, wechat: FakeWeChat, expected_replies: int, max_seconds: float) -> float:
+    """运行 start() 直到发出至少 expected_replies 条回复且所有消息都已处理，或超过 max_seconds(模拟秒)，返回运行时长"""
+    clock = bot.clock
+    start = clock.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        thread = threading.Thread(target=bot.start, daemon=True)
+        thread.start()
+        while clock.time() - start < max_seconds:
+            if (len(wechat.sent) >= expected_replies and not wechat.pending_arrivals()
+                    and not wechat.unread_conversations() and not (bot.pipeline and bot.pipeline.in_flight())):
+                break
+            time.sleep(0.01)
+        bot.running = False
+        thread.join(timeout=60)
+    return clock.time() - start
+
+
+def reply_latencies(wechat: FakeWeChat) -> List[float]:
+    """每条回复相对于对应联系人最早未回复消息的端到端延迟"""
+    latencies = []
+    waiting: Dict[tuple, List[float]] = defaultdict(list)
+    events = [(a.time, 0, a) for a in wechat.arrivals] + [(s.time, 1, s) for s in wechat.sent]
+    for _, kind, record in sorted(events, key=lambda e: (e[0], e[1])):
+        key = (record.window_index, record.contact)
+        if kind == 0:
+            waiting[key].append(record.time)
+        elif waiting[key]:
+            latencies.append(record.time - waiting[key][0])
+            waiting[key].clear()
+    return latencies
+
+
+def unanswered_greetings(wechat: FakeWeChat) -> int:
+    """之后没有收到任何回复的拜年消息数"""
+    return sum(
+        1 for a in wechat.arrivals
+        if a.text in GREETINGS and not any(
+            s.window_index == a.window_index and s.contact == a.contact and s.time >= a.time for s in wechat.sent)
+    )
+
+
+def quiet_logging():
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+@contextlib.contextmanager
+def expected_failures():
+    """模拟故障的场景中屏蔽预期会出现的告警和错误日志，只输出基准结果"""
+    root = logging.getLogger()
+    level = root.level
+    root.setLevel(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        root.setLevel(level)
@@ -1,4 +1,4 @@
 from .wechat_auto_reply import WeChatAutoReply
-from .utils.config import setup_logging
+from .utils.log import setup_logging
 
 __all__ = ['WeChatAutoReply', 'setup_logging'] 
\ No newline at end of file
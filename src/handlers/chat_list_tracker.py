@@ -0,0 +1,53 @@
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+
+from .message_handler import MessageHandler
+
+
+@dataclass(frozen=True)
+class ChatEntry:
+    contact_name: str
+    unread_count: int
+    item_name: str
+
+
+class ChatListTracker:
+    """按窗口保存会话列表快照，每次扫描只给出发生变化的会话
+
+    有意跳过的未读会话项（特殊账号、未到回复间隔等）记为已搁置，不再算作待处理，
+    直到会话项名称变化（有新消息）或搁置到期。
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[int, Dict[str, ChatEntry]] = {}
+        self._settled: Dict[int, Dict[str, Optional[float]]] = {}  # 会话项名称 -> 搁置到期时间，None 表示直到名称变化
+
+    def update(self, window_handle: int, item_names: Iterable[str]) -> List[ChatEntry]:
+        """用最新的会话项名称更新快照，返回新增或变化的会话"""
+        previous = self._snapshots.get(window_handle, {})
+        current = {}
+        changed = []
+        for item_name in item_names:
+            entry = previous.get(item_name)
+            if entry is None:
+                # 名称没变的会话项直接沿用上次的解析结果
+                contact_name, _ = MessageHandler.parse_contact_info(item_name)
+                entry = ChatEntry(contact_name, MessageHandler.parse_unread_count(item_name), item_name)
+                changed.append(entry)
+            current[item_name] = entry
+        self._snapshots[window_handle] = current
+        settled = self._settled.get(window_handle, {})
+        self._settled[window_handle] = {name: until for name, until in settled.items() if name in current}
+        return changed
+
+    def settle(self, window_handle: int, item_name: str, until: Optional[float] = None):
+        """有意跳过的未读会话项，until 为重新处理的时间点"""
+        self._settled.setdefault(window_handle, {})[item_name] = until
+
+    def pending(self, window_handle: int, now: float) -> Set[str]:
+        """快照中仍待处理的未读会话项名称（不含搁置中的）"""
+        settled = self._settled.get(window_handle, {})
+        return {
+            name for name, entry in self._snapshots.get(window_handle, {}).items()
+            if entry.unread_count and (name not in settled or settled[name] is not None and settled[name] <= now)
+        }
@@ -0,0 +1,50 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from ..utils.config import VIP_CONTACTS, PRIORITY_WEIGHTS
+
+
+@dataclass
+class PendingConversation:
+    item: Any
+    contact_name: str
+    unread_count: int
+    wait_seconds: float = 0.0
+    score: float = 0.0
+
+
+class ConversationRanker:
+    """按未读数、VIP名单和等待时间对待处理会话排序
+
+    等待时间按 (窗口, 联系人) 记录，各窗口分别排序时互不影响。
+    """
+
+    def __init__(self, vip_contacts: Iterable[str] = VIP_CONTACTS, weights: Optional[Dict[str, float]] = None):
+        self.vip_contacts = set(vip_contacts)
+        self.weights = {**PRIORITY_WEIGHTS, **(weights or {})}
+        self.pending_since: Dict[Tuple[Hashable, str], float] = {}
+
+    def rank(self, conversations: List[PendingConversation], now: float,
+             window: Hashable = None) -> List[PendingConversation]:
+        """计算优先级并从高到低排序，同时记录每个会话首次出现的时间
+
+        conversations 为窗口 window（如窗口句柄）中的全部待处理会话，只清除该窗口中已不在列表里的记录。
+        """
+        current = {(window, c.contact_name) for c in conversations}
+        for key in list(self.pending_since):
+            if key[0] == window and key not in current:
+                del self.pending_since[key]
+
+        for conversation in conversations:
+            since = self.pending_since.setdefault((window, conversation.contact_name), now)
+            conversation.wait_seconds = now - since
+            conversation.score = (
+                self.weights['unread'] * conversation.unread_count
+                + self.weights['vip'] * (conversation.contact_name in self.vip_contacts)
+                + self.weights['wait'] * conversation.wait_seconds
+            )
+        return sorted(conversations, key=lambda c: c.score, reverse=True)
+
+    def forget(self, contact_name: str, window: Hashable = None):
+        """会话已处理，清除等待记录"""
+        self.pending_since.pop((window, contact_name), None)
@@ -1,36 +1,40 @@
 from typing import Optional, Tuple
 import logging
-from ..utils.config import SPECIAL_ACCOUNTS
+from .rule_index import RuleIndex, SPECIAL_ACCOUNT, GROUP_NAME, GROUP_MESSAGE
 
 class MessageHandler:
-    @staticmethod
-    def is_special_account(item_name: str) -> bool:
+    def __init__(self, rules: Optional[RuleIndex] = None):
+        self.rules = rules if rules is not None else RuleIndex()
+
+    def is_special_account(self, contact_name: str) -> bool:
         """判断是否为特殊账号"""
-        return item_name in SPECIAL_ACCOUNTS
+        return self.rules.matches(contact_name, SPECIAL_ACCOUNT)
 
-    @staticmethod
-    def is_group_chat(item_name: str, item_value: str) -> bool:
+    def is_group_chat(self, item_name: str, item_value: str) -> bool:
         """判断是否为群聊"""
         if not item_name:
             return False
-            
-        group_indicators = [
-            '群聊', '群', '交流群', '讨论组', '社群',
-            '商会', '协会', '班级', '支部', '联盟',
-            '内购群', '粉丝群'
-        ]
         
-        message_indicators = [
-            '个成员', '[群消息]', '条]', '消息免打扰'
-        ]
-        
-        is_group_by_name = any(indicator in item_name for indicator in group_indicators)
+        is_group_by_name = self.rules.matches(item_name, GROUP_NAME)
         is_group_by_value = False
         if item_value:
-            is_group_by_value = any(indicator in item_value for indicator in message_indicators)
+            is_group_by_value = self.rules.matches(item_value, GROUP_MESSAGE)
         
         return is_group_by_name or is_group_by_value
 
+    @staticmethod
+    def parse_unread_count(item_name: str) -> int:
+        """解析未读消息数，没有新消息时返回0"""
+        if "条新消息" not in item_name:
+            return 0
+        name_parts = item_name.replace("已置顶", "").split("条新消息")[0]
+        digits = ''
+        for char in reversed(name_parts.strip()):
+            if not char.isdigit():
+                break
+            digits = char + digits
+        return int(digits) if digits else 1
+
     @staticmethod
     def parse_contact_info(item_name: str) -> Tuple[str, bool]:
         """解析联系人信息"""
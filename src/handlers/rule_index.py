@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ..utils.clock import Clock
+from ..utils.config import (SPECIAL_ACCOUNTS, GROUP_NAME_INDICATORS, GROUP_MESSAGE_INDICATORS,
+                            NEW_YEAR_KEYWORDS, RULES_PATH, RULES_RELOAD_INTERVAL)
+
+SPECIAL_ACCOUNT = 'special_account'
+GROUP_NAME = 'group_name'
+GROUP_MESSAGE = 'group_message'
+NEW_YEAR = 'new_year'
+
+EXACT = 'exact'        # 整个文本与规则相同才命中
+CONTAINS = 'contains'  # 文本包含规则即命中
+
+# 内置规则集：名称 -> (匹配方式, 规则列表)
+BUILTIN_RULE_SETS = {
+    SPECIAL_ACCOUNT: (EXACT, SPECIAL_ACCOUNTS),
+    GROUP_NAME: (CONTAINS, GROUP_NAME_INDICATORS),
+    GROUP_MESSAGE: (CONTAINS, GROUP_MESSAGE_INDICATORS),
+    NEW_YEAR: (CONTAINS, NEW_YEAR_KEYWORDS),
+}
+
+
+class Automaton:
+    """Aho-Corasick 多模式匹配：一次扫描文本得到所有命中的规则集"""
+
+    def __init__(self, rules: Iterable[Tuple[str, str, bool]]):
+        """rules 为 (规则, 规则集名称, 是否整体匹配)"""
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[Tuple[int, str, bool]]] = [[]]
+        self.size = 0
+        for pattern, label, exact in rules:
+            if pattern:
+                self._add(pattern, label, exact)
+        self._build()
+
+    def _add(self, pattern: str, label: str, exact: bool):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append((len(pattern), label, exact))
+        self.size += 1
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def search(self, text: str) -> Set[str]:
+        """返回文本命中的规则集名称"""
+        labels = set()
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        length = len(text)
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_length, label, exact in output[state]:
+                if not exact or (pattern_length == length and index == length - 1):
+                    labels.add(label)
+        return labels
+
+
+class RuleIndex:
+    """由 config.py 的内置规则和用户规则文件编译成的规则索引
+
+    规则文件修改后会在下一次匹配时重新编译（最多每 reload_interval 秒检查一次），无需重启。
+    规则文件的格式为 {"规则集名称": ["规则", ...]} 或 {"规则集名称": {"match": "exact", "rules": [...]}}，
+    与内置规则集同名时追加到内置规则中。
+    """
+
+    def __init__(self, path: Optional[str] = RULES_PATH, reload_interval: float = RULES_RELOAD_INTERVAL,
+                 clock: Optional[Clock] = None):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.clock = clock or Clock()
+        self._mtime: Optional[float] = None
+        self._checked_at = self.clock.monotonic()
+        self._reload_lock = threading.Lock()
+        self._automaton = Automaton(self._collect_rules({}))
+        if self.path and os.path.exists(self.path):
+            self.reload()
+
+    def labels(self, text: str) -> Set[str]:
+        """文本命中的所有规则集"""
+        self._maybe_reload()
+        return self._automaton.search(text) if text else set()
+
+    def matches(self, text: str, label: str) -> bool:
+        return label in self.labels(text)
+
+    def reload(self) -> bool:
+        """重新读取规则文件并编译，读取失败时保留原有规则"""
+        try:
+            user_rules = self._load_user_rules()
+        except Exception as e:
+            logging.error(f"加载规则文件失败，继续使用原有规则: {str(e)}")
+            return False
+        self._automaton = Automaton(self._collect_rules(user_rules))
+        logging.info(f"规则已重新加载，共 {self._automaton.size} 条")
+        return True
+
+    def _maybe_reload(self):
+        if not self.path or self.clock.monotonic() - self._checked_at < self.reload_interval:
+            return
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = self.clock.monotonic()
+            mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+            if mtime != self._mtime:
+                self.reload()
+        finally:
+            self._reload_lock.release()
+
+    def _load_user_rules(self) -> Dict[str, Tuple[str, List[str]]]:
+        if not self.path or not os.path.exists(self.path):
+            self._mtime = None
+            return {}
+        self._mtime = os.path.getmtime(self.path)
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        user_rules = {}
+        for label, entry in data.items():
+            if isinstance(entry, dict):
+                match, rules = entry.get('match'), entry.get('rules', [])
+            else:
+                match, rules = None, entry
+            match = match or BUILTIN_RULE_SETS.get(label, (CONTAINS,))[0]
+            if match not in (EXACT, CONTAINS):
+                raise ValueError(f"规则集 {label} 的匹配方式无效: {match}")
+            user_rules[label] = (match, [str(rule) for rule in rules])
+        return user_rules
+
+    @staticmethod
+    def _collect_rules(user_rules: Dict[str, Tuple[str, List[str]]]) -> List[Tuple[str, str, bool]]:
+        rules = []
+        for label, (match, patterns) in BUILTIN_RULE_SETS.items():
+            rules.extend((pattern, label, match == EXACT) for pattern in patterns)
+        for label, (match, patterns) in user_rules.items():
+            rules.extend((pattern, label, match == EXACT) for pattern in patterns)
+        return rules
@@ -0,0 +1,365 @@
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from concurrent.futures import Future, wait
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .utils.config import CLASSIFY_BATCH_SIZE, IMAGE_RETRIES, IMAGE_RETRY_INTERVAL, PIPELINE_SHUTDOWN_TIMEOUT
+from .utils.metrics import metrics
+
+WORKER_POLL_INTERVAL = 0.05  # 工作线程检查待生成队列的间隔(秒)
+
+
+@dataclass
+class ReplyJob:
+    window: Any
+    contact_name: str
+    messages: List[str]   # 会话中的未读消息，按收到的先后排列
+    created_at: float
+    deadline: Optional[float] = None  # 回复应在此时间前生成完毕，None 表示不限
+    greetings: Optional[List[str]] = None  # 判定为拜年信息的消息
+    reply: Optional[str] = None
+    followup: Optional[List[str]] = None  # 发送回复时读到的、生成期间新到的消息
+    account: Optional[str] = None  # 窗口登录的微信账号，区分不同账号下的同名联系人
+    image_retries: int = 0  # 图片未能交给视觉模型而重新提交的次数
+
+    @property
+    def key(self) -> Tuple[Optional[str], str]:
+        return self.account, self.contact_name
+
+
+class ReplyPipeline:
+    """检测 → 分类/生成 → 发送 流水线
+
+    扫描和读取消息在UI线程完成后通过 submit 提交；工作线程负责拜年判断和生成回复，
+    结果进入发送队列，由UI线程调用 drain_sends 逐个发送。所有队列都有上限 queue_size，
+    待处理任务或等待图片的会话已满时 submit 返回 False，UI线程暂停打开新的会话；
+    待生成队列已满时工作线程直接生成，不再取新的任务。
+    发送时读到生成期间新到的消息，重新提交给流水线处理。
+    工作线程取任务时一并取出队列中已在等待的其他会话（最多 batch_size 个），合并成一次批量判断；
+    判定为拜年信息的会话放入待生成队列，由空闲的工作线程分别生成回复。
+    含图片的会话在视觉模型判断期间暂放一边，不占用工作线程，图片都有结果或超时后再判断。
+    判断时视觉模型仍未完成、且没有其他拜年信息的会话不记为已处理，继续等待这些图片的结果，
+    判定为拜年图片时照常生成回复（不再受截止时间限制）；图片未能交给视觉模型（排队已满等）时
+    隔 IMAGE_RETRY_INTERVAL 秒重新提交，最多 IMAGE_RETRIES 次，仍无结果的图片不记为已处理。
+    """
+
+    def __init__(self, llm_service, deliver, workers: int, queue_size: int, compose_reply=None,
+                 batch_size: int = CLASSIFY_BATCH_SIZE, reply_state=None,
+                 on_ready: Optional[Callable[[], None]] = None):
+        """compose_reply 为生成回复的函数，默认直接调用 llm_service.generate_greeting_reply；
+        reply_state 用于记录判定为不需要回复的消息；on_ready 在有回复进入发送队列时调用，用于唤醒UI线程"""
+        self.llm_service = llm_service
+        self.deliver = deliver
+        self.compose_reply = compose_reply or llm_service.generate_greeting_reply
+        self.work_queue: 'queue.Queue[Optional[ReplyJob]]' = queue.Queue(maxsize=queue_size)
+        self.send_queue: 'queue.Queue[ReplyJob]' = queue.Queue(maxsize=queue_size)
+        self.compose_queue: 'queue.Queue[ReplyJob]' = queue.Queue(maxsize=queue_size)
+        self.queue_size = queue_size
+        self.workers = workers
+        self.batch_size = batch_size
+        self.reply_state = reply_state
+        self.on_ready = on_ready
+        self._in_flight: Set[Tuple[Optional[str], str]] = set()
+        self._awaiting_images: List[Tuple[ReplyJob, List[Future], float]] = []
+        # 超时后仍在等待视觉模型的会话：(会话, 各图片的判断，None 表示尚未提交, 重新提交的时间)
+        self._late_images: List[Tuple[ReplyJob, Dict[str, Optional[Future]], float]] = []
+        self._followups: List[ReplyJob] = []  # 发送时读到新消息、尚未能重新提交的会话
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """启动工作线程"""
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"reply-worker-{i + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def in_flight(self) -> Set[Tuple[Optional[str], str]]:
+        """正在处理中的 (账号, 联系人)"""
+        with self._lock:
+            return set(self._in_flight)
+
+    def full(self) -> bool:
+        with self._lock:
+            images_full = max(len(self._awaiting_images), len(self._late_images)) >= self.queue_size
+        return images_full or self.work_queue.full()
+
+    def submit(self, job: ReplyJob) -> bool:
+        """提交待分类/生成的任务，队列已满或该联系人已在处理中时返回False"""
+        with self._lock:
+            if job.key in self._in_flight:
+                return False
+            try:
+                self.work_queue.put_nowait(job)
+            except queue.Full:
+                logging.info("处理队列已满，暂缓处理 %s", job.contact_name)
+                return False
+            self._in_flight.add(job.key)
+        return True
+
+    def _finish(self, job: ReplyJob):
+        with self._lock:
+            self._in_flight.discard(job.key)
+
+    def _worker(self):
+        while not self._stopping.is_set():
+            ready = self._take_image_jobs()
+            if ready:
+                self._classify_ready(ready)
+                continue
+            # 优先生成已判定的会话的回复
+            try:
+                job = self.compose_queue.get_nowait()
+            except queue.Empty:
+                try:
+                    job = self.work_queue.get(timeout=WORKER_POLL_INTERVAL)
+                except queue.Empty:
+                    continue
+                if job is None or self._stopping.is_set():
+                    break
+                self._classify([job, *self._take_waiting(self.batch_size - 1)])
+                continue
+            self._compose(job)
+
+    def _take_waiting(self, limit: int) -> List[ReplyJob]:
+        """不等待地取出队列中已有的任务"""
+        jobs = []
+        while len(jobs) < limit:
+            try:
+                job = self.work_queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # 停止信号留给其他工作线程
+                try:
+                    self.work_queue.put_nowait(None)
+                except queue.Full:
+                    pass
+                break
+            jobs.append(job)
+        return jobs
+
+    def _classify(self, jobs: List[ReplyJob]):
+        """判断一批会话的消息；图片还在等视觉模型的会话暂放一边，其余的立即判断"""
+        ready = []
+        for job in jobs:
+            futures = self.llm_service.prefetch_images(job.messages)
+            if all(future.done() for future in futures):
+                ready.append(job)
+                continue
+            until = self.llm_service.image_detector.ready_by(futures)
+            if job.deadline is not None:
+                until = min(until, job.deadline)
+            with self._lock:
+                parked = len(self._awaiting_images) < self.queue_size
+                if parked:
+                    self._awaiting_images.append((job, futures, until))
+            if not parked:
+                # 等待图片的会话已满，由本线程等待图片结果后判断
+                ready.append(job)
+        if ready:
+            self._classify_ready(ready)
+
+    def _take_image_jobs(self) -> List[ReplyJob]:
+        """取出图片都已有结果或已等到时限的会话"""
+        if self._late_images:
+            self._resolve_late_images()
+        if not self._awaiting_images:
+            return []
+        now = self.llm_service.clock.time()
+        ready, waiting = [], []
+        with self._lock:
+            for job, futures, until in self._awaiting_images:
+                if now >= until or all(future.done() for future in futures):
+                    ready.append(job)
+                else:
+                    waiting.append((job, futures, until))
+            self._awaiting_images = waiting
+        return ready
+
+    def _resolve_late_images(self):
+        """处理到了重新提交时间的、以及图片都已有结果的会话"""
+        now = self.llm_service.clock.time()
+        due, waiting = [], []
+        with self._lock:
+            for entry in self._late_images:
+                job, futures, retry_at = entry
+                if now >= retry_at and all(future is None or future.done() for future in futures.values()):
+                    due.append(entry)
+                else:
+                    waiting.append(entry)
+            self._late_images = waiting
+        for job, futures, _ in due:
+            if None in futures.values():
+                futures = dict(zip(futures, self.llm_service.prefetch_images(list(futures))))
+                self._park_late(job, futures, reserved=True)
+            else:
+                self._resolve_late_job(job, futures, reserved=True)
+
+    def _resolve_late_job(self, job: ReplyJob, futures: Dict[str, Future], reserved: bool = False):
+        """图片都有结果后：有拜年图片的会话交给生成，不是拜年的图片记为已处理，
+        未能交给视觉模型的图片稍后重新提交；reserved 表示该会话刚从等待列表中取出，重新放回时不受上限限制"""
+        verdicts = {message: self.llm_service.image_detector.verdict(future) for message, future in futures.items()}
+        job.greetings = [message for message, verdict in verdicts.items() if verdict]
+        if job.greetings:
+            logging.info("%s 的图片判断完成，判定为拜年信息，补发回复", job.contact_name)
+            metrics.inc('late_image_greetings')
+            job.deadline = None
+            self._enqueue_compose(job)
+            return
+        decided = [message for message, verdict in verdicts.items() if verdict is not None]
+        if self.reply_state and decided:
+            self.reply_state.mark_handled(job.contact_name, decided, job.account)
+        undecided = [message for message, verdict in verdicts.items() if verdict is None]
+        if undecided and job.image_retries < IMAGE_RETRIES:
+            job.image_retries += 1
+            retry_at = self.llm_service.clock.time() + IMAGE_RETRY_INTERVAL
+            if self._park_late(job, dict.fromkeys(undecided), retry_at, reserved):
+                logging.info("%s 的 %s 张图片未能交给视觉模型，%s 秒后重新提交",
+                             job.contact_name, len(undecided), IMAGE_RETRY_INTERVAL)
+                return
+        if undecided:
+            logging.info("%s 的 %s 张图片未能判断，不记为已处理", job.contact_name, len(undecided))
+            metrics.inc('image_verdicts', len(undecided), source='gave_up')
+        self._finish(job)
+
+    def _park_late(self, job: ReplyJob, futures: Dict[str, Optional[Future]], retry_at: float = 0.0,
+                   reserved: bool = False) -> bool:
+        """放入等待图片结果的列表，列表已满（且不是刚取出的会话）时返回False"""
+        with self._lock:
+            if not reserved and len(self._late_images) >= self.queue_size:
+                return False
+            self._late_images.append((job, futures, retry_at))
+        return True
+
+    def _classify_ready(self, jobs: List[ReplyJob]):
+        """判断一批会话，含拜年信息的会话放入待生成队列"""
+        for job in self._classify_group(jobs):
+            self._enqueue_compose(job)
+
+    def _enqueue_compose(self, job: ReplyJob):
+        """放入待生成队列；队列已满时由本线程直接生成"""
+        try:
+            self.compose_queue.put_nowait(job)
+        except queue.Full:
+            self._compose(job)
+
+    def _classify_group(self, jobs: List[ReplyJob]) -> List[ReplyJob]:
+        """一次批量判断多个会话的消息，返回含拜年信息的会话"""
+        messages = [message for job in jobs for message in job.messages]
+        deadlines = [job.deadline for job in jobs if job.deadline is not None]
+        try:
+            verdicts = iter(self.llm_service.classify_messages(messages, min(deadlines) if deadlines else None))
+        except Exception as e:
+            logging.error(f"批量判断 {len(jobs)} 个会话的消息时出错: {str(e)}")
+            for job in jobs:
+                self._finish(job)
+            return []
+        if len(jobs) > 1:
+            logging.info("合并判断 %s 个会话的 %s 条消息", len(jobs), len(messages))
+        greeting_jobs = []
+        for job in jobs:
+            job_verdicts = [next(verdicts) for _ in job.messages]
+            job.greetings = [message for message, verdict in zip(job.messages, job_verdicts) if verdict]
+            undecided = [message for message, verdict in zip(job.messages, job_verdicts) if verdict is None]
+            if job.greetings:
+                greeting_jobs.append(job)
+            elif undecided:
+                self._wait_late_images(job, undecided)
+            else:
+                logging.info("不是拜年信息，跳过处理: %s", job.messages)
+                metrics.inc('skipped_contacts', reason='not_greeting')
+                if self.reply_state:
+                    self.reply_state.mark_handled(job.contact_name, job.messages, job.account)
+                self._finish(job)
+        return greeting_jobs
+
+    def _wait_late_images(self, job: ReplyJob, undecided: List[str]):
+        """已判定的消息记为已处理，还没有结果的图片继续等待，期间该联系人仍算作处理中"""
+        logging.info("%s 的 %s 张图片还没有判断结果，暂不记为已处理", job.contact_name, len(undecided))
+        decided = [message for message in job.messages if message not in undecided]
+        if self.reply_state and decided:
+            self.reply_state.mark_handled(job.contact_name, decided, job.account)
+        futures = dict(zip(undecided, self.llm_service.prefetch_images(undecided)))
+        if self._park_late(job, futures):
+            return
+        # 等待结果的会话已满，由本线程等到图片有结果
+        while not self._stopping.is_set() and wait(futures.values(), timeout=WORKER_POLL_INTERVAL).not_done:
+            continue
+        if self._stopping.is_set():
+            self._finish(job)
+            return
+        self._resolve_late_job(job, futures)
+
+    def _compose(self, job: ReplyJob):
+        try:
+            # 同一会话的多条拜年信息合并回复一次
+            job.reply = self.compose_reply('\n'.join(job.greetings), job.deadline)
+            while not self._stopping.is_set():
+                try:
+                    self.send_queue.put(job, timeout=0.5)
+                    if self.on_ready:
+                        self.on_ready()
+                    break
+                except queue.Full:
+                    continue
+        except Exception as e:
+            logging.error(f"处理 {job.contact_name} 的消息时出错: {str(e)}")
+            self._finish(job)
+
+    def drain_sends(self) -> int:
+        """在UI线程中发送所有已生成的回复，返回发送数"""
+        sent = 0
+        self._submit_followups()
+        while not self._stopping.is_set():
+            try:
+                job = self.send_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if self.deliver(job):
+                    sent += 1
+            finally:
+                self._finish(job)
+            if job.followup:
+                self._followups.append(self._followup_job(job))
+                self._submit_followups()
+        return sent
+
+    def _followup_job(self, job: ReplyJob) -> ReplyJob:
+        """发送时读到的新消息作为新的任务，截止时间与原任务同样长"""
+        logging.info("%s 在生成回复期间发来 %s 条新消息，重新提交处理", job.contact_name, len(job.followup))
+        metrics.inc('delivery_followups')
+        now = self.llm_service.clock.time()
+        deadline = None if job.deadline is None else now + max(job.deadline - job.created_at, 0)
+        return ReplyJob(job.window, job.contact_name, job.followup, now, deadline, account=job.account)
+
+    def _submit_followups(self):
+        """重新提交发送时读到的新消息，队列已满的留到下次发送时再试"""
+        self._followups = [job for job in self._followups if not self.submit(job)]
+
+    def shutdown(self):
+        """停止工作线程并等待其退出（最多 PIPELINE_SHUTDOWN_TIMEOUT 秒），丢弃尚未发送的任务"""
+        self._stopping.set()
+        dropped = (self.work_queue.qsize() + self.compose_queue.qsize() + self.send_queue.qsize()
+                   + len(self._awaiting_images) + len(self._late_images) + len(self._followups))
+        for _ in self._threads:
+            try:
+                self.work_queue.put_nowait(None)
+            except queue.Full:
+                break
+        # 工作线程可能仍在调用模型或读写回复状态，退出后调用方才能关闭这些资源
+        until = time.monotonic() + PIPELINE_SHUTDOWN_TIMEOUT
+        for thread in self._threads:
+            thread.join(max(until - time.monotonic(), 0))
+        alive = sum(thread.is_alive() for thread in self._threads)
+        if alive:
+            logging.warning(f"{alive} 个工作线程在 {PIPELINE_SHUTDOWN_TIMEOUT} 秒内未退出")
+        self._threads = []
+        if dropped:
+            logging.info(f"流水线停止，丢弃 {dropped} 个未完成的任务")
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from ..utils.clock import Clock
+from ..utils.config import CLASSIFICATION_CACHE_PATH, CLASSIFICATION_CACHE_SIZE, CLASSIFICATION_CACHE_TTL
+
+_STRIP_PATTERN = re.compile(r'[\s!！。.~～,，、…]+')
+
+
+class ClassificationCache:
+    """拜年信息判断结果的LRU缓存，支持TTL过期和磁盘持久化"""
+
+    def __init__(self, max_size: int = CLASSIFICATION_CACHE_SIZE, ttl: Optional[float] = CLASSIFICATION_CACHE_TTL,
+                 path: Optional[str] = CLASSIFICATION_CACHE_PATH, clock: Optional[Clock] = None,
+                 save_every: int = 20):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.clock = clock or Clock()
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def normalize(message: str) -> str:
+        """归一化消息文本：全角转半角、去掉空白和常见标点、统一小写"""
+        return _STRIP_PATTERN.sub('', unicodedata.normalize('NFKC', message)).lower()
+
+    def _expired(self, timestamp: float) -> bool:
+        return self.ttl is not None and self.clock.time() - timestamp > self.ttl
+
+    def get(self, message: str) -> Optional[bool]:
+        """查询缓存，未命中或已过期返回None"""
+        key = self.normalize(message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[1]):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, message: str, result: bool):
+        """写入判断结果，超出容量时淘汰最久未使用的条目"""
+        key = self.normalize(message)
+        with self._lock:
+            self._entries[key] = (result, self.clock.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._dirty += 1
+            should_save = self._dirty >= self.save_every
+        if should_save:
+            self.save()
+
+    def items(self) -> List[Tuple[str, bool]]:
+        """未过期的 (归一化消息, 判断结果)，用于训练本地分类器"""
+        with self._lock:
+            return [(key, entry[0]) for key, entry in self._entries.items() if not self._expired(entry[1])]
+
+    def stats(self) -> dict:
+        """命中统计，用于评估缓存容量"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def load(self):
+        """从磁盘加载缓存，跳过已过期的条目"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with self._lock:
+                for key, (result, timestamp) in sorted(data.items(), key=lambda item: item[1][1]):
+                    if not self._expired(timestamp):
+                        self._entries[key] = (bool(result), timestamp)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+            logging.info(f"已加载 {len(self._entries)} 条拜年判断缓存")
+        except Exception as e:
+            logging.error(f"加载拜年判断缓存失败: {str(e)}")
+
+    def save(self):
+        """将缓存写入磁盘（先写临时文件再替换）"""
+        if not self.path:
+            return
+        try:
+            with self._lock:
+                data = {key: list(entry) for key, entry in self._entries.items()}
+                self._dirty = 0
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"保存拜年判断缓存失败: {str(e)}")
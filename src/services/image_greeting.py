@@ -0,0 +1,303 @@
+import logging
+import re
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+from ..utils.clock import Clock
+from ..utils.config import (IMAGE_CACHE_SIZE, IMAGE_CACHE_TTL, IMAGE_CACHE_PATH, IMAGE_HASH_MAX_DISTANCE,
+                            IMAGE_WORKERS, IMAGE_QUEUE_SIZE, IMAGE_DEADLINE, IMAGE_MAX_SIDE)
+from ..utils.metrics import metrics
+from .classification_cache import ClassificationCache
+
+# 截到图的图片消息在消息列表中替换成带感知哈希的占位文本，参与去重、判断和回复
+IMAGE_MARKER = '[图片:{:016x}]'
+IMAGE_MARKER_PATTERN = re.compile(r'\[图片:([0-9a-f]{16})\]')
+HASH_SAMPLES = 4        # 计算感知哈希时每个格子每个方向的采样点数
+HASH_FLAT = 4           # 相邻两格平均亮度相差不超过此值视为一样亮，避免纯色区域的噪声改变哈希
+PENDING_IMAGES = 64     # 最多保留的尚未判断的截图数
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+@dataclass
+class CapturedImage:
+    """截取的图片，pixels 按行排列，每个像素为 0xRRGGBB"""
+    width: int
+    height: int
+    pixels: List[int]
+
+    def resized(self, max_side: int) -> 'CapturedImage':
+        """按最近邻缩小到最长边不超过 max_side"""
+        if max(self.width, self.height) <= max_side:
+            return self
+        scale = max_side / max(self.width, self.height)
+        width, height = max(1, int(self.width * scale)), max(1, int(self.height * scale))
+        xs = [int(x / scale) for x in range(width)]
+        pixels = []
+        for y in range(height):
+            row = int(y / scale) * self.width
+            pixels.extend(self.pixels[row + x] for x in xs)
+        return CapturedImage(width, height, pixels)
+
+    def to_png(self, max_side: int = IMAGE_MAX_SIDE) -> bytes:
+        """编码为RGB PNG（发给视觉模型）"""
+        image = self.resized(max_side)
+        raw = bytearray()
+        for y in range(image.height):
+            raw.append(0)
+            for color in image.pixels[y * image.width:(y + 1) * image.width]:
+                raw += color.to_bytes(3, 'big')
+        return (_PNG_SIGNATURE
+                + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', image.width, image.height, 8, 2, 0, 0, 0))
+                + _png_chunk(b'IDAT', zlib.compress(bytes(raw)))
+                + _png_chunk(b'IEND', b''))
+
+    @classmethod
+    def from_png(cls, data: bytes) -> 'CapturedImage':
+        """解码 to_png 写出的PNG（8位RGB、不使用行过滤），供模拟器使用"""
+        if not data.startswith(_PNG_SIGNATURE):
+            raise ValueError('不是PNG数据')
+        offset, header, compressed = len(_PNG_SIGNATURE), None, b''
+        while offset < len(data):
+            length, tag = struct.unpack('>I4s', data[offset:offset + 8])
+            body = data[offset + 8:offset + 8 + length]
+            if tag == b'IHDR':
+                header = struct.unpack('>IIBBBBB', body)
+            elif tag == b'IDAT':
+                compressed += body
+            offset += 12 + length
+        if not header or header[2:5] != (8, 2, 0):
+            raise ValueError('只支持8位RGB的PNG')
+        width, height = header[:2]
+        raw = zlib.decompress(compressed)
+        stride = width * 3 + 1
+        pixels = []
+        for y in range(height):
+            if raw[y * stride] != 0:
+                raise ValueError('不支持PNG行过滤')
+            row = raw[y * stride + 1:(y + 1) * stride]
+            pixels.extend(int.from_bytes(row[i:i + 3], 'big') for i in range(0, len(row), 3))
+        return cls(width, height, pixels)
+
+
+def _png_chunk(tag: bytes, body: bytes) -> bytes:
+    return struct.pack('>I', len(body)) + tag + body + struct.pack('>I', zlib.crc32(tag + body))
+
+
+def _luminance(color: int) -> int:
+    return (((color >> 16) & 0xFF) * 299 + ((color >> 8) & 0xFF) * 587 + (color & 0xFF) * 114) // 1000
+
+
+def _sample_points(length: int, cells: int) -> List[List[int]]:
+    """把 [0, length) 分成 cells 段，每段取最多 HASH_SAMPLES 个均匀分布的采样点"""
+    points = []
+    for i in range(cells):
+        start, end = i * length // cells, max((i + 1) * length // cells, i * length // cells + 1)
+        step = max(1, (end - start) // HASH_SAMPLES)
+        points.append(list(range(start, min(end, length), step))[:HASH_SAMPLES] or [min(start, length - 1)])
+    return points
+
+
+def dhash(image: CapturedImage, size: int = 8) -> int:
+    """差值哈希：缩小成 (size+1)×size 的灰度图，比较每行相邻两格的明暗，得到 size*size 位
+
+    缩放、重新压缩和轻微噪声只会改变少数几位，按汉明距离比较即可识别转发的同一张图。
+    贺卡常有大片纯色，亮度几乎相同的两格记为0，否则这些位会随噪声随机翻转。
+    每格只取少量采样点求平均，截图再大也只需读取约 (size+1)*size*HASH_SAMPLES² 个像素。
+    """
+    columns = _sample_points(image.width, size + 1)
+    rows = _sample_points(image.height, size)
+    bits = 0
+    for ys in rows:
+        cells = []
+        for xs in columns:
+            samples = [_luminance(image.pixels[y * image.width + x]) for y in ys for x in xs]
+            cells.append(sum(samples) / len(samples))
+        for left, right in zip(cells, cells[1:]):
+            bits = (bits << 1) | (left - right > HASH_FLAT)
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class ImageVerdictCache(ClassificationCache):
+    """图片感知哈希 → 是否拜年 的缓存，与文字判断缓存一样支持LRU、TTL和持久化
+
+    没有完全相同的哈希时，取汉明距离不超过 max_distance 的最近一条。
+    """
+
+    def __init__(self, max_size: int = IMAGE_CACHE_SIZE, ttl: Optional[float] = IMAGE_CACHE_TTL,
+                 path: Optional[str] = IMAGE_CACHE_PATH, clock: Optional[Clock] = None,
+                 max_distance: int = IMAGE_HASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.near_hits = 0
+        super().__init__(max_size, ttl, path, clock, save_every=1)
+
+    @staticmethod
+    def normalize(image_hash: int) -> str:
+        return f"{image_hash:016x}"
+
+    def get(self, image_hash: int) -> Optional[bool]:
+        result = super().get(image_hash)
+        if result is not None or not self.max_distance:
+            return result
+        with self._lock:
+            best = None
+            for key, (verdict, timestamp) in self._entries.items():
+                distance = hamming(int(key, 16), image_hash)
+                if distance <= self.max_distance and (best is None or distance < best[0]) \
+                        and not self._expired(timestamp):
+                    best = (distance, key, verdict)
+            if best is None:
+                return None
+            self._entries.move_to_end(best[1])
+            self.misses -= 1
+            self.hits += 1
+            self.near_hits += 1
+            return best[2]
+
+
+class ImageGreetingDetector:
+    """图片消息的拜年判断
+
+    读取消息时 register 截图，得到带感知哈希的占位文本，代替消息列表中的"[图片]"。
+    判断时先查哈希缓存，转发的同一张贺卡只调用一次视觉模型；未命中的交给最多 workers 个线程的视觉模型，
+    排队超过 queue_size 或截图已不在内存中时结果为None（暂不判断，调用方稍后重新提交）。
+    每张图从提交起最多等待 deadline 秒，超时的结果同样为None（尚未判断，调用方不应把它当作已处理），
+    后台的判断完成后仍写入缓存，之后再收到这张图时直接命中。
+    """
+
+    def __init__(self, judge: Callable[[CapturedImage], Optional[bool]],
+                 cache: Optional[ImageVerdictCache] = None, workers: int = IMAGE_WORKERS,
+                 queue_size: int = IMAGE_QUEUE_SIZE, deadline: float = IMAGE_DEADLINE,
+                 clock: Optional[Clock] = None):
+        """judge 调用视觉模型判断一张图，无法判断时返回None"""
+        self.judge = judge
+        self.clock = clock or Clock()
+        self.cache = cache if cache is not None else ImageVerdictCache(clock=self.clock)
+        self.queue_size = queue_size
+        self.deadline = deadline
+        self._images: 'OrderedDict[int, CapturedImage]' = OrderedDict()
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='vision')
+
+    @staticmethod
+    def parse(message: str) -> Optional[int]:
+        """占位文本中的感知哈希，不是图片消息时返回None"""
+        match = IMAGE_MARKER_PATTERN.fullmatch(message)
+        return int(match.group(1), 16) if match else None
+
+    def register(self, image: CapturedImage) -> str:
+        """记录截图，返回代替消息内容的占位文本"""
+        image_hash = dhash(image)
+        with self._lock:
+            self._images[image_hash] = image
+            self._images.move_to_end(image_hash)
+            while len(self._images) > PENDING_IMAGES:
+                self._images.popitem(last=False)
+        return IMAGE_MARKER.format(image_hash)
+
+    def submit(self, messages: Iterable[str]) -> List[Future]:
+        """开始判断一组图片消息（不等待），同一张图正在判断时复用同一个结果"""
+        return [self._submit(self.parse(message)) for message in messages]
+
+    def _submit(self, image_hash: int) -> Future:
+        cached = self.cache.get(image_hash)
+        if cached is not None:
+            metrics.inc('image_verdicts', source='cache')
+            return self._done(cached)
+        with self._lock:
+            pending = self._pending.get(image_hash)
+            if pending:
+                return pending
+            image = self._images.get(image_hash)
+            if image is None or len(self._pending) >= self.queue_size:
+                reason = 'no_image' if image is None else 'queue_full'
+                logging.info("图片 %016x 无法交给视觉模型（%s），暂不判断", image_hash, reason)
+                metrics.inc('image_verdicts', source=reason)
+                return self._done(None)
+            future = self._pending[image_hash] = self._executor.submit(self._judge, image_hash, image)
+            future.expires = self.clock.time() + self.deadline
+        return future
+
+    def _done(self, verdict: Optional[bool]) -> Future:
+        future = Future()
+        future.set_result(verdict)
+        future.expires = self.clock.time()
+        return future
+
+    @staticmethod
+    def ready_by(futures: List[Future]) -> float:
+        """这组判断最迟得出结果（或超时）的时间（clock.time() 下的时间点）"""
+        return max(future.expires for future in futures)
+
+    def _judge(self, image_hash: int, image: CapturedImage) -> bool:
+        verdict = None
+        start = self.clock.monotonic()
+        try:
+            verdict = self.judge(image)
+        except Exception as e:
+            logging.error(f"视觉模型判断图片时出错: {str(e)}")
+        metrics.observe('stage_duration_seconds', self.clock.monotonic() - start, stage='vision')
+        if verdict is not None:
+            # 先写缓存再移出进行中的列表，期间提交的同一张图不会重复调用模型
+            self.cache.put(image_hash, verdict)
+            metrics.inc('image_verdicts', source='model')
+        else:
+            metrics.inc('image_verdicts', source='failed')
+        with self._lock:
+            self._pending.pop(image_hash, None)
+            if verdict is not None:
+                self._images.pop(image_hash, None)
+        return bool(verdict)
+
+    def wait(self, futures: List[Future], deadline: Optional[float] = None) -> List[Optional[bool]]:
+        """等待判断结果，最多等到 deadline（clock.time() 下的时间点）且不超过各图片的等待时限，未完成的为None"""
+        if futures:
+            now = self.clock.time()
+            until = self.ready_by(futures) if deadline is None else min(deadline, self.ready_by(futures))
+            done = threading.Event()
+            remaining = [len(futures)]
+            lock = threading.Lock()
+
+            def on_done(_):
+                with lock:
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        done.set()
+
+            for future in futures:
+                future.add_done_callback(on_done)
+            self.clock.wait(done, until - now)
+        timed_out = sum(1 for future in futures if not future.done())
+        if timed_out:
+            logging.info("视觉模型未在截止时间前完成，%s 张图片暂不判断", timed_out)
+            metrics.inc('image_verdicts', timed_out, source='timeout')
+        return [self.verdict(future) for future in futures]
+
+    @staticmethod
+    def verdict(future: Future) -> Optional[bool]:
+        """已完成的判断结果，未完成或未能提交时返回None，被取消（程序退出）时按不是拜年处理"""
+        if not future.done():
+            return None
+        return False if future.cancelled() else future.result()
+
+    def classify(self, messages: List[str], deadline: Optional[float] = None) -> List[Optional[bool]]:
+        return self.wait(self.submit(messages), deadline)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {**self.cache.stats(), 'near_hits': self.cache.near_hits, 'pending': pending}
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.cache.save()
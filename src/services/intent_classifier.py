@@ -0,0 +1,96 @@
+import math
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..utils.config import LOCAL_CLASSIFIER_ACCEPT_ABOVE, LOCAL_CLASSIFIER_REJECT_BELOW
+from .classification_cache import ClassificationCache
+
+# 冷启动用的标注样本，之后由模型的判断记录(拜年判断缓存)继续训练
+SEED_SAMPLES: List[Tuple[str, bool]] = [
+    *((message, True) for message in (
+        '新年快乐', '过年好', '给您拜年了', '蛇年大吉', '万事如意', '心想事成', '阖家欢乐', '阖家安康',
+        '恭喜发财', '红包拿来', '岁岁平安', '身体健康', '万事胜意', '蛇来运转', '新春大吉', '大吉大利',
+        '财源广进', '步步高升', '喜乐安康', '前程似锦', '鸿运当头', '笑口常开', '年年有余', '吉祥如意',
+        '事事顺心', '平安喜乐', '新春愉快', '除夕快乐', '生意兴隆', '家和万事兴',
+    )),
+    *((message, False) for message in (
+        '在吗', '收到', 'ok', '好的', '嗯', '嗯嗯', '哈哈', '哈哈哈', '[动画表情]', '[图片]', '[语音]',
+        '[视频]', '[链接]', '[文件]', '明天开会吗', '吃饭了吗', '在干嘛', '谢谢', '好的收到', '知道了',
+        '没问题', '稍等', '马上到', '你到哪了', '发我一下', '晚点说', '行', '可以', '在路上', '几点出发',
+        '？', '打个电话', '文件发你了', '看一下群消息', '明天见',
+    )),
+]
+
+
+class IntentClassifier:
+    """本地拜年意图分类器：字符n-gram朴素贝叶斯
+
+    predict 返回 True(确定是拜年)、False(确定不是) 或 None(不确定，交给模型判断)，
+    单次判断只需几十微秒。
+    """
+
+    def __init__(self, reject_below: float = LOCAL_CLASSIFIER_REJECT_BELOW,
+                 accept_above: float = LOCAL_CLASSIFIER_ACCEPT_ABOVE, max_ngram: int = 3):
+        self.reject_below = reject_below
+        self.accept_above = accept_above
+        self.max_ngram = max_ngram
+        self.decisions: Counter = Counter()
+        self._counts: Dict[bool, Counter] = {True: Counter(), False: Counter()}
+        self._totals = {True: 0, False: 0}
+        self._docs = {True: 0, False: 0}
+        self._vocabulary: set = set()
+        self._lock = threading.Lock()
+
+    def features(self, message: str) -> set:
+        """归一化后的字符 1~max_ngram 元组"""
+        text = ClassificationCache.normalize(message)
+        return {text[i:i + n] for n in range(1, self.max_ngram + 1) for i in range(len(text) - n + 1)}
+
+    def learn(self, message: str, label: bool):
+        """加入一条标注样本"""
+        features = self.features(message)
+        with self._lock:
+            self._counts[label].update(features)
+            self._totals[label] += len(features)
+            self._docs[label] += 1
+            self._vocabulary.update(features)
+
+    def train(self, samples: Iterable[Tuple[str, bool]]):
+        for message, label in samples:
+            self.learn(message, label)
+
+    def score(self, message: str) -> Optional[float]:
+        """拜年与非拜年的对数几率；没有任何已知特征时返回None"""
+        features = self.features(message)
+        with self._lock:
+            if not self._docs[True] or not self._docs[False]:
+                return None
+            known = features & self._vocabulary
+            if not known:
+                return None
+            positive, negative = self._counts[True], self._counts[False]
+            vocabulary = len(self._vocabulary)
+            score = math.log(self._docs[True] / self._docs[False])
+            for feature in known:
+                # 拉普拉斯平滑；两类都没见过的特征不提供证据，直接跳过
+                score += math.log((positive[feature] + 1) / (self._totals[True] + vocabulary))
+                score -= math.log((negative[feature] + 1) / (self._totals[False] + vocabulary))
+            return score
+
+    def predict(self, message: str) -> Optional[bool]:
+        """确定是拜年返回True，确定不是返回False，不确定返回None"""
+        score = self.score(message)
+        if score is None or self.reject_below < score < self.accept_above:
+            result, decision = None, 'unsure'
+        else:
+            result = score >= self.accept_above
+            decision = 'accept' if result else 'reject'
+        with self._lock:
+            self.decisions[decision] += 1
+        return result
+
+    def stats(self) -> dict:
+        """样本数和各类判断的次数"""
+        with self._lock:
+            return {'samples': self._docs[True] + self._docs[False], **self.decisions}
@@ -1,56 +1,289 @@
+import base64
+import functools
 import logging
-import ollama
-from ..utils.config import TEXT_MODEL, IMAGE_MODEL, NEW_YEAR_KEYWORDS
+import re
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+from ..utils.clock import Clock
+from ..utils.metrics import metrics, timed
+from ..utils.config import (TEXT_MODEL, IMAGE_MODEL, LLM_STREAMING, REPLY_MAX_LENGTH,
+                            LOCAL_CLASSIFIER_ENABLED, CLASSIFY_BATCH_SIZE, IMAGE_DETECTION_ENABLED)
+from .classification_cache import ClassificationCache
+from .image_greeting import IMAGE_MARKER_PATTERN, CapturedImage, ImageGreetingDetector
+from .intent_classifier import SEED_SAMPLES, IntentClassifier
+from .ollama_client import CircuitOpenError, OllamaClient, OllamaError
+from .model_router import ModelRouter
+from ..handlers.rule_index import RuleIndex, NEW_YEAR
+
+THANKS_WORDS = ("谢谢", "感谢", "感恩")
+SENTENCE_ENDINGS = ("。", "？", "?")
+FALLBACK_REPLY = "谢谢您的祝福！祝您蛇年大吉，万事如意！"
+
+CLASSIFY_PROMPT = """请判断以下消息是否是拜年信息或新年祝福。请只回答"是"或"否"，不要有任何解释或其他内容。
+
+判断标准：
+1. 包含新年、春节、年等相关祝福
+2. 表达了祝福、问候的意思
+3. 节日相关的祝愿（如：恭喜发财、大吉大利等）
+
+消息内容：{message}
+
+只需要回答一个字："是"或"否"："""
+
+BATCH_CLASSIFY_PROMPT = """请逐条判断以下消息是否是拜年信息或新年祝福。
+
+判断标准：
+1. 包含新年、春节、年等相关祝福
+2. 表达了祝福、问候的意思
+3. 节日相关的祝愿（如：恭喜发财、大吉大利等）
+
+消息列表：
+{messages}
+
+请逐条回答，每行一条，格式为"序号. 是"或"序号. 否"，不要有任何解释或其他内容："""
+
+VISION_PROMPT = """请判断这张图片是否是拜年贺卡、新年祝福图片或春节相关的祝福表情。请只回答"是"或"否"，不要有任何解释或其他内容。"""
+
+IMAGE_GREETING_TEXT = '[拜年图片]'   # 生成回复时代替图片占位文本
+
+BATCH_VERDICT_PATTERN = re.compile(r'(\d+)\s*[.、:：)）]?\s*(是|否|不是)')
+
+
+class ThinkFilter:
+    """流式过滤 deepseek-r1 输出中 <think>...</think> 推理内容，只保留正文"""
 
-class LLMService:
     def __init__(self):
+        self.text = ''
+        self._buffer = ''
+        self._in_think = False
+
+    def feed(self, token: str):
+        self._buffer += token
+        while True:
+            tag = '</think>' if self._in_think else '<think>'
+            index = self._buffer.find(tag)
+            if index != -1:
+                if not self._in_think:
+                    self.text += self._buffer[:index]
+                self._buffer = self._buffer[index + len(tag):]
+                self._in_think = not self._in_think
+                continue
+            # 末尾可能是被拆开的半个标签，先留在缓冲区
+            keep = next((n for n in range(min(len(tag) - 1, len(self._buffer)), 0, -1)
+                         if tag.startswith(self._buffer[-n:])), 0)
+            emit = self._buffer[:len(self._buffer) - keep]
+            if not self._in_think:
+                self.text += emit
+            self._buffer = self._buffer[len(self._buffer) - keep:]
+            return
+
+    @classmethod
+    def strip(cls, text: str) -> str:
+        """去掉完整文本中的推理内容"""
+        think_filter = cls()
+        think_filter.feed(text)
+        return think_filter.text + (think_filter._buffer if not think_filter._in_think else '')
+
+
+class LLMService:
+    def __init__(self, client=None, cache: ClassificationCache = None, rules: RuleIndex = None,
+                 router: ModelRouter = None, clock: Clock = None):
+        """client 需提供与 ollama 相同的 generate 接口（并接受 timeout 参数），默认使用带连接池和熔断的 OllamaClient"""
         try:
-            self.ollama_client = ollama
+            self.clock = clock or Clock()
+            self.ollama_client = client if client is not None else OllamaClient(clock=self.clock)
+            self.router = router if router is not None else ModelRouter(clock=self.clock)
             self.text_model = TEXT_MODEL
             self.image_model = IMAGE_MODEL
+            self.streaming = LLM_STREAMING
+            self.batch_size = CLASSIFY_BATCH_SIZE
+            self.active_requests = 0
+            self._active_by_task = Counter()
+            self._active_lock = threading.Lock()
+            self.classification_cache = cache if cache is not None else ClassificationCache()
+            self.rules = rules if rules is not None else RuleIndex()
+            self.local_classifier = None
+            if LOCAL_CLASSIFIER_ENABLED:
+                self.local_classifier = IntentClassifier()
+                self.local_classifier.train(SEED_SAMPLES)
+                self.local_classifier.train(self.classification_cache.items())
+            self.image_detector = ImageGreetingDetector(
+                self.is_greeting_image, clock=self.clock) if IMAGE_DETECTION_ENABLED else None
             logging.info("成功初始化Ollama客户端")
         except Exception as e:
             logging.error(f"初始化Ollama客户端失败: {str(e)}")
             raise
 
-    def is_new_year_greeting(self, message):
-        """判断是否是拜年信息"""
-        try:
-            # 关键词匹配
-            if any(keyword in message for keyword in NEW_YEAR_KEYWORDS):
-                logging.info(f"通过关键词匹配判定为拜年信息 - 消息：{message}")
-                return True
-            
-            # LLM判断
-            prompt = """请判断以下消息是否是拜年信息或新年祝福。请只回答"是"或"否"，不要有任何解释或其他内容。
-
-判断标准：
-1. 包含新年、春节、年等相关祝福
-2. 表达了祝福、问候的意思
-3. 节日相关的祝愿（如：恭喜发财、大吉大利等）
+    def warm_up(self):
+        """预加载模型并在空闲时保活，客户端不支持时跳过"""
+        warm_up = getattr(self.ollama_client, 'warm_up', None)
+        if warm_up:
+            models = self.router.primary_models()
+            warm_up(models)
+            self.ollama_client.start_keep_alive(models)
 
-消息内容：{message}
+    def close(self):
+        if self.image_detector:
+            self.image_detector.close()
+        close = getattr(self.ollama_client, 'close', None)
+        if close:
+            close()
 
-只需要回答一个字："是"或"否"："""
+    def is_new_year_greeting(self, message, deadline: Optional[float] = None):
+        """判断是否是拜年信息；deadline 为 clock.time() 下的截止时间，来不及调用模型时由本地分类器兜底"""
+        try:
+            local = self._local_verdict(message)
+            if local is not None:
+                return local
             
-            response = self.ollama_client.generate(
-                model=self.text_model, 
-                prompt=prompt.format(message=message)
-            )
-            result = response['response'].strip().lower()
-            result = result.replace('<think>', '').replace('</think>', '')
-            result = result.split('\n')[0].strip()
+            # LLM判断
+            response = self._routed_generate('classify', CLASSIFY_PROMPT.format(message=message),
+                                             self._verdict_complete, deadline)
+            if response is None:
+                is_greeting = self._fallback_verdict(message)
+                logging.info("来不及调用模型，使用兜底判断 - 消息：%s - 结果：%s", message, is_greeting)
+                return is_greeting
+            result = response.strip().split('\n')[0].strip()
             
-            logging.info(f"LLM判断结果 - 消息：{message} - 清理后的结果：{result}")
+            logging.info("LLM判断结果 - 消息：%s - 清理后的结果：%s", message, result)
             
-            return result == '是' if result else False
+            is_greeting = bool(self._parse_verdict(result))
+            self._remember_verdict(message, is_greeting)
+            return is_greeting
 
         except Exception as e:
             logging.error(f"检测拜年信息时出错: {str(e)}")
-            return any(keyword in message for keyword in NEW_YEAR_KEYWORDS)
+            return self.rules.matches(message, NEW_YEAR)
+
+    @timed('classify')
+    def classify_messages(self, messages: List[str], deadline: Optional[float] = None) -> List[Optional[bool]]:
+        """批量判断一组消息（可来自多个会话）是否是拜年信息，结果与 messages 一一对应
+
+        关键词、缓存和本地分类器能判定的直接得出结果；其余消息去重后每 batch_size 条合并成一次模型调用，
+        模型逐条回答"序号. 是/否"。部分失败时逐级兜底：漏答的消息单独调用模型判断，
+        整批调用出错或来不及调用模型时由本地分类器判断。
+        图片消息先交给视觉模型（与文字判断同时进行），最后等待其结果；视觉模型超时或未能提交的图片结果为None。
+        """
+        images = {i: message for i, message in enumerate(messages) if self.is_image(message)}
+        image_futures = self.image_detector.submit(images.values()) if images else []
+        verdicts = [False if i in images else self._local_verdict(message) for i, message in enumerate(messages)]
+        undecided: Dict[str, List[int]] = {}
+        for i, verdict in enumerate(verdicts):
+            if verdict is None:
+                undecided.setdefault(ClassificationCache.normalize(messages[i]), []).append(i)
+        pending = [messages[indexes[0]] for indexes in undecided.values()]
+        answers: List[Optional[bool]] = []
+        for offset in range(0, len(pending), self.batch_size):
+            answers.extend(self._classify_chunk(pending[offset:offset + self.batch_size], deadline))
+        for indexes, answer in zip(undecided.values(), answers):
+            for i in indexes:
+                verdicts[i] = answer
+        if images:
+            for i, verdict in zip(images, self.image_detector.wait(image_futures, deadline)):
+                verdicts[i] = verdict
+        return verdicts
+
+    def is_image(self, message: str) -> bool:
+        """是否是已截图的图片消息（占位文本）"""
+        return self.image_detector is not None and self.image_detector.parse(message) is not None
+
+    def prefetch_images(self, messages: List[str]) -> List[Future]:
+        """提前把图片消息交给视觉模型，不等待结果；返回各图片的判断结果"""
+        images = [message for message in messages if self.is_image(message)]
+        return self.image_detector.submit(images) if images else []
+
+    def is_greeting_image(self, image: CapturedImage) -> Optional[bool]:
+        """调用视觉模型判断图片是否是拜年贺卡或祝福表情，无法判断时返回None"""
+        encoded = base64.b64encode(image.to_png()).decode('ascii')
+        response = self._routed_generate('vision', VISION_PROMPT, self._verdict_complete, None, images=[encoded])
+        if response is None:
+            return None
+        verdict = self._parse_verdict(response.strip().split('\n')[0])
+        logging.info("视觉模型判断结果 - %sx%s 图片：%s", image.width, image.height, verdict)
+        return verdict
+
+    def _classify_chunk(self, messages: List[str], deadline: Optional[float]) -> List[bool]:
+        """一次模型调用判断一批消息，并处理漏答和失败"""
+        if len(messages) == 1:
+            return [self.is_new_year_greeting(messages[0], deadline)]
+        try:
+            answers = self._classify_batch(messages, deadline)
+        except Exception as e:
+            logging.error(f"批量检测拜年信息时出错: {str(e)}")
+            return [self._fallback_verdict(message) for message in messages]
+        if answers is None:
+            logging.info("来不及调用模型，%s 条消息使用兜底判断", len(messages))
+            return [self._fallback_verdict(message) for message in messages]
+        verdicts = []
+        for message, answer in zip(messages, answers):
+            if answer is None:
+                logging.info("批量判断漏答，单独判断 - 消息：%s", message)
+                answer = self.is_new_year_greeting(message, deadline)
+            else:
+                self._remember_verdict(message, answer)
+            verdicts.append(answer)
+        return verdicts
+
+    def select_greetings(self, messages: List[str], deadline: Optional[float] = None) -> List[str]:
+        """一个会话的未读消息中属于拜年信息的部分"""
+        return [message for message, is_greeting in zip(messages, self.classify_messages(messages, deadline))
+                if is_greeting]
+
+    def _classify_batch(self, messages: List[str], deadline: Optional[float]) -> Optional[List[Optional[bool]]]:
+        """一次模型调用逐条判断多条消息，漏答的消息为None；来不及调用模型时返回None"""
+        listing = '\n'.join(f"{i}. {' '.join(message.split())}" for i, message in enumerate(messages, 1))
+        is_complete = functools.partial(self._batch_complete, count=len(messages))
+        response = self._routed_generate('classify', BATCH_CLASSIFY_PROMPT.format(messages=listing),
+                                         is_complete, deadline)
+        if response is None:
+            return None
+        answers = self._parse_batch_verdicts(response, len(messages))
+        logging.info("LLM批量判断结果 - %s 条消息：%s", len(messages), answers)
+        return answers
+
+    def _local_verdict(self, message: str) -> Optional[bool]:
+        """不调用模型的判断：关键词、缓存、本地分类器，都无法判定时返回None"""
+        # 关键词匹配
+        if self.rules.matches(message, NEW_YEAR):
+            logging.info("通过关键词匹配判定为拜年信息 - 消息：%s", message)
+            return True
+        
+        cached = self.classification_cache.get(message)
+        if cached is not None:
+            logging.info("命中拜年判断缓存 - 消息：%s - 结果：%s", message, cached)
+            return cached
+        
+        if self.local_classifier:
+            local = self.local_classifier.predict(message)
+            if local is not None:
+                # 本地判断结果不写入缓存，缓存只记录模型的判断，作为分类器的训练数据
+                logging.info("本地分类器判定 - 消息：%s - 结果：%s", message, local)
+                return local
+        return None
+
+    def _remember_verdict(self, message: str, is_greeting: bool):
+        """记录模型的判断：写入缓存并训练本地分类器"""
+        self.classification_cache.put(message, is_greeting)
+        if self.local_classifier:
+            self.local_classifier.learn(message, is_greeting)
+
+    @timed('generate')
+    def generate_greeting_reply(self, original_message, deadline: Optional[float] = None):
+        """生成拜年回复；deadline 为 clock.time() 下的截止时间，来不及调用模型时返回兜底回复"""
+        return self._greeting_reply(original_message, deadline)
 
-    def generate_greeting_reply(self, original_message):
-        """生成拜年回复"""
+    def generate_pool_reply(self, seed: str) -> str:
+        """为预生成回复池生成回复
+
+        后台任务：耗时记入 refill 阶段而不是 generate，也不计入模型路由的观测耗时，
+        以免空闲时的补充影响实时消息的档位选择。
+        """
+        with metrics.timer('refill', self.clock):
+            return self._greeting_reply(seed, None, background=True)
+
+    def _greeting_reply(self, original_message, deadline: Optional[float], background: bool = False) -> str:
         try:
             system_prompt = """你是一个春节祝福助手。请生成2025蛇年春节拜年回复。
 
@@ -77,19 +310,20 @@ class LLMService:
 
 直接输出祝福语，不要有任何解释、标点符号或引号。"""
 
+            original_message = IMAGE_MARKER_PATTERN.sub(IMAGE_GREETING_TEXT, original_message)
             user_prompt = f"收到的拜年祝福：{original_message}\n请生成回复："
             
-            response = self.ollama_client.generate(
-                model=self.text_model,
-                prompt=f"{system_prompt}\n\n{user_prompt}"
-            )
-            
-            reply = response['response'].strip()
+            reply = self._routed_generate('reply', f"{system_prompt}\n\n{user_prompt}", self._reply_complete, deadline,
+                                          background=background)
+            if reply is None:
+                logging.info("来不及调用模型，使用兜底回复")
+                return FALLBACK_REPLY
+            reply = reply.strip()
             lines = [line.strip() for line in reply.split('\n') if line.strip()]
             
             start_idx = -1
             for i, line in enumerate(lines):
-                if any(line.startswith(word) for word in ["谢谢", "感谢", "感恩"]):
+                if line.startswith(THANKS_WORDS):
                     start_idx = i
                     break
             
@@ -98,15 +332,144 @@ class LLMService:
             else:
                 actual_reply = lines[-1] if lines else ""
             
-            actual_reply = actual_reply.replace('<think>', '').replace('</think>', '')
-            actual_reply = actual_reply.strip('"')
+            actual_reply = actual_reply.strip('"')[:REPLY_MAX_LENGTH]
             
             if not actual_reply:
-                return "谢谢您的祝福！祝您蛇年大吉，万事如意！"
+                return FALLBACK_REPLY
             
-            logging.info(f"生成的回复：{actual_reply}")
+            logging.info("生成的回复：%s", actual_reply)
             return actual_reply
             
         except Exception as e:
             logging.error(f"生成拜年回复时出错: {str(e)}")
-            return "谢谢您的祝福！祝您蛇年大吉，万事如意！" 
\ No newline at end of file
+            return FALLBACK_REPLY
+
+    def _routed_generate(self, task: str, prompt: str, is_complete: Callable[[str], bool],
+                         deadline: Optional[float], images: Optional[List[str]] = None,
+                         background: bool = False) -> Optional[str]:
+        """按截止时间选择模型档位并生成；所有档位都来不及时返回None
+
+        模型调用失败时记录结果并尝试下一档，模型不存在时暂时跳过该模型，熔断时直接抛出。
+        background 为True的后台调用不计入路由的观测耗时，指标中的 task 标为 background。
+        """
+        label = 'background' if background else task
+        tried = set()
+        while True:
+            decision = self.router.choose(task, deadline, self._active_by_task[label], tried)
+            if decision.model is None:
+                metrics.inc('llm_fallbacks', task=label)
+                return None
+            tried.add(decision.model)
+            start = self.clock.monotonic()
+            try:
+                text = self._generate(prompt, is_complete, decision.model, decision.budget, images, label)
+            except Exception as e:
+                elapsed = self.clock.monotonic() - start
+                if not background:
+                    self.router.record(decision, elapsed, ok=False)
+                metrics.inc('llm_requests', task=label, model=decision.model, outcome='error')
+                metrics.observe('llm_request_seconds', elapsed, task=label, model=decision.model)
+                if isinstance(e, OllamaError) and e.status == 404:
+                    self.router.mark_unavailable(decision.model)
+                # 熔断时所有模型都不可用，不必再试下一档
+                if isinstance(e, CircuitOpenError) or len(tried) >= len(self.router.models(task)):
+                    raise
+                logging.warning(f"模型 {decision.model} 调用失败，尝试下一档: {str(e)}")
+                continue
+            elapsed = self.clock.monotonic() - start
+            if not background:
+                self.router.record(decision, elapsed)
+            metrics.inc('llm_requests', task=label, model=decision.model, outcome='ok')
+            metrics.observe('llm_request_seconds', elapsed, task=label, model=decision.model)
+            return text
+
+    def _fallback_verdict(self, message: str) -> bool:
+        """来不及调用模型时的判断：本地分类器倾向于拜年则判为是"""
+        if self.local_classifier:
+            score = self.local_classifier.score(message)
+            if score is not None:
+                return score > 0
+        return False
+
+    def _generate(self, prompt: str, is_complete: Callable[[str], bool], model: Optional[str] = None,
+                  timeout: Optional[float] = None, images: Optional[List[str]] = None, task: str = 'reply') -> str:
+        """调用模型并去掉推理内容
+
+        流式模式下边接收边解析，is_complete 判定已得到可用结果时立即关闭连接，
+        Ollama 服务端会随之停止生成。active_requests 记录正在进行的请求数，_active_by_task 按任务分别记录，
+        路由只按同一任务的请求数估计排队时间。
+        """
+        with self._active_lock:
+            self.active_requests += 1
+            self._active_by_task[task] += 1
+        try:
+            return self._request(prompt, is_complete, model or self.text_model, timeout, images)
+        finally:
+            with self._active_lock:
+                self.active_requests -= 1
+                self._active_by_task[task] -= 1
+
+    def _request(self, prompt: str, is_complete: Callable[[str], bool], model: str,
+                 timeout: Optional[float], images: Optional[List[str]] = None) -> str:
+        options = {} if timeout is None else {'timeout': timeout}
+        if images:
+            options['images'] = images
+        if not self.streaming:
+            response = self.ollama_client.generate(model=model, prompt=prompt, **options)
+            return ThinkFilter.strip(response['response'])
+
+        stream = self.ollama_client.generate(model=model, prompt=prompt, stream=True, **options)
+        think_filter = ThinkFilter()
+        try:
+            for chunk in stream:
+                think_filter.feed(chunk.get('response', ''))
+                if is_complete(think_filter.text):
+                    logging.debug("已得到可用结果，提前结束生成")
+                    break
+        finally:
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+        return think_filter.text
+
+    @staticmethod
+    def _parse_verdict(text: str) -> Optional[bool]:
+        """解析"是"/"否"，尚无法判断时返回None"""
+        text = text.strip().lstrip('"“「*')
+        if text.startswith('是'):
+            return True
+        if text.startswith(('否', '不是')):
+            return False
+        return None
+
+    @classmethod
+    def _verdict_complete(cls, text: str) -> bool:
+        """已得到"是"/"否"，或第一行已结束"""
+        stripped = text.lstrip()
+        return cls._parse_verdict(stripped) is not None or '\n' in stripped
+
+    @staticmethod
+    def _parse_batch_verdicts(text: str, count: int) -> List[Optional[bool]]:
+        """解析逐条回答的"序号. 是/否"，没有回答的序号为None"""
+        verdicts: List[Optional[bool]] = [None] * count
+        for number, answer in BATCH_VERDICT_PATTERN.findall(text):
+            index = int(number) - 1
+            if 0 <= index < count and verdicts[index] is None:
+                verdicts[index] = answer == '是'
+        return verdicts
+
+    @classmethod
+    def _batch_complete(cls, text: str, count: int) -> bool:
+        """所有序号都已回答"""
+        return None not in cls._parse_batch_verdicts(text, count)
+
+    @staticmethod
+    def _reply_complete(text: str) -> bool:
+        """以感谢开头的一句话已结束，或已达到字数上限"""
+        for line in text.lstrip().split('\n')[:-1]:
+            if line.strip().strip('"').startswith(THANKS_WORDS):
+                return True
+        last_line = text.lstrip().split('\n')[-1].strip().strip('"')
+        if last_line.startswith(THANKS_WORDS):
+            return len(last_line) >= REPLY_MAX_LENGTH or last_line.endswith(SENTENCE_ENDINGS)
+        return False
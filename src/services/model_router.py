@@ -0,0 +1,123 @@
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from ..utils.clock import Clock
+from ..utils.config import (MODEL_TIERS, MODEL_LATENCY_HALF_LIFE, MODEL_LATENCY_SMOOTHING,
+                            MODEL_UNAVAILABLE_BACKOFF)
+
+FALLBACK = 'fallback'
+
+
+@dataclass
+class RouteDecision:
+    task: str
+    model: Optional[str]        # None 表示已过截止时间或没有可用的模型，使用兜底结果
+    predicted: float = 0.0      # 预计耗时(秒)，含排队
+    budget: Optional[float] = None  # 距截止时间的剩余秒数，None 表示不限
+    queue_depth: int = 0
+
+
+class ModelRouter:
+    """按任务和截止时间选择模型档位
+
+    每个任务的模型按档位从优到快排列。预计耗时 = 同一任务的排队请求数 × 平均请求耗时 + 该模型的观测耗时，
+    超出剩余时间时降到下一档；前面的档位都来不及时仍使用最后一个可用档位（以剩余时间为超时），
+    只有已过截止时间或没有可用模型时返回 model=None，由调用方使用兜底结果。
+    观测耗时为指数滑动平均，并随距上次观测的时间按半衰期 half_life 衰减，
+    偶尔一次很慢的调用不会让该档位一直不被选中；尚未观测过的模型视为来得及。
+    """
+
+    def __init__(self, tiers: Optional[Dict[str, List[str]]] = None, clock: Optional[Clock] = None,
+                 smoothing: float = MODEL_LATENCY_SMOOTHING, half_life: float = MODEL_LATENCY_HALF_LIFE):
+        self.tiers = tiers or MODEL_TIERS
+        self.clock = clock or Clock()
+        self.smoothing = smoothing
+        self.half_life = half_life
+        self._latency: Dict[tuple, Tuple[float, float]] = {}   # (任务, 模型) -> (观测耗时, 观测时间)
+        self._request_latency: Optional[float] = None
+        self._unavailable_until: Dict[str, float] = {}
+        self._outcomes = defaultdict(lambda: {'count': 0, 'late': 0, 'failed': 0, 'total': 0.0})
+        self._lock = threading.Lock()
+
+    def models(self, task: str) -> List[str]:
+        return list(self.tiers.get(task, []))
+
+    def primary_models(self) -> List[str]:
+        """各任务的首选模型（用于预加载）"""
+        return list(dict.fromkeys(models[0] for models in self.tiers.values() if models))
+
+    def choose(self, task: str, deadline: Optional[float], queue_depth: int = 0,
+               exclude: Iterable[str] = ()) -> RouteDecision:
+        """选择第一个预计能在截止时间前完成的模型，都来不及时选最后一个可用档位
+
+        deadline 为 clock.time() 下的时间点，queue_depth 为同一任务正在进行的请求数。
+        """
+        now = self.clock.time()
+        budget = None if deadline is None else deadline - now
+        exclude = set(exclude)
+        with self._lock:
+            queue_wait = queue_depth * (self._request_latency or 0.0)
+            decision = RouteDecision(task, None, queue_wait, budget, queue_depth)
+            if budget is None or budget > 0:
+                for model in self.tiers.get(task, []):
+                    if model in exclude or self._unavailable_until.get(model, 0) > self.clock.monotonic():
+                        continue
+                    decision = RouteDecision(task, model, queue_wait + self._estimate(task, model), budget, queue_depth)
+                    if budget is None or decision.predicted <= budget:
+                        break
+        budget_text = '不限' if budget is None else f"{budget:.1f} 秒"
+        logging.info("模型路由 %s: %s，预计 %.1f 秒，剩余 %s，排队 %s",
+                     task, decision.model or '兜底', decision.predicted, budget_text, queue_depth)
+        if decision.model is None:
+            self._record_outcome(decision, 0.0, late=False, failed=False)
+        return decision
+
+    def record(self, decision: RouteDecision, elapsed: float, ok: bool = True):
+        """记录一次调用的实际耗时，更新观测值"""
+        late = decision.budget is not None and elapsed > decision.budget
+        with self._lock:
+            if ok:
+                key = (decision.task, decision.model)
+                previous = self._estimate(*key) if key in self._latency else None
+                self._latency[key] = (elapsed if previous is None else (
+                    self.smoothing * elapsed + (1 - self.smoothing) * previous), self.clock.monotonic())
+                self._request_latency = elapsed if self._request_latency is None else (
+                    self.smoothing * elapsed + (1 - self.smoothing) * self._request_latency)
+        self._record_outcome(decision, elapsed, late, not ok)
+        logging.info("模型路由结果 %s/%s: 耗时 %.1f 秒，预计 %.1f 秒，%s", decision.task, decision.model,
+                     elapsed, decision.predicted, '失败' if not ok else '超时' if late else '按时')
+
+    def _estimate(self, task: str, model: str) -> float:
+        """按距上次观测的时间衰减后的观测耗时，调用方需持有 _lock"""
+        if (task, model) not in self._latency:
+            return 0.0
+        latency, observed_at = self._latency[(task, model)]
+        if not self.half_life:
+            return latency
+        return latency * 0.5 ** ((self.clock.monotonic() - observed_at) / self.half_life)
+
+    def mark_unavailable(self, model: str, seconds: float = MODEL_UNAVAILABLE_BACKOFF):
+        """模型不可用（如未下载）时暂时跳过"""
+        logging.warning(f"模型 {model} 不可用，{seconds} 秒内跳过")
+        with self._lock:
+            self._unavailable_until[model] = self.clock.monotonic() + seconds
+
+    def _record_outcome(self, decision: RouteDecision, elapsed: float, late: bool, failed: bool):
+        with self._lock:
+            outcome = self._outcomes[f"{decision.task}/{decision.model or FALLBACK}"]
+            outcome['count'] += 1
+            outcome['late'] += late
+            outcome['failed'] += failed
+            outcome['total'] += elapsed
+
+    def stats(self) -> dict:
+        """各任务/模型的调用次数、超时次数、失败次数和平均耗时"""
+        with self._lock:
+            return {
+                route: {'count': o['count'], 'late': o['late'], 'failed': o['failed'],
+                        'avg': o['total'] / o['count'] if o['count'] else 0.0}
+                for route, o in self._outcomes.items()
+            }
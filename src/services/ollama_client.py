@@ -0,0 +1,282 @@
+import http.client
+import json
+import logging
+import queue
+import socket
+import threading
+from typing import Iterable, Iterator, Optional
+from urllib.parse import urlsplit
+
+from ..utils.clock import Clock
+from ..utils.config import (OLLAMA_HOST, OLLAMA_POOL_SIZE, OLLAMA_TIMEOUT, OLLAMA_CONNECT_TIMEOUT,
+                            OLLAMA_KEEP_ALIVE, OLLAMA_KEEP_ALIVE_INTERVAL,
+                            BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+
+class OllamaError(Exception):
+    """Ollama 请求失败，status 为HTTP状态码（未收到响应时为None）"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class OllamaTimeout(OllamaError):
+    """请求超过截止时间"""
+
+
+class CircuitOpenError(OllamaError):
+    """熔断中，请求未发出"""
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，reset_timeout 秒后放行一个试探请求，成功则恢复"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT, clock: Optional[Clock] = None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock or Clock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行请求；熔断到期后只放行一个试探请求"""
+        with self._lock:
+            if self.state == self.OPEN and self.clock.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            if self.state == self.CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info("Ollama 已恢复，结束熔断")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_inconclusive(self):
+        """结果不能说明服务状态（如调用方的时间预算不足而超时）：不计入失败，试探请求则放行下一个试探"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self._opened_at = self.clock.monotonic() - self.reset_timeout
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.warning(f"Ollama 连续失败 {self.failures} 次，熔断 {self.reset_timeout} 秒")
+                self.state = self.OPEN
+                self._opened_at = self.clock.monotonic()
+
+
+class OllamaClient:
+    """带连接池、截止时间、熔断和模型保活的 Ollama HTTP 客户端
+
+    generate 与 ollama 模块的接口一致：stream=False 返回响应字典，stream=True 返回逐块产出的生成器，
+    关闭生成器即断开连接，服务端随之停止生成。每次请求都带上 keep_alive，
+    start_keep_alive 在长时间没有请求时定期预加载模型，避免空闲后第一条消息等待模型加载。
+    """
+
+    def __init__(self, host: str = OLLAMA_HOST, pool_size: int = OLLAMA_POOL_SIZE,
+                 timeout: float = OLLAMA_TIMEOUT, connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+                 keep_alive: str = OLLAMA_KEEP_ALIVE, breaker: Optional[CircuitBreaker] = None,
+                 clock: Optional[Clock] = None):
+        url = urlsplit(host if '://' in host else f'http://{host}')
+        self.host = url.hostname or '127.0.0.1'
+        self.port = url.port or 11434
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.keep_alive = keep_alive
+        self.clock = clock or Clock()
+        self.breaker = breaker or CircuitBreaker(clock=self.clock)
+        self.last_request_at = 0.0
+        self._pool: 'queue.LifoQueue[http.client.HTTPConnection]' = queue.LifoQueue()
+        self._stopping = threading.Event()
+        self._keep_alive_thread: Optional[threading.Thread] = None
+
+    def generate(self, model: str, prompt: str, stream: bool = False, timeout: Optional[float] = None, **options):
+        """调用 /api/generate；timeout 为本次调用的截止时间(秒)，默认使用 self.timeout
+
+        timeout 比 self.timeout 短时（调用方按剩余时间预算传入），超时只说明预算不够，不计入熔断。
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("Ollama 熔断中，跳过请求")
+        budget_limited = timeout is not None and timeout < self.timeout
+        deadline = self.clock.monotonic() + (timeout if timeout is not None else self.timeout)
+        payload = {'model': model, 'prompt': prompt, 'stream': stream, 'keep_alive': self.keep_alive, **options}
+        try:
+            connection, response = self._post('/api/generate', payload, deadline)
+        except OllamaError as e:
+            # 4xx(如模型不存在)说明服务本身正常，不计入熔断
+            if e.status is not None and e.status < 500:
+                self.breaker.record_success()
+            else:
+                self._record_error(e, budget_limited)
+            raise
+        except Exception as e:
+            self._record_error(e, budget_limited)
+            raise
+        if stream:
+            return self._stream(connection, response, deadline, budget_limited)
+        try:
+            data = json.loads(self._read(connection, response.read, deadline))
+        except Exception as e:
+            connection.close()
+            self._record_error(e, budget_limited)
+            raise
+        self._release(connection)
+        self.breaker.record_success()
+        return data
+
+    def warm_up(self, models: Iterable[str]) -> bool:
+        """预加载模型（空 prompt 只加载模型不生成）"""
+        ok = True
+        for model in models:
+            start = self.clock.monotonic()
+            try:
+                self.generate(model, '')
+                logging.info(f"模型 {model} 已加载，耗时 {self.clock.monotonic() - start:.1f} 秒")
+            except Exception as e:
+                logging.warning(f"预加载模型 {model} 失败: {str(e)}")
+                ok = False
+        return ok
+
+    def start_keep_alive(self, models: Iterable[str], interval: float = OLLAMA_KEEP_ALIVE_INTERVAL):
+        """后台定期预加载模型，距上次请求不足 interval 秒时跳过"""
+        if self._keep_alive_thread:
+            return
+        models = list(models)
+
+        def run():
+            while not self._stopping.is_set():
+                self.clock.sleep(min(interval, 1))
+                if self.clock.monotonic() - self.last_request_at >= interval:
+                    self.warm_up(models)
+
+        self._stopping.clear()
+        self._keep_alive_thread = threading.Thread(target=run, name='ollama-keep-alive', daemon=True)
+        self._keep_alive_thread.start()
+
+    def close(self):
+        """停止保活并关闭连接池中的连接"""
+        self._stopping.set()
+        self._keep_alive_thread = None
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def _post(self, path: str, payload: dict, deadline: float):
+        """发送请求并读取响应头；复用的连接已被服务端关闭时换新连接重试一次"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        self.last_request_at = self.clock.monotonic()
+        for attempt in range(2):
+            connection, reused = self._acquire()
+            try:
+                timeout = self._remaining(deadline)
+                if connection.sock:
+                    connection.sock.settimeout(timeout)
+                else:
+                    connection.timeout = min(self.connect_timeout, timeout)
+                connection.request('POST', path, body=body, headers=headers)
+                response = self._read(connection, connection.getresponse, deadline)
+            except socket.timeout:
+                connection.close()
+                raise OllamaTimeout("连接 Ollama 超时")
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            if response.status != 200:
+                detail = response.read().decode('utf-8', 'replace')
+                connection.close()
+                raise OllamaError(f"HTTP {response.status}: {detail}", response.status)
+            return connection, response
+        raise OllamaError("无法连接 Ollama")
+
+    def _record_error(self, error: Exception, budget_limited: bool):
+        if budget_limited and isinstance(error, OllamaTimeout):
+            self.breaker.record_inconclusive()
+        else:
+            self.breaker.record_failure()
+
+    def _stream(self, connection: http.client.HTTPConnection, response, deadline: float,
+                budget_limited: bool = False) -> Iterator[dict]:
+        finished = False
+        try:
+            while True:
+                line = self._read(connection, response.readline, deadline)
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                yield chunk
+                if chunk.get('done'):
+                    response.read()
+                    finished = True
+                    break
+            self.breaker.record_success()
+        except GeneratorExit:
+            # 调用方提前结束，已收到的内容有效
+            self.breaker.record_success()
+            raise
+        except Exception as e:
+            self._record_error(e, budget_limited)
+            raise
+        finally:
+            if finished:
+                self._release(connection)
+            else:
+                connection.close()
+
+    def _read(self, connection: http.client.HTTPConnection, read, deadline: float):
+        """在截止时间内完成一次读取"""
+        remaining = self._remaining(deadline)
+        if connection.sock:
+            connection.sock.settimeout(remaining)
+        try:
+            return read()
+        except socket.timeout:
+            connection.close()
+            raise OllamaTimeout("Ollama 响应超时")
+
+    def _remaining(self, deadline: float) -> float:
+        """距截止时间的真实秒数（套接字超时不受模拟时钟加速影响）"""
+        remaining = deadline - self.clock.monotonic()
+        if remaining <= 0:
+            raise OllamaTimeout("Ollama 响应超时")
+        return remaining / self.clock.scale
+
+    def _acquire(self):
+        """取一个空闲连接，没有时新建；返回 (连接, 是否复用)"""
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            return http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout), False
+
+    def _release(self, connection: http.client.HTTPConnection):
+        if self._pool.qsize() < self.pool_size and not self._stopping.is_set():
+            self._pool.put(connection)
+        else:
+            connection.close()
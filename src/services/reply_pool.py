@@ -0,0 +1,178 @@
+import logging
+import threading
+from collections import deque
+from itertools import chain
+from typing import Deque, Dict, List, Optional
+
+from ..handlers.rule_index import Automaton
+from ..utils.clock import Clock
+from ..utils.config import (REPLY_POOL_SIZE, REPLY_POOL_SIMILARITY, REPLY_POOL_PERSONALIZE_LENGTH,
+                            REPLY_POOL_CATEGORIES)
+from .classification_cache import ClassificationCache
+from .llm_service import FALLBACK_REPLY
+
+GENERAL_CATEGORY = '通用'
+REFILL_POLL_INTERVAL = 1   # 池已满或模型忙时的检查间隔(秒)
+DUPLICATE_BACKOFF = 60     # 某类别连续生成重复回复后暂停补充的时间(秒)
+MAX_DUPLICATES = 3
+
+
+def bigrams(text: str) -> set:
+    text = ClassificationCache.normalize(text)
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def similarity(a: str, b: str) -> float:
+    """字符二元组的Jaccard相似度"""
+    a, b = bigrams(a), bigrams(b)
+    return len(a & b) / len(a | b)
+
+
+class ReplyPool:
+    """预生成的拜年回复池
+
+    后台线程在模型空闲时按类别调用 generate_pool_reply 补充回复，
+    与池中或最近发出的回复过于相似的结果会被丢弃，避免不同联系人收到相同的回复。
+    take 按来信匹配的类别立即取出一条回复；池中没有合适的回复、
+    或来信内容较具体需要单独生成时返回None。
+    """
+
+    def __init__(self, llm_service, size: int = REPLY_POOL_SIZE, categories: Optional[Dict[str, dict]] = None,
+                 max_similarity: float = REPLY_POOL_SIMILARITY,
+                 personalize_length: int = REPLY_POOL_PERSONALIZE_LENGTH, clock: Optional[Clock] = None):
+        self.llm_service = llm_service
+        self.size = size
+        self.categories = categories or REPLY_POOL_CATEGORIES
+        self.max_similarity = max_similarity
+        self.personalize_length = personalize_length
+        self.clock = clock or Clock()
+        self.hits = 0
+        self.misses = 0
+        self.personalized = 0
+        self.discarded = 0
+        self.refill_times: Deque[float] = deque(maxlen=1000)
+        self._matcher = Automaton(
+            (keyword, category, False)
+            for category, entry in self.categories.items() for keyword in entry.get('keywords', [])
+        )
+        self._replies: Dict[str, Deque[str]] = {category: deque() for category in self.categories}
+        self._recent: Deque[str] = deque(maxlen=100)
+        self._duplicates: Dict[str, int] = {category: 0 for category in self.categories}
+        self._paused_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """启动后台补充线程"""
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='reply-pool', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread = None
+
+    def categorize(self, message: str) -> List[str]:
+        """来信匹配的类别（按配置顺序），最后是通用类别"""
+        matched = self._matcher.search(message)
+        categories = [category for category in self.categories if category in matched]
+        if GENERAL_CATEGORY in self.categories and GENERAL_CATEGORY not in categories:
+            categories.append(GENERAL_CATEGORY)
+        return categories
+
+    def needs_personal(self, message: str) -> bool:
+        """来信较长、内容较具体时单独生成回复"""
+        return len(ClassificationCache.normalize(message)) > self.personalize_length
+
+    def take(self, message: str) -> Optional[str]:
+        """取出一条适合该来信的回复，没有时返回None"""
+        if self.needs_personal(message):
+            with self._lock:
+                self.personalized += 1
+            return None
+        with self._lock:
+            for category in self.categorize(message):
+                replies = self._replies[category]
+                for reply in replies:
+                    if not self._repeats_greeting(reply, message):
+                        replies.remove(reply)
+                        self._recent.append(reply)
+                        self.hits += 1
+                        return reply
+            self.misses += 1
+        return None
+
+    def record_sent(self, reply: str):
+        """记录现场生成并发出的回复，后续补充时避开相似的内容"""
+        with self._lock:
+            self._recent.append(reply)
+
+    @staticmethod
+    def _repeats_greeting(reply: str, message: str) -> bool:
+        """回复是否重复了来信中的祝福语（连续4个字相同）"""
+        text = ClassificationCache.normalize(message)
+        return any(text[i:i + 4] in reply for i in range(len(text) - 3))
+
+    def _next_category(self) -> Optional[str]:
+        """回复最少且未暂停的类别，都已补满时返回None"""
+        now = self.clock.monotonic()
+        with self._lock:
+            candidates = [
+                (len(replies), category) for category, replies in self._replies.items()
+                if len(replies) < self.size and self._paused_until.get(category, 0) <= now
+            ]
+        return min(candidates)[1] if candidates else None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            category = self._next_category()
+            # 只在模型空闲时补充，不与正在进行的判断和生成争用
+            if category is None or self.llm_service.active_requests:
+                self.clock.sleep(REFILL_POLL_INTERVAL)
+                continue
+            try:
+                self._refill(category)
+            except Exception as e:
+                logging.error(f"补充回复池时出错: {str(e)}")
+                self.clock.sleep(REFILL_POLL_INTERVAL)
+
+    def _refill(self, category: str):
+        start = self.clock.monotonic()
+        reply = self.llm_service.generate_pool_reply(self.categories[category]['seed'])
+        elapsed = self.clock.monotonic() - start
+        with self._lock:
+            self.refill_times.append(elapsed)
+            if not reply or reply == FALLBACK_REPLY or self._is_duplicate(reply):
+                self.discarded += 1
+                self._duplicates[category] += 1
+                if self._duplicates[category] >= MAX_DUPLICATES:
+                    logging.info(f"回复池类别 {category} 连续生成重复回复，暂停补充 {DUPLICATE_BACKOFF} 秒")
+                    self._paused_until[category] = self.clock.monotonic() + DUPLICATE_BACKOFF
+                    self._duplicates[category] = 0
+                return
+            self._duplicates[category] = 0
+            self._replies[category].append(reply)
+        logging.debug("回复池补充 %s: %s（耗时 %.1f 秒）", category, reply, elapsed)
+
+    def _is_duplicate(self, reply: str) -> bool:
+        pooled = chain.from_iterable(self._replies.values())
+        return any(similarity(reply, other) > self.max_similarity for other in chain(pooled, self._recent))
+
+    def stats(self) -> dict:
+        """池大小、命中率和补充耗时"""
+        with self._lock:
+            total = self.hits + self.misses
+            refill_times = sorted(self.refill_times)
+            return {
+                'size': {category: len(replies) for category, replies in self._replies.items()},
+                'hits': self.hits,
+                'misses': self.misses,
+                'personalized': self.personalized,
+                'hit_rate': self.hits / total if total else 0.0,
+                'discarded': self.discarded,
+                'refill_p50': refill_times[len(refill_times) // 2] if refill_times else 0.0,
+                'refill_avg': sum(refill_times) / len(refill_times) if refill_times else 0.0,
+            }
@@ -0,0 +1,203 @@
+import hashlib
+import itertools
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+
+from ..utils.clock import Clock
+from ..utils.config import REPLY_STATE_PATH, REPLY_STATE_TTL, REPLY_STATE_HOT_SIZE, REPLY_STATE_EVICT_INTERVAL
+from .classification_cache import ClassificationCache
+
+EVICT_BATCH = 10000   # 每次清理过期记录的最大行数，避免长时间持有写锁
+
+_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS replies (contact TEXT PRIMARY KEY, replied_at REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS handled (hash INTEGER PRIMARY KEY, handled_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS replies_replied_at ON replies (replied_at)',
+    'CREATE INDEX IF NOT EXISTS handled_handled_at ON handled (handled_at)',
+)
+
+
+class _HotLayer:
+    """最近访问记录的LRU，值为时间戳；None 表示已确认数据库中没有"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: 'OrderedDict[object, Optional[float]]' = OrderedDict()
+
+    def get(self, key, default=False):
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value: Optional[float]):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ReplyStateStore:
+    """回复状态的持久化存储：各联系人的最后回复时间和已处理消息的内容哈希
+
+    登录了多个微信账号时按 account 区分，不同账号下的同名联系人分开记录。
+
+    数据保存在 SQLite（WAL模式）中，重启后继续生效，不会重复回复或重新判断已处理的消息。
+    启动时不加载数据，按主键查询并缓存在内存LRU中；超过 ttl 的记录视为不存在，
+    并在写入时按 evict_interval 分批删除。path 为None时只保存在内存。
+    """
+
+    def __init__(self, path: Optional[str] = REPLY_STATE_PATH, ttl: float = REPLY_STATE_TTL,
+                 hot_size: int = REPLY_STATE_HOT_SIZE, evict_interval: float = REPLY_STATE_EVICT_INTERVAL,
+                 clock: Optional[Clock] = None):
+        self.path = path
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self.clock = clock or Clock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._replies = _HotLayer(hot_size)
+        self._handled = _HotLayer(hot_size)
+        self._last_evict = self.clock.monotonic()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path or ':memory:', check_same_thread=False, isolation_level=None)
+        if path:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            # WAL模式下 NORMAL 只在断电时可能丢失最后的事务，进程崩溃不受影响
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+
+    @staticmethod
+    def contact_key(contact_name: str, account: Optional[str] = None) -> str:
+        """账号 + 联系人，account 为None时只用联系人名称"""
+        return contact_name if account is None else f"{account}\0{contact_name}"
+
+    @classmethod
+    def message_hash(cls, contact_name: str, message: str, account: Optional[str] = None) -> int:
+        """账号 + 联系人 + 归一化消息内容的64位哈希"""
+        key = f"{cls.contact_key(contact_name, account)}\0{ClassificationCache.normalize(message)}".encode('utf-8')
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big', signed=True)
+
+    def _fresh(self, timestamp: Optional[float]) -> Optional[float]:
+        if timestamp is None or self.clock.time() - timestamp > self.ttl:
+            return None
+        return timestamp
+
+    def last_reply_time(self, contact_name: str, account: Optional[str] = None) -> Optional[float]:
+        """最后一次回复该联系人的时间，没有记录时返回None"""
+        key = self.contact_key(contact_name, account)
+        with self._lock:
+            timestamp = self._replies.get(key)
+            if timestamp is False:
+                row = self._db.execute('SELECT replied_at FROM replies WHERE contact = ?', (key,)).fetchone()
+                timestamp = row[0] if row else None
+                self._replies.put(key, timestamp)
+            return self._fresh(timestamp)
+
+    def record_reply(self, contact_name: str, timestamp: Optional[float] = None, account: Optional[str] = None):
+        timestamp = self.clock.time() if timestamp is None else timestamp
+        key = self.contact_key(contact_name, account)
+        with self._lock:
+            self._replies.put(key, timestamp)
+            try:
+                self._db.execute('INSERT OR REPLACE INTO replies (contact, replied_at) VALUES (?, ?)',
+                                 (key, timestamp))
+            except sqlite3.Error as e:
+                logging.error(f"保存回复时间失败: {str(e)}")
+        self._maybe_evict()
+
+    def unhandled(self, contact_name: str, messages: List[str], account: Optional[str] = None) -> List[str]:
+        """过滤掉已处理过的消息"""
+        hashes = [self.message_hash(contact_name, message, account) for message in messages]
+        with self._lock:
+            missing = [h for h in hashes if self._handled.get(h) is False]
+            if missing:
+                found = dict(self._db.execute(
+                    f"SELECT hash, handled_at FROM handled WHERE hash IN ({','.join('?' * len(missing))})",
+                    missing
+                ).fetchall())
+                for h in missing:
+                    self._handled.put(h, found.get(h))
+            result = []
+            for message, h in zip(messages, hashes):
+                if self._fresh(self._handled.get(h)) is None:
+                    self.misses += 1
+                    result.append(message)
+                else:
+                    self.hits += 1
+            return result
+
+    def mark_handled(self, contact_name: str, messages: Iterable[str], account: Optional[str] = None):
+        """记录已处理（已回复或判定不需要回复）的消息"""
+        now = self.clock.time()
+        rows = [(self.message_hash(contact_name, message, account), now) for message in messages]
+        if not rows:
+            return
+        with self._lock:
+            for h, _ in rows:
+                self._handled.put(h, now)
+            try:
+                self._db.execute('BEGIN')
+                self._db.executemany('INSERT OR REPLACE INTO handled (hash, handled_at) VALUES (?, ?)', rows)
+                self._db.execute('COMMIT')
+            except sqlite3.Error as e:
+                if self._db.in_transaction:
+                    self._db.execute('ROLLBACK')
+                logging.error(f"保存已处理消息失败: {str(e)}")
+        self._maybe_evict()
+
+    def _maybe_evict(self):
+        if self.clock.monotonic() - self._last_evict >= self.evict_interval:
+            self._last_evict = self.clock.monotonic()
+            # 写入路径上每次只删一批，积压的过期记录在之后的间隔中逐步清理
+            self.evict_expired(max_batches=1)
+
+    def evict_expired(self, max_batches: Optional[int] = None) -> int:
+        """分批删除过期记录，每批最多 EVICT_BATCH 行，返回删除的行数"""
+        cutoff = self.clock.time() - self.ttl
+        removed = 0
+        try:
+            for table, column in (('replies', 'replied_at'), ('handled', 'handled_at')):
+                for _ in itertools.repeat(None) if max_batches is None else range(max_batches):
+                    with self._lock:
+                        count = self._db.execute(
+                            f"DELETE FROM {table} WHERE rowid IN "
+                            f"(SELECT rowid FROM {table} WHERE {column} < ? LIMIT ?)", (cutoff, EVICT_BATCH)
+                        ).rowcount
+                    removed += count
+                    if count < EVICT_BATCH:
+                        break
+        except sqlite3.Error as e:
+            logging.error(f"清理过期回复状态失败: {str(e)}")
+        if removed:
+            logging.info(f"清理了 {removed} 条过期回复状态")
+        self.evicted += removed
+        return removed
+
+    def stats(self) -> dict:
+        """已处理消息的命中统计和内存层大小"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hot_replies': len(self._replies),
+                'hot_handled': len(self._handled),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evicted': self.evicted,
+            }
+
+    def close(self):
+        with self._lock:
+            try:
+                self._db.close()
+            except sqlite3.Error as e:
+                logging.error(f"关闭回复状态存储失败: {str(e)}")
@@ -1,23 +1,142 @@
-import uiautomation as auto
-import time
 import logging
 import random
-from typing import List, Optional, Tuple
+import re
+import threading
+from collections import defaultdict, deque
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from ..utils.clock import Clock
+from ..utils.config import (UI_WAIT_TIMEOUT, UI_POLL_INTERVAL, MESSAGE_RENDER_TIMEOUT, WINDOW_CACHE_TTL,
+                            CHANGE_EVENTS_ENABLED, IMAGE_MESSAGE_NAMES, PASTE_RESTORE_DELAY, MESSAGE_TIP_PATTERNS)
+from ..utils.metrics import metrics, timed
+from .ui_backend import CachedChild, UIABackend
+
+if TYPE_CHECKING:
+    import uiautomation as auto
+    from .image_greeting import ImageGreetingDetector
+
+_TIP_PATTERN = re.compile('|'.join(f"(?:{pattern})" for pattern in MESSAGE_TIP_PATTERNS))
 
 class UIAutomation:
-    @staticmethod
-    def random_sleep(min_seconds: float = 0.5, max_seconds: float = 2.0) -> float:
+    def __init__(self, backend=None, clock: Optional[Clock] = None):
+        self.backend = backend if backend is not None else UIABackend()
+        self.clock = clock or Clock()
+        self.wait_times: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=1000))
+        self._panel_cache: Dict[int, Tuple[Any, str]] = {}
+        self._account_names: Dict[int, Optional[str]] = {}
+        self._windows_cache: List[Any] = []
+        self._windows_cached_at = 0.0
+        self.locator_hits = 0
+        self.locator_misses = 0
+        self.events_enabled = CHANGE_EVENTS_ENABLED
+        self.change_event = threading.Event()
+        self.on_change: Optional[Callable[[], None]] = None  # 收到变化事件时额外调用（在事件线程中）
+        self.image_detector: Optional['ImageGreetingDetector'] = None  # 设置后截取图片消息
+        self._changed_windows: Set[int] = set()
+        self._subscriptions: Dict[int, Any] = {}
+        self._events_lock = threading.Lock()
+
+    def wait_until(self, condition: Callable[[], Any], timeout: float = UI_WAIT_TIMEOUT,
+                   interval: float = UI_POLL_INTERVAL, step: str = 'wait') -> Any:
+        """轮询 condition 直到返回真值或超时，返回最后一次的结果
+
+        每次等待的耗时按 step 记录在 wait_times 中。
+        """
+        start = self.clock.monotonic()
+        deadline = start + timeout
+        while True:
+            try:
+                result = condition()
+            except Exception:
+                result = None
+            now = self.clock.monotonic()
+            if result or now >= deadline:
+                break
+            self.clock.sleep(min(interval, deadline - now))
+        self.wait_times[step].append(self.clock.monotonic() - start)
+        if not result:
+            logging.debug("等待 %s 超时（%s 秒）", step, timeout)
+        return result
+
+    def random_sleep(self, min_seconds: float = 0.5, max_seconds: float = 2.0) -> float:
         """随机休眠一段时间"""
         sleep_time = random.uniform(min_seconds, max_seconds)
-        time.sleep(sleep_time)
+        self.clock.sleep(sleep_time)
         return sleep_time
 
+    def paste_text(self, text: str) -> bool:
+        """通过剪贴板一次性粘贴文本，之后恢复原剪贴板内容
+
+        等输入框中出现该文本后才恢复剪贴板，否则目标程序响应慢时可能粘贴出恢复后的内容；
+        输入框不支持读取内容时无法确认，等待 PASTE_RESTORE_DELAY 秒后恢复；
+        能读取内容但等不到该文本时不恢复。只能恢复文本内容，剪贴板中原有的图片等格式会丢失。
+        """
+        previous = None
+        try:
+            previous = self.backend.get_clipboard_text()
+        except Exception as e:
+            logging.warning(f"读取剪贴板失败: {str(e)}")
+
+        if not self.backend.set_clipboard_text(text):
+            logging.error("写入剪贴板失败")
+            return False
+        self.backend.send_keys('{Ctrl}v')
+
+        if previous is not None:
+            if self._focused_text() is None:
+                self.clock.sleep(PASTE_RESTORE_DELAY)
+            elif not self.wait_until(lambda: text in (self._focused_text() or ''), step='paste'):
+                logging.warning("未能确认粘贴完成，不恢复剪贴板")
+                return True
+            try:
+                self.backend.set_clipboard_text(previous)
+            except Exception as e:
+                logging.warning(f"恢复剪贴板失败: {str(e)}")
+        return True
+
+    def _focused_text(self) -> Optional[str]:
+        """焦点控件的文本，无法读取时返回None"""
+        try:
+            return self.backend.get_focused_text()
+        except Exception:
+            return None
+
+    def get_chat_items(self, chat_list_panel) -> List[CachedChild]:
+        """批量读取会话列表中的所有会话项及其名称"""
+        return self.backend.get_children_with_names(chat_list_panel)
+
     @staticmethod
-    def find_all_wechat_windows() -> List[auto.WindowControl]:
-        """查找所有微信主窗口"""
+    def window_handle(wechat_window: 'auto.WindowControl') -> int:
+        """窗口句柄，作为定位缓存的键"""
+        return wechat_window.NativeWindowHandle
+
+    def account_name(self, wechat_window: 'auto.WindowControl') -> Optional[str]:
+        """窗口登录的微信账号昵称，按窗口句柄缓存；读取不到时返回None"""
+        handle = self.window_handle(wechat_window)
+        if handle not in self._account_names:
+            try:
+                self._account_names[handle] = self.backend.get_account_name(wechat_window) or None
+            except Exception as e:
+                logging.debug(f"读取登录账号失败: {str(e)}")
+                self._account_names[handle] = None
+        return self._account_names[handle]
+
+    @timed('find_windows')
+    def find_all_wechat_windows(self) -> List['auto.WindowControl']:
+        """查找所有微信主窗口
+
+        结果缓存 WINDOW_CACHE_TTL 秒，期间只检查缓存的窗口是否仍然有效，
+        不再遍历整个桌面。
+        """
+        if self._windows_cache and self.clock.monotonic() - self._windows_cached_at < WINDOW_CACHE_TTL:
+            if all(self.backend.is_control_alive(window) for window in self._windows_cache):
+                return list(self._windows_cache)
+            logging.info("缓存的微信窗口已失效，重新查找")
+        self._windows_cache = []
+
         try:
             wechat_windows = []
-            all_windows = auto.GetRootControl().GetChildren()
+            all_windows = self.backend.get_root_control().GetChildren()
             for window in all_windows:
                 try:
                     if window.ClassName == 'WeChatMainWndForPC':
@@ -29,64 +148,194 @@ class UIAutomation:
                 logging.error("未找到任何微信窗口，请确保微信已登录并打开")
                 return []
             
-            logging.info(f"找到 {len(wechat_windows)} 个微信窗口")
-            return wechat_windows
+            logging.info("找到 %s 个微信窗口", len(wechat_windows))
+            self._windows_cache = wechat_windows
+            self._windows_cached_at = self.clock.monotonic()
+            return list(wechat_windows)
         except Exception as e:
             logging.error(f"查找微信窗口时出错: {str(e)}")
             return []
 
-    @staticmethod
-    def find_chat_list_panel(wechat_window: auto.WindowControl) -> Optional[auto.ListControl]:
-        """查找会话列表面板"""
+    @timed('find_panel')
+    def find_chat_list_panel(self, wechat_window: 'auto.WindowControl') -> Optional['auto.ListControl']:
+        """查找会话列表面板
+
+        按窗口句柄缓存找到的面板和生效的查找方法，缓存有效时直接返回；
+        面板失效后优先用上次生效的方法重新查找。
+        """
         try:
+            handle = self.window_handle(wechat_window)
+            cached = self._panel_cache.get(handle)
+            if cached:
+                panel, method = cached
+                if self.backend.is_control_alive(panel):
+                    self.locator_hits += 1
+                    return panel
+                logging.info("缓存的会话列表已失效（%s），重新查找", method)
+                del self._panel_cache[handle]
+                self._unsubscribe(handle)
+
+            self.locator_misses += 1
+            panel, method = self._search_chat_list_panel(wechat_window, cached[1] if cached else None)
+            if panel:
+                self._panel_cache[handle] = (panel, method)
+                self._subscribe(handle, panel)
+            return panel
+        except Exception as e:
+            logging.error(f"查找会话列表面板时出错: {str(e)}")
+            return None
+
+    def _search_chat_list_panel(self, wechat_window: 'auto.WindowControl',
+                                preferred: Optional[str] = None) -> Tuple[Optional['auto.ListControl'], Optional[str]]:
+        """依次尝试各查找方法，返回 (面板, 生效的方法)"""
+        def by_list_control():
             # 方法1：直接查找ListBox
             panel = wechat_window.ListControl(Name="会话")
-            if panel.Exists():
-                logging.info("通过ListControl找到会话列表")
-                return panel
+            return panel if panel.Exists() else None
 
+        def by_pane_class():
             # 方法2：查找特定类名的面板
             panel = wechat_window.PaneControl(ClassName="ListBox")
-            if panel.Exists():
-                logging.info("通过PaneControl找到会话列表")
-                return panel
+            return panel if panel.Exists() else None
 
+        def by_left_panel():
             # 方法3：通过层级查找
             left_panel = wechat_window.PaneControl(Name="左侧区域")
             if left_panel.Exists():
                 panel = left_panel.ListControl()
                 if panel.Exists():
-                    logging.info("通过左侧区域找到会话列表")
                     return panel
+            return None
 
+        def by_children():
             # 方法4：遍历所有面板
-            all_panes = wechat_window.GetChildren()
-            for pane in all_panes:
+            for pane in wechat_window.GetChildren():
                 try:
                     if pane.ClassName in ["ListBox", "List", "ListView"]:
-                        logging.info(f"通过遍历找到可能的会话列表: {pane.ClassName}")
                         return pane
                 except:
                     continue
-
-            logging.error("未找到会话列表面板")
             return None
-        except Exception as e:
-            logging.error(f"查找会话列表面板时出错: {str(e)}")
+
+        methods = [
+            ("ListControl", by_list_control),
+            ("PaneControl", by_pane_class),
+            ("左侧区域", by_left_panel),
+            ("遍历子控件", by_children),
+        ]
+        if preferred:
+            methods.sort(key=lambda m: m[0] != preferred)
+
+        for method, search in methods:
+            panel = search()
+            if panel:
+                logging.info("通过%s找到会话列表", method)
+                return panel, method
+
+        logging.error("未找到会话列表面板")
+        return None, None
+
+    def _subscribe(self, handle: int, panel):
+        """订阅会话列表的变化事件，后端不支持时退回轮询"""
+        if not self.events_enabled:
+            return
+
+        def on_change():
+            with self._events_lock:
+                self._changed_windows.add(handle)
+            self.change_event.set()
+            if self.on_change:
+                self.on_change()
+
+        if self.backend.subscribe_changes(panel, on_change):
+            self._subscriptions[handle] = panel
+            logging.info("已订阅会话列表变化事件")
+        else:
+            logging.warning("无法订阅会话列表变化事件，改为定时轮询")
+            self.events_enabled = False
+
+    def _unsubscribe(self, handle: int):
+        panel = self._subscriptions.pop(handle, None)
+        if panel is not None:
+            self.backend.unsubscribe_changes(panel)
+
+    def events_active(self) -> bool:
+        """是否有窗口正在通过事件通知会话列表变化"""
+        return bool(self._subscriptions)
+
+    def pop_changed_windows(self) -> Set[int]:
+        """取出自上次调用以来收到变化事件的窗口句柄"""
+        with self._events_lock:
+            changed, self._changed_windows = self._changed_windows, set()
+        return changed
+
+    def locator_stats(self) -> dict:
+        """会话列表定位缓存的命中统计"""
+        return {'cached_windows': len(self._panel_cache), 'hits': self.locator_hits, 'misses': self.locator_misses}
+
+    def read_message_items(self, wechat_window: 'auto.WindowControl') -> Optional[List[CachedChild]]:
+        """一次批量读取消息列表中的所有消息项，找不到消息列表时返回None"""
+        message_list = wechat_window.ListControl(Name="消息")
+        if not message_list.Exists(0, 0):
             return None
+        return self.backend.get_children_with_names(message_list)
+
+    def read_message_list(self, wechat_window: 'auto.WindowControl') -> Optional[List[str]]:
+        """一次批量读取消息列表中所有消息的内容，找不到消息列表时返回None"""
+        items = self.read_message_items(wechat_window)
+        return None if items is None else [item.name for item in items]
 
     @staticmethod
-    def get_last_message(wechat_window: auto.WindowControl) -> Optional[str]:
-        """获取最后一条消息内容"""
-        try:
-            time.sleep(1)
-            message_list = wechat_window.ListControl(Name="消息")
-            if message_list.Exists():
-                messages = message_list.GetChildren()
-                if messages:
-                    last_message = messages[-1]
-                    return last_message.Name
+    def is_tip(name: str) -> bool:
+        """消息列表项是否是时间分隔或系统提示"""
+        return _TIP_PATTERN.fullmatch(name.strip()) is not None
+
+    def describe_message(self, item: CachedChild) -> str:
+        """消息内容；图片和表情消息截图后返回带感知哈希的占位文本，截图失败时返回原名称"""
+        if not self.image_detector or item.name not in IMAGE_MESSAGE_NAMES:
+            return item.name
+        with metrics.timer('capture', self.clock):
+            try:
+                image = self.backend.capture_image(item.control)
+            except Exception as e:
+                logging.debug("截取图片消息失败: %s", e)
+                image = None
+            return self.image_detector.register(image) if image else item.name
+
+    def message_list_signature(self, wechat_window: 'auto.WindowControl') -> Optional[Tuple[int, str]]:
+        """消息列表的 (消息数, 最后一条消息)，用于判断列表是否已切换"""
+        messages = self.read_message_list(wechat_window)
+        if not messages:
             return None
+        return len(messages), messages[-1]
+
+    @timed('read')
+    def get_unread_messages(self, wechat_window: 'auto.WindowControl', count: int,
+                            previous: Optional[Tuple[int, str]] = None) -> List[str]:
+        """获取最后 count 条消息（即会话的未读消息），按收到的先后排列
+
+        时间分隔和系统提示（MESSAGE_TIP_PATTERNS）不是消息，先去掉再取最后 count 条。
+        previous 为点击会话前的消息列表签名，等待列表变化后再读取，
+        最多等待 MESSAGE_RENDER_TIMEOUT 秒。列表变化时读到的内容直接使用，不再重复读取。
+        """
+        try:
+            def rendered():
+                items = self.read_message_items(wechat_window)
+                if not items or (len(items), items[-1].name) == previous:
+                    return None
+                return items
+
+            items = self.wait_until(rendered, MESSAGE_RENDER_TIMEOUT, step='message_list')
+            if items is None:
+                items = self.read_message_items(wechat_window) or []
+            messages = [item for item in items if not self.is_tip(item.name)]
+            return [self.describe_message(item) for item in messages[-max(count, 1):]]
         except Exception as e:
-            logging.error(f"获取最后一条消息时出错: {str(e)}")
-            return None 
\ No newline at end of file
+            logging.error(f"获取未读消息时出错: {str(e)}")
+            return []
+
+    def get_last_message(self, wechat_window: 'auto.WindowControl',
+                         previous: Optional[Tuple[int, str]] = None) -> Optional[str]:
+        """获取最后一条消息内容"""
+        messages = self.get_unread_messages(wechat_window, 1, previous)
+        return messages[-1] if messages else None
@@ -0,0 +1,171 @@
+import logging
+from typing import Callable, List, Optional
+
+from .image_greeting import CapturedImage
+
+
+class CachedChild:
+    """批量读取得到的子控件：名称已缓存，需要操作时才创建控件对象"""
+
+    def __init__(self, name: str, factory: Callable[[], object]):
+        self.name = name
+        self._factory = factory
+        self._control = None
+        self._value: Optional[str] = None
+
+    @property
+    def control(self):
+        if self._control is None:
+            self._control = self._factory()
+        return self._control
+
+    @property
+    def value(self) -> str:
+        """ValuePattern 的值，首次访问时才读取"""
+        if self._value is None:
+            try:
+                self._value = self.control.GetValuePattern().Value
+            except Exception:
+                self._value = ""
+        return self._value
+
+
+class UIABackend:
+    """基于uiautomation的真实桌面后端
+
+    会话列表、消息列表等控件直接使用uiautomation的Control对象，
+    这里只封装模块级的操作（根控件、鼠标、键盘），以便替换为模拟器后端。
+    """
+
+    def __init__(self):
+        import uiautomation as auto
+        self.auto = auto
+        self._event_handlers = {}
+
+    def get_root_control(self):
+        """获取桌面根控件"""
+        return self.auto.GetRootControl()
+
+    def get_children_with_names(self, control) -> List[CachedChild]:
+        """通过UIA缓存请求一次取回所有子元素及其名称
+
+        GetChildren 会逐个遍历子元素，之后每读一次 Name 又是一次跨进程调用；
+        缓存请求只需一次调用。失败时退回逐个读取。
+        """
+        try:
+            client = self.auto._AutomationClient.instance().IUIAutomation
+            request = client.CreateCacheRequest()
+            request.AddProperty(self.auto.PropertyId.NameProperty)
+            elements = control.Element.FindAllBuildCache(
+                self.auto.TreeScope.Children, client.CreateTrueCondition(), request
+            )
+            children = []
+            for i in range(elements.Length):
+                element = elements.GetElement(i)
+                children.append(CachedChild(
+                    element.CachedName,
+                    lambda element=element: self.auto.Control.CreateControlFromElement(element)
+                ))
+            return children
+        except Exception as e:
+            logging.debug("批量读取子控件失败，改为逐个读取: %s", e)
+            return [CachedChild(child.Name, lambda child=child: child) for child in control.GetChildren()]
+
+    def subscribe_changes(self, control, callback: Callable[[], None]) -> bool:
+        """订阅控件子树的结构变化和名称变化事件，不支持时返回False
+
+        callback 在UIA的事件线程中调用，只应做轻量的通知。
+        """
+        try:
+            import comtypes
+            from comtypes.gen import UIAutomationClient as uia
+
+            class ChangeHandler(comtypes.COMObject):
+                _com_interfaces_ = [
+                    uia.IUIAutomationStructureChangedEventHandler,
+                    uia.IUIAutomationPropertyChangedEventHandler,
+                ]
+
+                def HandleStructureChangedEvent(self, sender, changeType, runtimeId):
+                    callback()
+
+                def HandlePropertyChangedEvent(self, sender, propertyId, newValue):
+                    callback()
+
+            client = self.auto._AutomationClient.instance().IUIAutomation
+            handler = ChangeHandler()
+            client.AddStructureChangedEventHandler(control.Element, uia.TreeScope_Subtree, None, handler)
+            client.AddPropertyChangedEventHandler(
+                control.Element, uia.TreeScope_Subtree, None, handler, [self.auto.PropertyId.NameProperty]
+            )
+            self._event_handlers[id(control)] = (control, handler)
+            return True
+        except Exception as e:
+            logging.debug(f"订阅界面变化事件失败: {str(e)}")
+            return False
+
+    def unsubscribe_changes(self, control):
+        """取消 subscribe_changes 的订阅"""
+        entry = self._event_handlers.pop(id(control), None)
+        if not entry:
+            return
+        try:
+            client = self.auto._AutomationClient.instance().IUIAutomation
+            client.RemoveStructureChangedEventHandler(control.Element, entry[1])
+            client.RemovePropertyChangedEventHandler(control.Element, entry[1])
+        except Exception as e:
+            logging.debug(f"取消订阅界面变化事件失败: {str(e)}")
+
+    def capture_image(self, control) -> Optional[CapturedImage]:
+        """截取控件所在的屏幕区域（控件需在屏幕上可见），失败时返回None"""
+        bitmap = control.ToBitmap()
+        if not bitmap or not bitmap.Width or not bitmap.Height:
+            return None
+        pixels = [color & 0xFFFFFF for color in bitmap.GetAllPixelColors()]
+        return CapturedImage(bitmap.Width, bitmap.Height, pixels)
+
+    def get_account_name(self, window) -> Optional[str]:
+        """窗口登录的账号昵称：左侧导航栏第一个按钮（头像）的名称"""
+        button = window.ToolBarControl(Name='导航').ButtonControl(searchDepth=1)
+        return button.Name if button.Exists(0, 0) else None
+
+    def click(self, x: int, y: int):
+        """点击屏幕坐标"""
+        self.auto.Click(x, y)
+
+    def send_keys(self, keys: str):
+        """发送按键"""
+        self.auto.SendKeys(keys)
+
+    def get_focused_text(self) -> Optional[str]:
+        """当前焦点控件（如聊天输入框）的文本，不支持 ValuePattern 时返回None"""
+        pattern = self.auto.GetFocusedControl().GetValuePattern()
+        return pattern.Value if pattern else None
+
+    def get_clipboard_text(self) -> str:
+        """读取剪贴板文本"""
+        return self.auto.GetClipboardText()
+
+    def set_clipboard_text(self, text: str) -> bool:
+        """写入剪贴板文本"""
+        return self.auto.SetClipboardText(text)
+
+    def is_cancel_pressed(self) -> bool:
+        """是否按下了取消发送的 Ctrl+Q"""
+        return self.auto.IsKeyPressed(self.auto.Keys.VK_Q) and self.auto.IsKeyPressed(self.auto.Keys.VK_CONTROL)
+
+    def is_control_alive(self, control) -> bool:
+        """控件对应的界面元素是否仍然有效（读取一次属性，元素失效时会抛出异常）"""
+        try:
+            return control.Element.CurrentProcessId != 0
+        except Exception:
+            return False
+
+    def is_foreground(self, window) -> bool:
+        """窗口是否在前台"""
+        return self.auto.GetForegroundWindow() == window.NativeWindowHandle
+
+    def is_maximized(self, window) -> bool:
+        """窗口是否已最大化"""
+        window_pattern = window.GetWindowPattern()
+        return bool(window_pattern) and window_pattern.Current.WindowVisualState == self.auto.WindowVisualState.Maximized
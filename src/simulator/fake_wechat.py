@@ -0,0 +1,520 @@
+import heapq
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from ..services.image_greeting import CapturedImage
+from ..services.ui_backend import CachedChild
+from ..utils.clock import Clock
+
+WECHAT_CLASS_NAME = 'WeChatMainWndForPC'
+TIME_TIP_GAP = 300  # 与上一条消息间隔超过此时间(秒)时，消息列表中先插入一条时间分隔（与微信一致）
+
+# 各类UI操作的模拟耗时(秒)，默认值参照uiautomation的默认等待时间
+DEFAULT_LATENCY = {
+    'property': 0.002,         # 读取一次控件属性（一次跨进程COM调用）
+    'get_children': 0.005,     # GetChildren 固定开销
+    'get_children_item': 0.002,  # GetChildren 每个子项的开销（TreeWalker逐个遍历，每项一次跨进程调用）
+    'cache_item': 0.0001,      # UIA缓存请求中每个子项的开销
+    'find': 0.05,              # ListControl/PaneControl 查找（FindFirst 遍历控件树）
+    'focus': 0.05,             # SetFocus
+    'click': 0.05,             # 鼠标点击
+    'mouse_move': 0.3,         # simulateMove=True 时的鼠标移动
+    'operation_wait': 0.5,     # uiautomation Click/SendKeys 默认的操作后等待(OPERATION_WAIT_TIME)
+    'send_keys_char': 0.01,    # SendKeys 每个字符的间隔
+    'maximize': 0.2,           # 最大化窗口
+    'render': 0.3,             # 点击会话后消息列表刷新所需时间
+    'capture': 0.03,           # 截取一个控件的图片(ToBitmap)
+}
+
+
+@dataclass
+class Rect:
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+
+@dataclass
+class Conversation:
+    contact: str
+    messages: List[str] = field(default_factory=list)
+    unread: int = 0
+    pinned: bool = False
+    last_active: float = 0.0
+
+
+class ImageMessage(str):
+    """图片或表情消息：字符串值为消息列表中显示的名称，image 为图片内容"""
+
+    def __new__(cls, image: CapturedImage, text: str = '[图片]'):
+        message = super().__new__(cls, text)
+        message.image = image
+        return message
+
+
+@dataclass
+class MessageRecord:
+    time: float
+    window_index: int
+    contact: str
+    text: str
+
+
+class _MissingControl:
+    """未找到的控件，与uiautomation一样 Exists() 返回 False"""
+
+    def Exists(self, maxSearchSeconds: float = 0, searchIntervalSeconds: float = 0) -> bool:
+        return False
+
+    def __getattr__(self, name):
+        raise LookupError(f"控件不存在，无法访问 {name}")
+
+
+class FakeControl:
+    """模拟的uiautomation控件，只实现本项目用到的接口"""
+
+    ControlTypeName = 'Control'
+
+    def __init__(self, sim: 'FakeWeChat', name: str = '', class_name: str = '', children=None):
+        self._sim = sim
+        self._name = name
+        self._class_name = class_name
+        self._children = children or []
+        self._alive = True
+
+    @property
+    def Name(self) -> str:
+        self._sim.cost('property')
+        return self._get_name()
+
+    @property
+    def ClassName(self) -> str:
+        self._sim.cost('property')
+        return self._class_name
+
+    @property
+    def BoundingRectangle(self) -> Rect:
+        self._sim.cost('property')
+        return Rect(0, 0, 1280, 800)
+
+    def _get_name(self) -> str:
+        return self._name
+
+    def _get_children(self) -> list:
+        return list(self._children)
+
+    def Exists(self, maxSearchSeconds: float = 0, searchIntervalSeconds: float = 0) -> bool:
+        return True
+
+    def GetChildren(self) -> list:
+        children = self._get_children()
+        self._sim.cost('get_children')
+        self._sim.cost('get_children_item', len(children))
+        return children
+
+    def SetFocus(self) -> bool:
+        self._sim.cost('focus')
+        return True
+
+    def Click(self, x: int = None, y: int = None, simulateMove: bool = True, waitTime: float = None) -> None:
+        # 与uiautomation一致，Click 没有返回值
+        if simulateMove:
+            self._sim.cost('mouse_move')
+        self._sim.cost('click')
+        self._on_click()
+        self._sim.clock.sleep(self._sim.latency['operation_wait'] if waitTime is None else waitTime)
+
+    def _on_click(self):
+        pass
+
+    def GetValuePattern(self):
+        # 会话项不支持ValuePattern，真实环境同样返回None
+        self._sim.cost('property')
+        return None
+
+    def ListControl(self, **conditions):
+        return self._find('ListControl', conditions)
+
+    def PaneControl(self, **conditions):
+        return self._find('PaneControl', conditions)
+
+    def _find(self, control_type: str, conditions: dict):
+        self._sim.cost('find')
+        queue = list(self._get_children())
+        while queue:
+            node = queue.pop(0)
+            if node.ControlTypeName == control_type and self._matches(node, conditions):
+                return node
+            queue.extend(node._get_children())
+        return _MissingControl()
+
+    @staticmethod
+    def _matches(node: 'FakeControl', conditions: dict) -> bool:
+        if 'Name' in conditions and node._get_name() != conditions['Name']:
+            return False
+        if 'ClassName' in conditions and node._class_name != conditions['ClassName']:
+            return False
+        return True
+
+
+class FakeChatItem(FakeControl):
+    ControlTypeName = 'ListItemControl'
+
+    def __init__(self, sim: 'FakeWeChat', window: 'FakeWindow', conversation: Conversation):
+        super().__init__(sim, class_name='')
+        self._window = window
+        self._conversation = conversation
+
+    def _get_name(self) -> str:
+        conversation = self._conversation
+        name = conversation.contact
+        if conversation.unread:
+            name += f"{conversation.unread}条新消息"
+        if conversation.pinned:
+            name += "已置顶"
+        return name
+
+    def _on_click(self):
+        self._window.select(self._conversation.contact)
+
+
+class FakeChatList(FakeControl):
+    ControlTypeName = 'ListControl'
+
+    def __init__(self, sim: 'FakeWeChat', window: 'FakeWindow'):
+        super().__init__(sim, name='会话', class_name='')
+        self._window = window
+
+    def _get_children(self) -> list:
+        with self._sim.lock:
+            conversations = sorted(
+                self._window.conversations.values(),
+                key=lambda c: (c.pinned, c.last_active),
+                reverse=True
+            )
+        return [FakeChatItem(self._sim, self._window, c) for c in conversations]
+
+
+class FakeMessageList(FakeControl):
+    ControlTypeName = 'ListControl'
+
+    def __init__(self, sim: 'FakeWeChat', window: 'FakeWindow'):
+        super().__init__(sim, name='消息', class_name='')
+        self._window = window
+
+    def _get_children(self) -> list:
+        with self._sim.lock:
+            conversation = self._window.displayed_conversation()
+            messages = list(conversation.messages) if conversation else []
+        return [FakeMessageItem(self._sim, message) for message in messages]
+
+
+class FakeMessageItem(FakeControl):
+    ControlTypeName = 'ListItemControl'
+
+    def __init__(self, sim: 'FakeWeChat', message: str):
+        super().__init__(sim, name=message, class_name='')
+        self.image: Optional[CapturedImage] = getattr(message, 'image', None)
+
+
+class FakeWindow(FakeControl):
+    ControlTypeName = 'WindowControl'
+
+    def __init__(self, sim: 'FakeWeChat', index: int):
+        super().__init__(sim, name='微信', class_name=WECHAT_CLASS_NAME)
+        self.index = index
+        self.handle = 0x10000 + index
+        self.account = f"账号{index + 1}"
+        self.conversations: Dict[str, Conversation] = {}
+        self.selected: Optional[str] = None
+        self.render_at = 0.0
+        self.displayed: Optional[str] = None
+        self.input_focused = False
+        self.input_buffer = ''
+        self.maximized = False
+        self._children = [FakeChatList(sim, self), FakeMessageList(sim, self)]
+
+    @property
+    def NativeWindowHandle(self) -> int:
+        self._sim.cost('property')
+        return self.handle
+
+    def SetFocus(self) -> bool:
+        self._sim.cost('focus')
+        with self._sim.lock:
+            if self._sim.foreground is not self:
+                self._sim.focus_changes += 1
+            self._sim.foreground = self
+        return True
+
+    def rebuild(self):
+        """重建窗口内的控件（如微信刷新界面），原有控件随之失效"""
+        with self._sim.lock:
+            for child in self._children:
+                child._alive = False
+            self._children = [FakeChatList(self._sim, self), FakeMessageList(self._sim, self)]
+
+    def Maximize(self):
+        self._sim.cost('maximize')
+        self.maximized = True
+
+    def select(self, contact: str):
+        """选中会话，消息列表在渲染延迟之后才切换"""
+        with self._sim.lock:
+            conversation = self.conversations[contact]
+            if conversation.unread:
+                conversation.unread = 0
+                self._sim.notify(self.index)
+            if self.selected != contact:
+                self.selected = contact
+                self.input_buffer = ''
+                self.render_at = self._sim.clock.time() + self._sim.latency['render']
+
+    def displayed_conversation(self) -> Optional[Conversation]:
+        if self.selected and self._sim.clock.time() >= self.render_at:
+            self.displayed = self.selected
+        return self.conversations.get(self.displayed) if self.displayed else None
+
+    @staticmethod
+    def in_input_area(x: int, y: int) -> bool:
+        return x > 300 and y > 650
+
+
+class FakeWeChat:
+    """内存中的微信桌面模拟器
+
+    模拟若干个微信主窗口，每个窗口包含"会话"列表和"消息"列表，
+    按脚本在指定时间投递新消息，并记录机器人发出的回复。
+    所有UI操作都会按 latency 中的耗时在 clock 上休眠。
+    """
+
+    def __init__(self, clock: Optional[Clock] = None, window_count: int = 1, latency: Optional[dict] = None,
+                 other_windows: int = 20):
+        self.clock = clock or Clock()
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.lock = threading.RLock()
+        self.windows = [FakeWindow(self, i) for i in range(window_count)]
+        self.root = FakeControl(self, name='桌面', children=[
+            *(FakeControl(self, name=f'其他程序{i + 1}', class_name='Chrome_WidgetWin_1') for i in range(other_windows)),
+            *self.windows
+        ])
+        self.foreground: Optional[FakeWindow] = None
+        self.clipboard = ''
+        self.arrivals: List[MessageRecord] = []
+        self.sent: List[MessageRecord] = []
+        self.dropped_keys = 0
+        self.ui_calls = 0
+        self.focus_changes = 0
+        self._schedule = []
+        self._seq = itertools.count()
+        self._listeners: Dict[int, list] = {}
+        self._event_thread: Optional[threading.Thread] = None
+
+    def cost(self, operation: str, count: int = 1):
+        """模拟一次UI操作的耗时，同时投递到期的消息"""
+        self.pump()
+        if count > 0:
+            self.ui_calls += 1
+            self.clock.sleep(self.latency[operation] * count)
+
+    def subscribe(self, window: 'FakeWindow', callback):
+        """订阅窗口会话列表的变化，并启动后台线程按时投递消息"""
+        with self.lock:
+            self._listeners.setdefault(window.index, []).append(callback)
+            if self._event_thread is None:
+                self._event_thread = threading.Thread(target=self._deliver_loop, daemon=True)
+                self._event_thread.start()
+
+    def unsubscribe(self, window: 'FakeWindow', callback):
+        with self.lock:
+            callbacks = self._listeners.get(window.index, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def notify(self, window_index: int):
+        for callback in list(self._listeners.get(window_index, [])):
+            callback()
+
+    def _deliver_loop(self):
+        while True:
+            with self.lock:
+                next_at = self._schedule[0][0] if self._schedule else None
+            self.clock.sleep(min(0.5, next_at - self.clock.time()) if next_at else 0.5)
+            self.pump()
+
+    def add_contact(self, contact: str, window_index: int = 0, pinned: bool = False, messages=()):
+        with self.lock:
+            self.windows[window_index].conversations[contact] = Conversation(
+                contact, list(messages), pinned=pinned, last_active=self.clock.time()
+            )
+
+    def schedule_message(self, delay: float, contact: str, text: str, window_index: int = 0):
+        """在 delay 秒后向指定窗口投递一条来自 contact 的消息"""
+        with self.lock:
+            heapq.heappush(self._schedule, (self.clock.time() + delay, next(self._seq), window_index, contact, text))
+
+    def schedule_image(self, delay: float, contact: str, image: CapturedImage, window_index: int = 0,
+                       text: str = '[图片]'):
+        """在 delay 秒后投递一条图片消息"""
+        self.schedule_message(delay, contact, ImageMessage(image, text), window_index)
+
+    def pending_arrivals(self) -> int:
+        with self.lock:
+            return len(self._schedule)
+
+    def unread_conversations(self) -> int:
+        """有未读消息的会话数"""
+        with self.lock:
+            return sum(1 for window in self.windows for c in window.conversations.values() if c.unread)
+
+    def pump(self):
+        """投递所有到期的消息"""
+        now = self.clock.time()
+        changed = set()
+        with self.lock:
+            while self._schedule and self._schedule[0][0] <= now:
+                at, _, window_index, contact, text = heapq.heappop(self._schedule)
+                window = self.windows[window_index]
+                conversation = window.conversations.get(contact)
+                if conversation is None:
+                    conversation = window.conversations[contact] = Conversation(contact)
+                if not conversation.messages or at - conversation.last_active > TIME_TIP_GAP:
+                    conversation.messages.append(time.strftime('%H:%M', time.localtime(at)))
+                conversation.messages.append(text)
+                conversation.unread += 1
+                conversation.last_active = at
+                self.arrivals.append(MessageRecord(at, window_index, contact, text))
+                changed.add(window_index)
+        for window_index in changed:
+            self.notify(window_index)
+
+    def type_keys(self, keys: str):
+        """按uiautomation的SendKeys语法处理按键"""
+        with self.lock:
+            window = self.foreground
+            i = 0
+            while i < len(keys):
+                if keys[i] == '{':
+                    end = keys.find('}', i)
+                    token = keys[i + 1:end].lower() if end != -1 else ''
+                    i = end + 1 if end != -1 else len(keys)
+                    if token == 'enter':
+                        self._send_input(window)
+                    elif token == 'alt':
+                        # {Alt}1 之类的快捷键，跳过紧跟的字符
+                        i += 1
+                    elif token == 'ctrl':
+                        if keys[i:i + 1].lower() == 'v':
+                            self._paste(window)
+                        i += 1
+                    continue
+                if window and window.input_focused:
+                    window.input_buffer += keys[i]
+                else:
+                    self.dropped_keys += 1
+                i += 1
+
+    def _paste(self, window: Optional[FakeWindow]):
+        if window and window.input_focused:
+            window.input_buffer += self.clipboard
+        else:
+            self.dropped_keys += 1
+
+    def _send_input(self, window: Optional[FakeWindow]):
+        if not window or not window.input_focused or not window.input_buffer:
+            return
+        conversation = window.displayed_conversation()
+        if conversation is None:
+            return
+        text = window.input_buffer
+        window.input_buffer = ''
+        now = self.clock.time()
+        conversation.messages.append(text)
+        conversation.last_active = now
+        self.sent.append(MessageRecord(now, window.index, conversation.contact, text))
+        self.notify(window.index)
+
+
+class FakeUIBackend:
+    """与UIABackend接口一致的模拟器后端"""
+
+    def __init__(self, wechat: FakeWeChat, batch: bool = True):
+        self.wechat = wechat
+        self.batch = batch
+        self._subscriptions = {}
+
+    def get_root_control(self):
+        self.wechat.cost('find')
+        return self.wechat.root
+
+    def get_children_with_names(self, control) -> List[CachedChild]:
+        if not self.batch:
+            return [CachedChild(child.Name, lambda child=child: child) for child in control.GetChildren()]
+        children = control._get_children()
+        self.wechat.cost('property')
+        self.wechat.cost('cache_item', len(children))
+        return [CachedChild(child._get_name(), lambda child=child: child) for child in children]
+
+    def subscribe_changes(self, control, callback) -> bool:
+        window = getattr(control, '_window', None)
+        if window is None:
+            return False
+        self.wechat.subscribe(window, callback)
+        self._subscriptions[id(control)] = (window, callback)
+        return True
+
+    def unsubscribe_changes(self, control):
+        entry = self._subscriptions.pop(id(control), None)
+        if entry:
+            self.wechat.unsubscribe(*entry)
+
+    def get_account_name(self, window) -> Optional[str]:
+        self.wechat.cost('property')
+        return window.account
+
+    def click(self, x: int, y: int):
+        self.wechat.cost('click')
+        window = self.wechat.foreground
+        if window:
+            window.input_focused = window.in_input_area(x, y)
+        self.wechat.cost('operation_wait')
+
+    def send_keys(self, keys: str):
+        self.wechat.cost('send_keys_char', len(keys))
+        self.wechat.type_keys(keys)
+        self.wechat.cost('operation_wait')
+
+    def get_focused_text(self) -> Optional[str]:
+        self.wechat.cost('property')
+        window = self.wechat.foreground
+        return window.input_buffer if window and window.input_focused else None
+
+    def get_clipboard_text(self) -> str:
+        self.wechat.cost('property')
+        return self.wechat.clipboard
+
+    def set_clipboard_text(self, text: str) -> bool:
+        self.wechat.cost('property')
+        self.wechat.clipboard = text
+        return True
+
+    def capture_image(self, control) -> Optional[CapturedImage]:
+        self.wechat.cost('capture')
+        return getattr(control, 'image', None)
+
+    def is_cancel_pressed(self) -> bool:
+        return False
+
+    def is_control_alive(self, control) -> bool:
+        self.wechat.cost('property')
+        return control._alive
+
+    def is_foreground(self, window) -> bool:
+        return self.wechat.foreground is window
+
+    def is_maximized(self, window) -> bool:
+        return window.maximized
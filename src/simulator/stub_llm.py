@@ -0,0 +1,139 @@
+import base64
+import itertools
+import threading
+from typing import Callable, Dict, List, Optional
+
+from ..services.image_greeting import CapturedImage
+from ..utils.clock import Clock
+
+DEFAULT_REPLIES = [
+    '谢谢您的祝福祝您蛇年吉祥事业蒸蒸日上阖家幸福安康',
+    '感谢您的问候愿您灵蛇献智福寿双全万事顺遂',
+    '谢谢您愿新的一年金蛇送福身体健康家庭美满',
+    '感恩有您祝您蛇年大展宏图福运连连平安喜乐',
+    '谢谢祝福愿您蛇行顺畅事业兴旺合家欢乐',
+    '感谢惦记祝您祥蛇纳福前程似锦岁岁安康',
+    '谢谢您的心意愿您金蛇献瑞财源广进笑口常开',
+    '感恩相伴祝您灵蛇添福步步高升家和业兴',
+    '谢谢挂念愿您祥蛇报喜福寿安康好运连连',
+    '感谢您的祝福祝您蛇年如意事业腾飞合家团圆',
+    '谢谢您愿您灵蛇呈祥身体康健诸事顺心',
+    '感恩遇见祝您金蛇纳福鸿运当头阖家吉祥',
+]
+
+DEFAULT_GREETING_MARKERS = ('万事', '心想事成', '阖家', '安康', '兴旺', '步步高升')
+
+
+def is_red_card(image: CapturedImage) -> bool:
+    """默认的图片判断：红色为主的图片视为拜年贺卡"""
+    red = sum(1 for color in image.pixels if (color >> 16) & 0xFF > 2 * max((color >> 8) & 0xFF, color & 0xFF))
+    return red * 2 > len(image.pixels)
+
+THINK_TEXT = '好的，我需要先理解用户的消息，再按照要求给出回答。'
+TAIL_TEXT = '这条回复符合要求，表达了感谢与祝福。'
+
+
+class StubLLMClient:
+    """模拟Ollama generate接口的桩模型
+
+    按 prompt_latency + prompt 每个字的 prompt_char_interval + 每个输出token的 token_interval 计算耗时，
+    输出带 <think> 推理块、答案后常附带解释的 deepseek-r1 风格文本。
+    parallel 限制同时处理的请求数，与Ollama服务端默认串行处理请求一致。
+    model_speed 为各模型的耗时倍数（未列出的模型为1），用于模拟不同大小的模型。
+    omit_every > 0 时批量判断每 omit_every 条漏答一条，用于测试部分失败的处理。
+    stream=True 时逐token返回，关闭生成器即停止生成。
+    带 images 的请求模拟视觉模型：每张图耗时 vision_latency，由 is_greeting_image 回答"是"/"否"，
+    最多 vision_parallel 个同时进行，与文字请求互不占用。
+    """
+
+    def __init__(self, clock: Optional[Clock] = None, prompt_latency: float = 0.5,
+                 token_interval: float = 0.03, think_tokens: int = 150, tail_tokens: int = 20,
+                 parallel: int = 1, model_speed: Optional[Dict[str, float]] = None,
+                 prompt_char_interval: float = 0.0, omit_every: int = 0,
+                 is_greeting: Optional[Callable[[str], bool]] = None,
+                 replies: Optional[List[str]] = None, vision_latency: float = 3.0, vision_parallel: int = 1,
+                 is_greeting_image: Optional[Callable[[CapturedImage], bool]] = None):
+        self.clock = clock or Clock()
+        self.prompt_latency = prompt_latency
+        self.token_interval = token_interval
+        self.think_tokens = think_tokens
+        self.tail_tokens = tail_tokens
+        self.is_greeting = is_greeting or (lambda message: any(m in message for m in DEFAULT_GREETING_MARKERS))
+        self.replies = replies or DEFAULT_REPLIES
+        self.model_speed = model_speed or {}
+        self.prompt_char_interval = prompt_char_interval
+        self.omit_every = omit_every
+        self.vision_latency = vision_latency
+        self.is_greeting_image = is_greeting_image or is_red_card
+        self.vision_calls = 0
+        self.model_calls: Dict[str, int] = {}
+        self.calls = 0
+        self.tokens_generated = 0
+        self._reply_index = itertools.count()
+        self._slots = threading.Semaphore(parallel)
+        self._vision_slots = threading.Semaphore(vision_parallel)
+        self._lock = threading.Lock()
+
+    def _answer(self, prompt: str) -> str:
+        if '逐条回答' in prompt:
+            listing = prompt.split('消息列表：\n', 1)[-1].split('\n\n', 1)[0]
+            answers = []
+            for line in listing.splitlines():
+                number, _, message = line.partition('. ')
+                if self.omit_every and int(number) % self.omit_every == 0:
+                    continue
+                answers.append(f"{number}. {'是' if self.is_greeting(message) else '否'}")
+            return '\n'.join(answers)
+        if '只需要回答一个字' in prompt:
+            message = prompt.split('消息内容：', 1)[-1].split('\n', 1)[0]
+            return '是' if self.is_greeting(message) else '否'
+        return self.replies[next(self._reply_index) % len(self.replies)]
+
+    def _tokens(self, prompt: str) -> List[str]:
+        think = (THINK_TEXT * (self.think_tokens // len(THINK_TEXT) + 1))[:self.think_tokens]
+        tail = (TAIL_TEXT * (self.tail_tokens // len(TAIL_TEXT) + 1))[:self.tail_tokens]
+        tokens = ['<think>', '\n', *think, '\n', '</think>', '\n\n', *self._answer(prompt)]
+        return tokens + ['\n\n', *tail] if tail else tokens
+
+    def _count_tokens(self, count: int):
+        with self._lock:
+            self.tokens_generated += count
+
+    def generate(self, model: str, prompt: str, stream: bool = False, images: Optional[List[str]] = None,
+                 **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.model_calls[model] = self.model_calls.get(model, 0) + 1
+        if images:
+            return self._vision(model, images, stream)
+        tokens = self._tokens(prompt)
+        factor = self.model_speed.get(model, 1.0)
+        prompt_latency = self.prompt_latency + self.prompt_char_interval * len(prompt)
+        if stream:
+            return self._stream(model, tokens, factor, prompt_latency)
+        with self._slots:
+            self.clock.sleep((prompt_latency + self.token_interval * len(tokens)) * factor)
+        self._count_tokens(len(tokens))
+        return {'model': model, 'response': ''.join(tokens), 'done': True}
+
+    def _vision(self, model: str, images: List[str], stream: bool):
+        decoded = [CapturedImage.from_png(base64.b64decode(image)) for image in images]
+        with self._vision_slots:
+            self.clock.sleep(self.vision_latency * len(images) * self.model_speed.get(model, 1.0))
+        with self._lock:
+            self.vision_calls += 1
+        answer = '是' if all(self.is_greeting_image(image) for image in decoded) else '否'
+        if stream:
+            return iter([{'model': model, 'response': answer, 'done': False},
+                         {'model': model, 'response': '', 'done': True}])
+        return {'model': model, 'response': answer, 'done': True}
+
+    def _stream(self, model: str, tokens: List[str], factor: float, prompt_latency: float):
+        with self._slots:
+            # 按截止时间休眠，避免逐token休眠累积误差
+            start = self.clock.monotonic() + prompt_latency * factor
+            for i, token in enumerate(tokens, 1):
+                self.clock.sleep(start + i * self.token_interval * factor - self.clock.monotonic())
+                self._count_tokens(1)
+                yield {'model': model, 'response': token, 'done': False}
+            yield {'model': model, 'response': '', 'done': True}
@@ -0,0 +1,126 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from .stub_llm import StubLLMClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server: '_Server'
+
+    def setup(self):
+        super().setup()
+        # 与 Ollama(Go) 一样关闭Nagle算法，否则响应头和正文分开写时会等待延迟确认
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        stub = self.server.stub
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with stub.lock:
+            stub.requests += 1
+        if self.path != '/api/generate':
+            return self._send_json(404, {'error': 'not found'})
+        if stub.fail:
+            return self._send_json(500, {'error': 'stub failure'})
+        if stub.hang:
+            stub.stopped.wait()
+            return
+
+        model = payload.get('model', '')
+        with stub.lock:
+            loaded = model in stub.loaded
+        if not loaded:
+            time.sleep(stub.load_time)
+            with stub.lock:
+                stub.loaded.add(model)
+                stub.loads += 1
+
+        prompt = payload.get('prompt', '')
+        if not prompt:
+            return self._send_json(200, {'model': model, 'response': '', 'done': True})
+        if not payload.get('stream', True):
+            return self._send_json(200, stub.llm.generate(model, prompt))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        chunks = stub.llm.generate(model, prompt, stream=True)
+        try:
+            for chunk in chunks:
+                data = (json.dumps(chunk, ensure_ascii=False) + '\n').encode('utf-8')
+                self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开，停止生成
+            self.close_connection = True
+        finally:
+            chunks.close()
+
+    def _send_json(self, status: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    stub: 'StubOllamaServer'
+
+
+class StubOllamaServer:
+    """实现 Ollama /api/generate 接口的本地HTTP桩服务，用于测试 OllamaClient
+
+    生成内容和耗时来自 StubLLMClient；模型首次被请求时额外等待 load_time 秒模拟加载，
+    hang=True 时请求一直不返回，fail=True 时返回HTTP 500。
+    """
+
+    def __init__(self, llm: Optional[StubLLMClient] = None, load_time: float = 0.0, host: str = '127.0.0.1',
+                 port: int = 0):
+        self.llm = llm or StubLLMClient(prompt_latency=0.02, token_interval=0.001)
+        self.load_time = load_time
+        self.hang = False
+        self.fail = False
+        self.loaded = set()
+        self.loads = 0
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self._server = _Server((host, port), _Handler)
+        self._server.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'StubOllamaServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,34 @@
+import threading
+import time
+
+
+class Clock:
+    """时钟，scale 大于 1 时按比例加速（供模拟器使用）"""
+
+    def __init__(self, scale: float = 1.0):
+        self.scale = scale
+        self._real_start = time.monotonic()
+        self._wall_start = time.time()
+
+    def time(self) -> float:
+        """当前时间戳(秒)"""
+        if self.scale == 1.0:
+            return time.time()
+        return self._wall_start + (time.monotonic() - self._real_start) * self.scale
+
+    def monotonic(self) -> float:
+        """单调时间(秒)，用于计算耗时"""
+        if self.scale == 1.0:
+            return time.monotonic()
+        return (time.monotonic() - self._real_start) * self.scale
+
+    def sleep(self, seconds: float):
+        """休眠指定的(模拟)秒数"""
+        if seconds > 0:
+            time.sleep(seconds / self.scale)
+
+    def wait(self, event: threading.Event, seconds: float) -> bool:
+        """等待事件被设置，最多等待指定的(模拟)秒数，返回事件是否已设置"""
+        if seconds <= 0:
+            return event.is_set()
+        return event.wait(seconds / self.scale)
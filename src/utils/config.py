@@ -1,26 +1,79 @@
-import logging
-import sys
-
-def setup_logging():
-    """配置日志系统"""
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('wechat_auto_reply.log', encoding='utf-8'),
-            logging.StreamHandler(sys.stdout)
-        ]
-    )
-    logging.getLogger('comtypes').setLevel(logging.ERROR)
+# 日志配置
+LOG_FILE = 'wechat_auto_reply.log'
+LOG_LEVEL = 'INFO'            # 写入日志的最低级别，排查问题时可改为 'DEBUG'
+LOG_CONSOLE_LEVEL = 'INFO'    # 控制台输出的最低级别
+LOG_ASYNC = True              # 日志先放入队列，由后台线程格式化和写入，不阻塞扫描和发送
+LOG_QUEUE_SIZE = 10000        # 日志队列上限，写入跟不上时丢弃新的日志并计数
+LOG_JSON = False              # 日志文件每行一条JSON，便于检索和导入
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 日志文件超过此大小时轮转
+LOG_BACKUP_COUNT = 5          # 保留的历史日志文件数
+LOG_ROTATE_WHEN = None        # 按时间轮转，如 'midnight'；为None时按大小轮转
 
 # 常量配置
 DEFAULT_REPLY_INTERVAL = 60  # 默认回复间隔(秒)
-MIN_OPERATION_INTERVAL = 2   # 最小操作间隔
-DEFAULT_CHECK_INTERVAL = (8, 15)  # 默认检查间隔范围(秒)
+# 自适应轮询：按消息到达速率调整扫描间隔，平均每次扫描遇到约 POLL_TARGET_MESSAGES 条新消息
+POLL_MIN_INTERVAL = 2        # 消息密集时的最短轮询间隔(秒)
+POLL_MAX_INTERVAL = 30       # 空闲时的最长轮询间隔(秒)
+POLL_TARGET_MESSAGES = 1     # 每次扫描期望遇到的新消息数
+POLL_RATE_HALF_LIFE = 60     # 到达速率估计的半衰期(秒)
+POLL_JITTER = 0.2            # 轮询间隔的随机抖动比例
+# 界面操作限速（令牌桶）：{范围: (每秒次数, 允许连续执行的次数)}，点击会话和发送消息都需要取得令牌
+ACTION_RATE_LIMITS = {
+    'global': (1.0, 4),      # 所有微信窗口合计
+    'window': (0.5, 4),      # 每个微信窗口
+    'contact': (0.2, 3),     # 每个联系人（读取消息、回到会话、发送各一次）
+}
+RATE_LIMITER_MAX_KEYS = 1000  # 最多保留的令牌桶数，超出时丢弃最久未用且已补满的
+UI_WAIT_TIMEOUT = 3          # 等待界面状态(窗口前台、最大化等)的最长时间(秒)
+UI_POLL_INTERVAL = 0.05      # 等待界面状态时的轮询间隔(秒)
+MESSAGE_RENDER_TIMEOUT = 1   # 点击会话后等待消息列表刷新的最长时间(秒)
+MAX_UNREAD_MESSAGES = 10     # 每个会话最多读取的未读消息数，多条消息合并判断、合并回复一次
+# 消息列表中不是聊天消息的项（时间分隔、系统提示）的名称，整项匹配的正则表达式，不计入未读消息
+MESSAGE_TIP_PATTERNS = [
+    r'(昨天|前天|星期[一二三四五六日天]|\d{1,2}月\d{1,2}日|\d{4}年\d{1,2}月\d{1,2}日)? ?(凌晨|早上|上午|中午|下午|晚上)?\d{1,2}:\d{2}',
+    r'以下为新消息',
+    r'以上是打招呼的内容',
+    r'.+撤回了一条消息',
+    r'.+拍了拍.+',
+    r'你已添加了.+，现在可以开始聊天了。',
+    r'.+邀请.+加入了群聊',
+    r'.+修改群名为.+',
+]
+WINDOW_CACHE_TTL = 60        # 微信窗口列表的缓存时间(秒)，到期后重新遍历桌面以发现新窗口
+CHANGE_EVENTS_ENABLED = True # 订阅会话列表的UIA变化事件，有变化时立即扫描
+EVENT_POLL_INTERVAL = 60     # 事件模式下的兜底轮询间隔(秒)
+EVENT_MIN_SCAN_GAP = 1       # 事件触发的两次扫描之间的最小间隔(秒)
+MULTI_WINDOW_SCAN = True     # 每轮只读扫描所有微信窗口，只聚焦有新消息的窗口；False时每轮轮流切换一个窗口
 
 # LLM模型配置
 TEXT_MODEL = 'deepseek-r1:8b'
 IMAGE_MODEL = 'llava'
+LLM_STREAMING = True     # 流式接收模型输出，得到可用结果后提前结束生成
+REPLY_MAX_LENGTH = 40    # 回复字数上限
+
+# 按任务分档的模型：从优到快排列，预计耗时超过消息的剩余时间时降到下一档，都来不及时使用兜底结果
+# 默认只用 TEXT_MODEL；先 ollama pull 更小的模型后可加入更快的档位，例如
+# 'classify': ['qwen2.5:1.5b', 'qwen2.5:0.5b'], 'reply': [TEXT_MODEL, 'qwen2.5:1.5b']
+MODEL_TIERS = {
+    'classify': [TEXT_MODEL],   # 拜年判断
+    'reply': [TEXT_MODEL],      # 回复生成
+    'vision': [IMAGE_MODEL],    # 图片是否是拜年贺卡/表情
+}
+MESSAGE_DEADLINE = 30             # 从读到消息到回复生成完毕的时间预算(秒)
+MODEL_LATENCY_SMOOTHING = 0.3     # 模型观测耗时的指数滑动平均系数
+MODEL_LATENCY_HALF_LIFE = 120     # 观测耗时随时间衰减的半衰期(秒)，0 表示不衰减
+MODEL_UNAVAILABLE_BACKOFF = 300   # 模型不可用(如未下载)后跳过的时间(秒)
+CLASSIFY_BATCH_SIZE = 16          # 一次模型调用最多判断的消息数；流水线一次最多取出同样数量的会话合并判断
+
+# Ollama 客户端配置
+OLLAMA_HOST = 'http://127.0.0.1:11434'
+OLLAMA_POOL_SIZE = 4              # 保持的空闲HTTP连接数
+OLLAMA_TIMEOUT = 60               # 单次调用的截止时间(秒)，超时后放弃并使用兜底结果
+OLLAMA_CONNECT_TIMEOUT = 3        # 建立连接的超时(秒)
+OLLAMA_KEEP_ALIVE = '30m'         # 请求中携带的 keep_alive，模型在服务端常驻的时间
+OLLAMA_KEEP_ALIVE_INTERVAL = 600  # 距上次请求超过此时间(秒)时预加载一次模型，保持模型常驻
+BREAKER_FAILURE_THRESHOLD = 3     # 连续失败多少次后熔断，熔断期间直接使用兜底回复
+BREAKER_RESET_TIMEOUT = 30        # 熔断后多久(秒)放行一次试探请求
 
 # 特殊账号列表
 SPECIAL_ACCOUNTS = [
@@ -34,6 +87,16 @@ SPECIAL_ACCOUNTS = [
     '腾讯新闻'
 ]
 
+# 群聊判断：会话名称包含的词 / 会话预览包含的词
+GROUP_NAME_INDICATORS = [
+    '群聊', '群', '交流群', '讨论组', '社群',
+    '商会', '协会', '班级', '支部', '联盟',
+    '内购群', '粉丝群'
+]
+GROUP_MESSAGE_INDICATORS = [
+    '个成员', '[群消息]', '条]', '消息免打扰'
+]
+
 # 新年关键词
 NEW_YEAR_KEYWORDS = [
     '新年', '春节', '年', '拜年',
@@ -41,4 +104,79 @@ NEW_YEAR_KEYWORDS = [
     '吉祥', '如意', '快乐', '顺遂',
     '发财', '大吉', '好运', '幸福',
     '祥瑞', '美满', '健康', '平安'
-] 
\ No newline at end of file
+] 
+
+# 用户自定义规则文件（JSON，键为规则集名称，值为规则列表），修改后无需重启即可生效
+RULES_PATH = 'rules.json'
+RULES_RELOAD_INTERVAL = 5   # 检查规则文件是否修改的间隔(秒)
+
+# 拜年判断缓存配置
+CLASSIFICATION_CACHE_SIZE = 10000          # 最多缓存的消息数
+CLASSIFICATION_CACHE_TTL = 7 * 24 * 3600   # 缓存有效期(秒)，None 表示永不过期
+CLASSIFICATION_CACHE_PATH = 'classification_cache.json'  # 持久化文件，None 表示只保存在内存
+
+# 指标：各阶段耗时直方图和计数器，导出为 Prometheus 文本格式
+METRICS_ENABLED = True
+METRICS_FILE = 'metrics.prom'      # 定期写入的指标文件（可供 node_exporter textfile 采集），None 表示不写
+METRICS_PORT = None                # 本机HTTP端口，设置后可访问 http://127.0.0.1:端口/metrics，None 表示不开启
+METRICS_EXPORT_INTERVAL = 15       # 写入指标文件的间隔(秒)
+METRICS_SUMMARY_INTERVAL = 300     # 在日志中输出指标汇总的间隔(秒)
+
+# 回复状态：各联系人的最后回复时间和已处理消息的哈希，保存在SQLite中，重启后不会重复回复
+REPLY_STATE_PATH = 'reply_state.db'    # 数据库文件，None 表示只保存在内存
+REPLY_STATE_TTL = 24 * 3600            # 记录有效期(秒)，期间同一联系人发来的相同内容不再处理
+REPLY_STATE_HOT_SIZE = 10000           # 内存中缓存的记录数
+REPLY_STATE_EVICT_INTERVAL = 600       # 清理过期记录的间隔(秒)
+
+# 图片拜年识别：读取未读消息时截取图片和表情消息，按感知哈希查缓存，未命中时交给视觉模型判断
+IMAGE_DETECTION_ENABLED = True
+IMAGE_MESSAGE_NAMES = ('[图片]', '[动画表情]')  # 消息列表中图片、表情消息的名称
+IMAGE_CACHE_SIZE = 5000                       # 最多缓存的图片数
+IMAGE_CACHE_TTL = 30 * 24 * 3600              # 缓存有效期(秒)，None 表示永不过期
+IMAGE_CACHE_PATH = 'image_cache.json'         # 持久化文件，None 表示只保存在内存
+IMAGE_HASH_MAX_DISTANCE = 6                   # 感知哈希相差不超过此位数视为同一张图（转发、重新压缩）
+IMAGE_WORKERS = 1                             # 同时进行的视觉模型请求数
+IMAGE_QUEUE_SIZE = 8                          # 排队等待视觉模型的图片上限，超出时暂不判断，稍后重试
+IMAGE_DEADLINE = 20                           # 判断会话时等待视觉模型的最长时间(秒)，超时的图片有结果后再补发回复
+IMAGE_RETRY_INTERVAL = 30                     # 图片未能交给视觉模型（排队已满等）时，隔多久重新提交(秒)
+IMAGE_RETRIES = 3                             # 最多重新提交的次数，仍未得出结果的图片不记为已处理
+IMAGE_MAX_SIDE = 336                          # 发给视觉模型前把图片缩小到的最长边(像素)
+
+# 本地拜年意图分类器：关键词未命中时先用本地分类器判断，只有不确定的消息才交给模型
+LOCAL_CLASSIFIER_ENABLED = True
+LOCAL_CLASSIFIER_REJECT_BELOW = -3.0   # 对数几率低于此值直接判定为不是拜年
+LOCAL_CLASSIFIER_ACCEPT_ABOVE = 6.0    # 对数几率高于此值直接判定为拜年（误判会发出多余的回复，阈值更严）
+
+# 预生成回复池：空闲时后台按类别生成回复，发送时直接取用
+# 默认关闭：后台补充使模型调用增加约六成，而命中率不高、吞吐没有提升（见 benchmarks/bench_e2e.py --pool）
+REPLY_POOL_ENABLED = False
+REPLY_POOL_SIZE = 4                 # 每个类别保留的回复数
+REPLY_POOL_SIMILARITY = 0.6         # 与池中或最近发出的回复相似度(字符二元组Jaccard)超过此值视为重复
+REPLY_POOL_PERSONALIZE_LENGTH = 20  # 超过此长度的消息内容较具体，单独生成回复
+# 类别 -> 生成时使用的示例祝福和用于匹配来信的关键词；'通用'用于没有匹配到其他类别的消息
+REPLY_POOL_CATEGORIES = {
+    '通用': {'seed': '新年快乐', 'keywords': []},
+    '财运': {'seed': '恭喜发财，红包拿来', 'keywords': ['发财', '财', '红包', '富']},
+    '健康': {'seed': '祝您身体健康，平安喜乐', 'keywords': ['健康', '平安', '安康', '长寿']},
+    '家庭': {'seed': '祝您阖家幸福', 'keywords': ['阖家', '合家', '家人', '全家', '美满']},
+    '事业': {'seed': '祝您事业有成，步步高升', 'keywords': ['事业', '高升', '生意', '工作', '前程']},
+}
+
+PIPELINE_ENABLED = True   # 分类/生成在工作线程中进行，与UI操作重叠
+PIPELINE_WORKERS = 2      # 分类/生成工作线程数
+PIPELINE_QUEUE_SIZE = 8   # 待处理/待生成/待发送队列和等待图片的会话数的上限
+PIPELINE_SHUTDOWN_TIMEOUT = 10  # 退出时等待工作线程结束的最长时间(秒)
+
+# 每轮处理所有待处理会话
+CYCLE_MODE = True          # 串行模式下每轮处理全部新消息，而不是只处理第一个
+CYCLE_TIME_BUDGET = 60     # 每轮处理会话的时间预算(秒)，超出后留到下一轮
+VIP_CONTACTS = []          # 优先回复的联系人
+PRIORITY_WEIGHTS = {
+    'unread': 1.0,         # 每条未读消息
+    'vip': 100.0,          # VIP联系人
+    'wait': 0.1,           # 每等待一秒
+}
+
+# 回复输入方式：'paste' 通过剪贴板一次性粘贴（完成后恢复剪贴板），'type' 逐字输入模拟真人打字
+INPUT_MODE = 'paste'
+PASTE_RESTORE_DELAY = 0.5   # 无法读取输入框内容确认粘贴时，粘贴后等待多久再恢复剪贴板(秒)
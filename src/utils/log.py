@@ -0,0 +1,146 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from typing import List, Optional
+
+from .config import (LOG_FILE, LOG_LEVEL, LOG_CONSOLE_LEVEL, LOG_ASYNC, LOG_QUEUE_SIZE, LOG_JSON,
+                     LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_WHEN)
+from .metrics import metrics
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+_IMMUTABLE = (str, int, float, bool, type(None))
+
+_listener: Optional['_Listener'] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行紧凑的JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """把日志记录放入有界队列，由后台线程格式化和写入
+
+    队列满时丢弃 DEBUG/INFO 记录并计数，不阻塞调用方；WARNING 及以上的记录从不丢弃，
+    改为挤掉队列中最早的一条 DEBUG/INFO 记录，队列中全是 WARNING 及以上时等待后台线程腾出位置。
+    参数都是不可变值时推迟到后台线程格式化，否则（如列表，之后可能被修改）在放入队列前先合成消息。
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args and not (isinstance(args, tuple) and all(isinstance(arg, _IMMUTABLE) for arg in args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                self._count_dropped()
+            elif self._replace_low_level(record):
+                self._count_dropped()
+            else:
+                self.queue.put(record)
+
+    def _replace_low_level(self, record: logging.LogRecord) -> bool:
+        """用 record 替换队列中最早的一条 WARNING 以下的记录，没有可替换的记录时返回False"""
+        log_queue = self.queue
+        with log_queue.mutex:
+            for i, queued in enumerate(log_queue.queue):
+                if queued is not None and queued.levelno < logging.WARNING:
+                    del log_queue.queue[i]
+                    log_queue.queue.append(record)
+                    log_queue.not_empty.notify()
+                    return True
+        return False
+
+    def _count_dropped(self):
+        self.dropped += 1
+        metrics.inc('log_records_dropped')
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # 队列满时等待后台线程腾出位置，保证退出前写完已排队的日志
+        self.queue.put(self._sentinel)
+
+
+def build_handlers(path: Optional[str] = LOG_FILE, json_format: bool = LOG_JSON, stream=None,
+                   console_level=LOG_CONSOLE_LEVEL) -> List[logging.Handler]:
+    """文件（按大小或时间轮转）和控制台处理器"""
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers: List[logging.Handler] = []
+    if path:
+        if LOG_ROTATE_WHEN:
+            file_handler = logging.handlers.TimedRotatingFileHandler(
+                path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    console = logging.StreamHandler(stream or sys.stdout)
+    # 控制台始终用文本格式，方便直接阅读
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    console.setLevel(console_level)
+    handlers.append(console)
+    return handlers
+
+
+def setup_logging(async_mode: bool = LOG_ASYNC, **handler_options):
+    """配置日志系统
+
+    async_mode 为True时调用方只把记录放入队列，格式化和磁盘/控制台写入在后台线程完成，
+    退出时（或调用 stop_logging）写完队列中剩余的记录。
+    """
+    global _listener
+    stop_logging()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, (AsyncQueueHandler, logging.FileHandler, logging.StreamHandler)):
+            root.removeHandler(handler)
+            handler.close()
+    root.setLevel(LOG_LEVEL)
+    handlers = build_handlers(**handler_options)
+    if async_mode:
+        queue_handler = AsyncQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _listener = _Listener(queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        root.addHandler(queue_handler)
+    else:
+        for handler in handlers:
+            root.addHandler(handler)
+    logging.getLogger('comtypes').setLevel(logging.ERROR)
+
+
+def stop_logging():
+    """停止后台写入线程，写完队列中剩余的日志"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(stop_logging)
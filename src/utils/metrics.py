@@ -0,0 +1,277 @@
+import bisect
+import contextlib
+import functools
+import logging
+import os
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .clock import Clock
+from .config import METRICS_FILE, METRICS_PORT, METRICS_EXPORT_INTERVAL, METRICS_SUMMARY_INTERVAL
+
+PREFIX = 'wechat_'
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+# 采集函数返回 (指标名, 标签, 值)，导出时调用，用于读取各组件已有的统计
+Collector = Callable[[], Iterable[Tuple[str, Dict[str, str], float]]]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """固定分桶的直方图"""
+
+    def __init__(self, buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """按桶内线性插值估计分位数（与 Prometheus histogram_quantile 相同）"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """进程内的计数器和直方图，导出为 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = defaultdict(dict)
+        self._collectors: Dict[str, Collector] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            counters = self._counters[name]
+            counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = Histogram()
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, clock: Clock):
+        """记录代码块的耗时（clock 下的秒数）到 stage_duration_seconds"""
+        start = clock.monotonic()
+        try:
+            yield
+        finally:
+            self.observe('stage_duration_seconds', clock.monotonic() - start, stage=stage)
+
+    def register_collector(self, name: str, collector: Collector):
+        """注册导出时调用的采集函数，同名的会被替换"""
+        with self._lock:
+            self._collectors[name] = collector
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def histogram(self, name: str, **labels) -> Optional[Histogram]:
+        with self._lock:
+            return self._histograms.get(name, {}).get(_labels(labels))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        lines: List[str] = []
+        with self._lock:
+            counters = {name: dict(values) for name, values in self._counters.items()}
+            histograms = {name: dict(values) for name, values in self._histograms.items()}
+            collectors = list(self._collectors.values())
+        gauges: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        for collector in collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges[name][_labels(labels)] = value
+            except Exception as e:
+                logging.debug(f"采集指标失败: {str(e)}")
+
+        for name, values in sorted(counters.items()):
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+            lines.extend(f"{PREFIX}{name}_total{_format_labels(labels)} {value:g}"
+                         for labels, value in sorted(values.items()))
+        for name, values in sorted(gauges.items()):
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            lines.extend(f"{PREFIX}{name}{_format_labels(labels)} {value:g}" for labels, value in sorted(values.items()))
+        for name, values in sorted(histograms.items()):
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for labels, histogram in sorted(values.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """一行汇总：各阶段次数和 p50/p99，以及各计数器"""
+        with self._lock:
+            stages = sorted(self._histograms.get('stage_duration_seconds', {}).items())
+            counters = sorted(
+                (name + _format_labels(labels), value)
+                for name, values in self._counters.items() for labels, value in values.items()
+            )
+            parts = [f"{dict(labels).get('stage')} {h.count}次 p50={h.quantile(0.5):.2f}s p99={h.quantile(0.99):.2f}s"
+                     for labels, h in stages]
+        parts.extend(f"{name}={value:g}" for name, value in counters)
+        return '，'.join(parts)
+
+
+metrics = Metrics()
+
+
+def timed(stage: str):
+    """方法装饰器：按 self.clock 记录调用耗时"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with metrics.timer(stage, self.clock):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _LogCounter(logging.Handler):
+    """按级别统计 WARNING 及以上的日志条数，作为错误计数"""
+
+    def __init__(self, registry: Metrics):
+        super().__init__(level=logging.WARNING)
+        self.registry = registry
+
+    def emit(self, record: logging.LogRecord):
+        self.registry.inc('log_messages', level=record.levelname.lower())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: '_Server'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    registry: Metrics
+
+
+class MetricsExporter:
+    """定期把指标写入文件（可供 node_exporter textfile 采集）、在本机端口提供 /metrics，
+    并每 summary_interval 秒在日志中输出一行汇总"""
+
+    def __init__(self, registry: Metrics = metrics, path: Optional[str] = METRICS_FILE,
+                 port: Optional[int] = METRICS_PORT, interval: float = METRICS_EXPORT_INTERVAL,
+                 summary_interval: float = METRICS_SUMMARY_INTERVAL, clock: Optional[Clock] = None):
+        self.registry = registry
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.summary_interval = summary_interval
+        self.clock = clock or Clock()
+        self._log_counter = _LogCounter(registry)
+        self._server: Optional[_Server] = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        logging.getLogger().addHandler(self._log_counter)
+        if self.port:
+            try:
+                self._server = _Server(('127.0.0.1', self.port), _Handler)
+                self._server.registry = self.registry
+                threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+                logging.info(f"指标地址: http://127.0.0.1:{self.port}/metrics")
+            except OSError as e:
+                logging.error(f"启动指标HTTP服务失败: {str(e)}")
+                self._server = None
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last_export = last_summary = self.clock.monotonic()
+        while not self._stopping.is_set():
+            self.clock.sleep(min(self.interval, self.summary_interval, 1))
+            now = self.clock.monotonic()
+            if now - last_export >= self.interval:
+                last_export = now
+                self.write()
+            if now - last_summary >= self.summary_interval:
+                last_summary = now
+                logging.info(f"指标汇总: {self.registry.summary()}")
+
+    def write(self):
+        """写入指标文件（先写临时文件再替换，避免被读到一半）"""
+        if not self.path:
+            return
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.registry.render())
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"写入指标文件失败: {str(e)}")
+
+    def stop(self):
+        """停止导出，最后写入一次文件并输出汇总"""
+        self._stopping.set()
+        self._thread = None
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        logging.getLogger().removeHandler(self._log_counter)
+        self.write()
+        logging.info(f"指标汇总: {self.registry.summary()}")
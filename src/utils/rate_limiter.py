@@ -0,0 +1,102 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .clock import Clock
+from .config import ACTION_RATE_LIMITS, RATE_LIMITER_MAX_KEYS
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积攒 burst 个
+
+    reserve 总是立即扣除令牌（允许欠账）并返回需要等待的秒数，
+    多个桶可以先各自预约再统一等待最长的那个，不需要轮询。
+    """
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float, tokens: float = 1) -> float:
+        self._refill(now)
+        self.tokens -= tokens
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class ActionRateLimiter:
+    """界面操作限速：全局、每个微信窗口、每个联系人各一组令牌桶
+
+    limits 为 {范围: (每秒次数, 允许的连续次数)}，范围为 'global'、'window'、'contact'，
+    缺少的范围不限速。一次操作需要同时取得所有相关范围的令牌。
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None, clock: Optional[Clock] = None,
+                 max_keys: int = RATE_LIMITER_MAX_KEYS):
+        self.limits = ACTION_RATE_LIMITS if limits is None else limits
+        self.clock = clock or Clock()
+        self.max_keys = max_keys
+        self.waited = 0.0
+        self.throttled = 0
+        self._buckets: 'OrderedDict[tuple, TokenBucket]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _bucket(self, scope: str, key, now: float) -> Optional[TokenBucket]:
+        limit = self.limits.get(scope)
+        if not limit:
+            return None
+        bucket = self._buckets.get((scope, key))
+        if bucket is None:
+            bucket = self._buckets[(scope, key)] = TokenBucket(*limit, now)
+            self._prune(now)
+        else:
+            self._buckets.move_to_end((scope, key))
+        return bucket
+
+    def _prune(self, now: float):
+        """联系人过多时丢弃最久未用且已补满的桶（丢弃已补满的桶不影响限速）"""
+        while len(self._buckets) > self.max_keys:
+            key, bucket = next(iter(self._buckets.items()))
+            if not bucket.full(now):
+                break
+            del self._buckets[key]
+
+    def reserve(self, action: str, window=None, contact: Optional[str] = None) -> float:
+        """预约一次操作，返回需要等待的秒数"""
+        now = self.clock.monotonic()
+        with self._lock:
+            scopes = [('global', None)]
+            if window is not None:
+                scopes.append(('window', window))
+            if contact is not None:
+                scopes.append(('contact', contact))
+            delay = 0.0
+            for scope, key in scopes:
+                bucket = self._bucket(scope, key, now)
+                if bucket:
+                    delay = max(delay, bucket.reserve(now))
+            if delay > 0:
+                self.throttled += 1
+                self.waited += delay
+        if delay > 0:
+            logging.debug("操作限速 %s: 等待 %.2f 秒", action, delay)
+        return delay
+
+    def acquire(self, action: str, window=None, contact: Optional[str] = None) -> float:
+        """等待到允许执行该操作，返回等待的秒数"""
+        delay = self.reserve(action, window, contact)
+        self.clock.sleep(delay)
+        return delay
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'throttled': self.throttled, 'waited': self.waited, 'buckets': len(self._buckets)}
@@ -0,0 +1,76 @@
+import math
+import random
+import threading
+from typing import Optional
+
+from .clock import Clock
+from .config import POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, POLL_TARGET_MESSAGES, POLL_RATE_HALF_LIFE, POLL_JITTER
+
+
+class PollScheduler:
+    """按消息到达速率自适应的轮询间隔
+
+    到达速率为按 half_life 指数衰减的消息计数 / 平均寿命（half_life / ln2）。
+    下一次轮询间隔 = target / 速率，即平均每次扫描遇到约 target 条新消息，
+    限制在 [min_interval, max_interval] 内，并加上 ±jitter 比例的随机抖动：
+    消息密集时快速轮询，空闲时逐渐退到 max_interval。
+    等待期间休眠到下一次轮询时间，可由 notify 提前唤醒（界面变化事件、回复已生成等）。
+    """
+
+    def __init__(self, min_interval: float = POLL_MIN_INTERVAL, max_interval: float = POLL_MAX_INTERVAL,
+                 target: float = POLL_TARGET_MESSAGES, half_life: float = POLL_RATE_HALF_LIFE,
+                 jitter: float = POLL_JITTER, clock: Optional[Clock] = None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target = target
+        self.half_life = half_life
+        self.jitter = jitter
+        self.clock = clock or Clock()
+        self.interval = max_interval
+        self.last_scan = -math.inf
+        self.next_scan = self.clock.monotonic()
+        self._count = 0.0
+        self._updated = self.clock.monotonic()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def _decay(self, now: float):
+        self._count *= 0.5 ** ((now - self._updated) / self.half_life)
+        self._updated = now
+
+    def observe(self, messages: int):
+        """记录扫描中读到的新消息数"""
+        with self._lock:
+            self._decay(self.clock.monotonic())
+            self._count += messages
+
+    def rate(self) -> float:
+        """当前估计的消息到达速率(条/秒)"""
+        with self._lock:
+            self._decay(self.clock.monotonic())
+            return self._count * math.log(2) / self.half_life
+
+    def record_scan(self, max_interval: Optional[float] = None) -> float:
+        """一次扫描结束，按当前速率安排下一次轮询，返回间隔秒数
+
+        max_interval 可临时放宽上限（如事件模式下定时轮询只作兜底）。
+        """
+        upper = max(self.max_interval if max_interval is None else max_interval, self.min_interval)
+        rate = self.rate()
+        interval = upper if rate <= 0 else min(max(self.target / rate, self.min_interval), upper)
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        now = self.clock.monotonic()
+        self.interval = interval
+        self.last_scan = now
+        self.next_scan = now + interval
+        return interval
+
+    def notify(self):
+        """提前唤醒等待中的 wait（可在其他线程调用）"""
+        self._wake.set()
+
+    def wait(self, until: float) -> bool:
+        """休眠到 until（clock.monotonic 下的时间点）或被 notify 唤醒，返回是否被唤醒"""
+        woken = self.clock.wait(self._wake, until - self.clock.monotonic())
+        self._wake.clear()
+        return woken
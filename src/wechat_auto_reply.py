@@ -1,33 +1,114 @@
-import time
 import logging
-import random
-import uiautomation as auto
-from typing import Optional
+from typing import List, Optional, Tuple
 
-from .utils.config import setup_logging, DEFAULT_REPLY_INTERVAL, MIN_OPERATION_INTERVAL
+from .utils.clock import Clock
+from .utils.metrics import MetricsExporter, metrics, timed
+from .utils.rate_limiter import ActionRateLimiter
+from .utils.scheduler import PollScheduler
+from .utils.config import (DEFAULT_REPLY_INTERVAL,
+                           PIPELINE_ENABLED, PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE,
+                           CYCLE_MODE, CYCLE_TIME_BUDGET, INPUT_MODE,
+                           EVENT_POLL_INTERVAL, EVENT_MIN_SCAN_GAP, MULTI_WINDOW_SCAN, REPLY_POOL_ENABLED, METRICS_ENABLED,
+                           MESSAGE_DEADLINE, MAX_UNREAD_MESSAGES)
+from .pipeline import ReplyJob, ReplyPipeline
 from .services.llm_service import LLMService
+from .services.reply_pool import ReplyPool
+from .services.reply_state import ReplyStateStore
 from .services.ui_automation import UIAutomation
 from .handlers.message_handler import MessageHandler
+from .handlers.rule_index import RuleIndex
+from .handlers.conversation_ranker import ConversationRanker, PendingConversation
+from .handlers.chat_list_tracker import ChatListTracker
 
 class WeChatAutoReply:
-    def __init__(self):
+    def __init__(self, ui_backend=None, llm_client=None, clock: Optional[Clock] = None,
+                 reply_state: Optional[ReplyStateStore] = None):
+        """ui_backend / llm_client / clock 默认连接真实桌面和Ollama，可替换为模拟器；
+        reply_state 默认保存在 REPLY_STATE_PATH"""
         self.running = True
-        self.last_reply_time = {}
         self.reply_interval = DEFAULT_REPLY_INTERVAL
-        self.last_operation_time = 0
-        self.min_operation_interval = MIN_OPERATION_INTERVAL
         self.current_window_index = 0
+        self.cycle_mode = CYCLE_MODE
+        self.cycle_time_budget = CYCLE_TIME_BUDGET
+        self.input_mode = INPUT_MODE
+        self.multi_window_scan = MULTI_WINDOW_SCAN
+        self.message_deadline = MESSAGE_DEADLINE
+        self.max_unread_messages = MAX_UNREAD_MESSAGES
         
-        self.llm_service = LLMService()
-        self.ui_automation = UIAutomation()
-        self.message_handler = MessageHandler()
+        self.clock = clock or Clock()
+        self.scheduler = PollScheduler(clock=self.clock)
+        self.rate_limiter = ActionRateLimiter(clock=self.clock)
+        self.reply_state = reply_state if reply_state is not None else ReplyStateStore(clock=self.clock)
+        self.rules = RuleIndex(clock=self.clock)
+        self.llm_service = LLMService(llm_client, rules=self.rules, clock=self.clock)
+        self.ui_automation = UIAutomation(ui_backend, self.clock)
+        self.ui_automation.on_change = self.scheduler.notify
+        self.ui_automation.image_detector = self.llm_service.image_detector
+        self.backend = self.ui_automation.backend
+        self.message_handler = MessageHandler(self.rules)
+        self.ranker = ConversationRanker()
+        self.chat_list_tracker = ChatListTracker()
+        self.reply_pool = ReplyPool(self.llm_service, clock=self.clock) if REPLY_POOL_ENABLED else None
+        self.pipeline = ReplyPipeline(
+            self.llm_service, self.deliver_reply, PIPELINE_WORKERS, PIPELINE_QUEUE_SIZE, self.compose_reply,
+            reply_state=self.reply_state, on_ready=self.scheduler.notify
+        ) if PIPELINE_ENABLED else None
+        self.metrics_exporter = MetricsExporter(clock=self.clock) if METRICS_ENABLED else None
+        metrics.register_collector('wechat_auto_reply', self.collect_metrics)
 
-    def ensure_operation_interval(self):
-        """确保操作之间有足够的间隔"""
-        current_time = time.time()
-        if current_time - self.last_operation_time < self.min_operation_interval:
-            time.sleep(self.min_operation_interval)
-        self.last_operation_time = time.time()
+    def collect_metrics(self):
+        """导出指标时读取各组件自身的统计（缓存命中、队列长度等）"""
+        cache = self.llm_service.classification_cache.stats()
+        yield 'classification_cache_hits', {}, cache['hits']
+        yield 'classification_cache_misses', {}, cache['misses']
+        state = self.reply_state.stats()
+        yield 'reply_state_hits', {}, state['hits']
+        yield 'reply_state_misses', {}, state['misses']
+        locator = self.ui_automation.locator_stats()
+        yield 'locator_cache_hits', {}, locator['hits']
+        yield 'locator_cache_misses', {}, locator['misses']
+        yield 'llm_active_requests', {}, self.llm_service.active_requests
+        if self.llm_service.image_detector:
+            images = self.llm_service.image_detector.stats()
+            yield 'image_cache_hits', {}, images['hits']
+            yield 'image_cache_misses', {}, images['misses']
+            yield 'image_pending', {}, images['pending']
+        if self.reply_pool:
+            pool = self.reply_pool.stats()
+            yield 'reply_pool_hits', {}, pool['hits']
+            yield 'reply_pool_misses', {}, pool['misses']
+            for category, size in pool['size'].items():
+                yield 'reply_pool_size', {'category': category}, size
+        yield 'poll_interval_seconds', {}, self.scheduler.interval
+        yield 'message_arrival_rate', {}, self.scheduler.rate()
+        limiter = self.rate_limiter.stats()
+        yield 'rate_limited_actions', {}, limiter['throttled']
+        yield 'rate_limit_wait_seconds', {}, limiter['waited']
+        if self.pipeline:
+            yield 'pipeline_queue_depth', {'queue': 'work'}, self.pipeline.work_queue.qsize()
+            yield 'pipeline_queue_depth', {'queue': 'compose'}, self.pipeline.compose_queue.qsize()
+            yield 'pipeline_queue_depth', {'queue': 'send'}, self.pipeline.send_queue.qsize()
+
+    def window_key(self, wechat_window):
+        """窗口句柄，读取失败时返回None"""
+        try:
+            return self.ui_automation.window_handle(wechat_window)
+        except Exception:
+            return None
+
+    def account_key(self, wechat_window) -> Optional[str]:
+        """窗口登录的微信账号，用于区分不同账号下的同名联系人
+
+        读取不到账号昵称时：只有一个微信窗口时为None（只按联系人区分），多个窗口时用窗口句柄区分。
+        """
+        account = self.ui_automation.account_name(wechat_window)
+        if account is None and len(self.ui_automation.find_all_wechat_windows()) > 1:
+            account = f"窗口{self.window_key(wechat_window)}"
+        return account
+
+    def throttle(self, action: str, wechat_window, contact_name: Optional[str] = None):
+        """按全局、窗口、联系人的令牌桶等待到允许执行该界面操作"""
+        self.rate_limiter.acquire(action, self.window_key(wechat_window), contact_name)
 
     def switch_to_next_window(self, wechat_windows):
         """切换到下一个微信窗口"""
@@ -37,119 +118,322 @@ class WeChatAutoReply:
         self.current_window_index = (self.current_window_index + 1) % len(wechat_windows)
         current_window = wechat_windows[self.current_window_index]
         
+        if self.activate_window(current_window, force=True):
+            logging.info("切换到第 %s 个微信窗口", self.current_window_index + 1)
+            return current_window
+        return None
+
+    def activate_window(self, wechat_window, force: bool = False) -> bool:
+        """将微信窗口置于前台并切换到会话列表
+
+        窗口已在前台时直接返回，force 为True时仍然重新聚焦并切换到会话列表。
+        """
         try:
-            if current_window.SetFocus():
-                logging.info(f"切换到第 {self.current_window_index + 1} 个微信窗口")
-                time.sleep(1)
-                
-                try:
-                    rect = current_window.BoundingRectangle
-                    x = rect.left + 100
-                    y = (rect.top + rect.bottom) // 2
-                    auto.Click(x, y)
-                    self.ui_automation.random_sleep(0.5, 1)
-                    
-                    auto.SendKeys('{Alt}1')
-                    self.ui_automation.random_sleep(0.5, 1)
-                except Exception as e:
-                    logging.warning(f"尝试点击左侧区域时出错: {str(e)}")
+            if not force and self.backend.is_foreground(wechat_window):
+                return True
+            if not wechat_window.SetFocus():
+                logging.warning("无法将微信窗口置于前台")
+                return False
+            self.ui_automation.wait_until(
+                lambda: self.backend.is_foreground(wechat_window), step='window_focus'
+            )
+            
+            try:
+                rect = wechat_window.BoundingRectangle
+                x = rect.left + 100
+                y = (rect.top + rect.bottom) // 2
+                self.backend.click(x, y)
                 
-                return current_window
-            else:
-                logging.warning(f"无法将第 {self.current_window_index + 1} 个微信窗口置于前台")
-                return None
+                self.backend.send_keys('{Alt}1')
+                self.ui_automation.wait_until(
+                    lambda: wechat_window.ListControl(Name="会话").Exists(0, 0), step='chat_list'
+                )
+            except Exception as e:
+                logging.warning(f"尝试点击左侧区域时出错: {str(e)}")
+            return True
         except Exception as e:
             logging.error(f"切换窗口时出错: {str(e)}")
-            return None
+            return False
+
+    def scan_windows(self, wechat_windows, only_handles=None):
+        """只读扫描各微信窗口的会话列表，不切换焦点
+
+        返回 (有待处理会话的 [(窗口, 待处理会话)], 找不到会话列表的窗口)。
+        only_handles 不为None时只扫描其中的窗口。
+        """
+        with_work, unreachable = [], []
+        for wechat_window in wechat_windows:
+            try:
+                if only_handles is not None and self.ui_automation.window_handle(wechat_window) not in only_handles:
+                    continue
+                if not self.ui_automation.find_chat_list_panel(wechat_window):
+                    # 窗口可能停在通讯录等其他页面，需要聚焦后按 Alt+1 才能看到会话列表
+                    unreachable.append(wechat_window)
+                    continue
+                pending = self.collect_pending_conversations(wechat_window)
+                if pending:
+                    with_work.append((wechat_window, pending))
+            except Exception as e:
+                logging.error(f"扫描微信窗口时出错: {str(e)}")
+        logging.info("扫描了 %s 个微信窗口，%s 个有待处理的会话", len(wechat_windows), len(with_work))
+        return with_work, unreachable
+
+    def handle_window(self, wechat_window, pending: Optional[List[PendingConversation]] = None) -> bool:
+        """按当前模式处理一个已在前台的微信窗口，返回是否处理了消息"""
+        if self.pipeline:
+            return self.dispatch_new_messages(wechat_window, pending) > 0
+        if self.cycle_mode:
+            return self.process_new_messages(wechat_window, pending) > 0
+        found = self.check_new_message(wechat_window)
+        if found:
+            self.send_auto_reply(wechat_window, *found)
+            return True
+        return False
 
     def check_new_message(self, wechat_window):
-        """检查新消息"""
+        """检查新消息，返回第一个有拜年信息的 (联系人, 拜年消息列表, 读到的全部未读消息)"""
+        for contact_name, messages in self.iter_new_messages(wechat_window):
+            message_deadline = self.clock.time() + self.message_deadline
+            greetings, decided = self.select_greetings(messages, message_deadline)
+            if not greetings:
+                logging.info("不是拜年信息，跳过处理: %s", messages)
+                metrics.inc('skipped_contacts', reason='not_greeting')
+                self.reply_state.mark_handled(contact_name, decided, self.account_key(wechat_window))
+                continue
+
+            return contact_name, greetings, messages
+        
+        return None
+
+    def select_greetings(self, messages: List[str], deadline: Optional[float]) -> Tuple[List[str], List[str]]:
+        """串行模式下判断一个会话的未读消息，返回 (拜年消息, 已得出结果的消息)
+
+        视觉模型还没有结果的图片不在已得出结果的消息中，不记为已处理，之后重新读到时再判断。
+        """
+        verdicts = self.llm_service.classify_messages(messages, deadline)
+        greetings = [message for message, verdict in zip(messages, verdicts) if verdict]
+        return greetings, [message for message, verdict in zip(messages, verdicts) if verdict is not None]
+
+    @timed('scan')
+    def collect_pending_conversations(self, wechat_window, skip_contacts=()) -> List[PendingConversation]:
+        """读取会话列表，收集所有有新消息且需要处理的会话（不点击）"""
+        pending = []
         try:
             chat_list_panel = self.ui_automation.find_chat_list_panel(wechat_window)
             if not chat_list_panel:
-                return None
+                return pending
             
-            chat_items = chat_list_panel.GetChildren()
-            logging.info(f"找到 {len(chat_items)} 个会话项")
+            # 一次批量取回所有会话项的名称，未通过筛选的会话项不会再读取任何属性
+            chat_items = self.ui_automation.get_chat_items(chat_list_panel)
+            logging.debug("找到 %s 个会话项", len(chat_items))
+
+            handle = self.ui_automation.window_handle(wechat_window)
+            account = self.account_key(wechat_window)
+            changed = self.chat_list_tracker.update(handle, (item.name for item in chat_items))
+            if changed:
+                logging.info("会话列表有 %s 项变化", len(changed))
+            # 只处理变化的和仍待处理的未读会话项，有意跳过的会话项在有新消息之前不再检查
+            unread = self.chat_list_tracker.pending(handle, self.clock.time())
+            if not unread:
+                logging.debug("会话列表没有待处理的未读会话")
+                return pending
             
             for i, item in enumerate(chat_items):
                 try:
-                    item_name = item.Name
-                    item_value = ""
-                    try:
-                        item_value = item.GetValuePattern().Value
-                    except:
-                        pass
-
-                    if self.message_handler.is_special_account(item_name):
-                        logging.info(f"跳过特殊账号: {item_name}")
+                    item_name = item.name
+                    if item_name not in unread:
                         continue
-                    
+
                     contact_name, has_new_message = self.message_handler.parse_contact_info(item_name)
                     
+                    # 会话项名称带有未读数，需用解析出的联系人名称判断
+                    if self.message_handler.is_special_account(contact_name):
+                        logging.info("跳过特殊账号: %s", contact_name)
+                        metrics.inc('skipped_contacts', reason='special_account')
+                        self.chat_list_tracker.settle(handle, item_name)
+                        continue
+                    
                     if has_new_message and contact_name:
-                        logging.info(f"发现新消息，联系人: {contact_name}")
+                        if contact_name in skip_contacts:
+                            continue
+                        logging.info("发现新消息，联系人: %s", contact_name)
                         
-                        current_time = time.time()
-                        if contact_name in self.last_reply_time:
-                            time_diff = current_time - self.last_reply_time[contact_name]
+                        current_time = self.clock.time()
+                        last_reply_time = self.reply_state.last_reply_time(contact_name, account)
+                        if last_reply_time is not None:
+                            time_diff = current_time - last_reply_time
                             if time_diff < self.reply_interval:
-                                logging.info(f"跳过 {contact_name} 的消息（还需等待 {int(self.reply_interval - time_diff)} 秒）")
+                                logging.info("跳过 %s 的消息（还需等待 %s 秒）", contact_name, int(self.reply_interval - time_diff))
+                                metrics.inc('skipped_contacts', reason='reply_interval')
+                                self.chat_list_tracker.settle(handle, item_name, last_reply_time + self.reply_interval)
                                 continue
 
-                        if not self.click_chat_item(wechat_window, item, contact_name):
-                            continue
-
-                        last_message = self.ui_automation.get_last_message(wechat_window)
-                        if not last_message:
-                            logging.error("无法获取最后一条消息")
-                            continue
-
-                        if not self.llm_service.is_new_year_greeting(last_message):
-                            logging.info(f"不是拜年信息，跳过处理: {last_message}")
-                            continue
-
-                        return contact_name
+                        unread_count = self.message_handler.parse_unread_count(item_name)
+                        pending.append(PendingConversation(item, contact_name, unread_count))
                             
                 except Exception as e:
                     logging.error(f"处理会话项 {i+1} 时出错: {str(e)}")
                     continue
-            
-            return None
         except Exception as e:
             logging.error(f"检查新消息时出错: {str(e)}")
+        return pending
+
+    def iter_new_messages(self, wechat_window, skip_contacts=(), deadline: Optional[float] = None,
+                          pending: Optional[List[PendingConversation]] = None):
+        """按优先级逐个打开有新消息的会话，产出 (联系人, 未读消息列表)
+
+        按会话列表中的未读数一次读取全部未读消息（最多 MAX_UNREAD_MESSAGES 条），
+        这样后到的"在吗"之类的消息不会盖住前面的拜年信息。
+
+        deadline 为本轮的截止时间，到期后剩余会话留到下一轮。
+        pending 为扫描阶段已收集的待处理会话，为None时重新读取会话列表。
+        """
+        if pending is None:
+            pending = self.collect_pending_conversations(wechat_window, skip_contacts)
+        else:
+            pending = [c for c in pending if c.contact_name not in skip_contacts]
+        window = self.window_key(wechat_window)
+        account = self.account_key(wechat_window)
+        ranked = self.ranker.rank(pending, self.clock.time(), window)
+        for index, conversation in enumerate(ranked):
+            if deadline is not None and self.clock.time() >= deadline:
+                logging.info("本轮时间预算已用完，剩余 %s 个会话留到下一轮", len(ranked) - index)
+                return
+            contact_name = conversation.contact_name
+            try:
+                previous = self.ui_automation.message_list_signature(wechat_window)
+                if not self.click_chat_item(wechat_window, conversation.item.control, contact_name):
+                    continue
+                self.ranker.forget(contact_name, window)
+
+                count = min(conversation.unread_count, self.max_unread_messages)
+                messages = self.ui_automation.get_unread_messages(wechat_window, count, previous)
+                if not messages:
+                    logging.error("无法获取未读消息")
+                    continue
+                # 已读过的会话项（包括之后判定为不是拜年信息的）在有新消息之前不再检查
+                self.chat_list_tracker.settle(self.ui_automation.window_handle(wechat_window), conversation.item.name)
+                fresh = self.reply_state.unhandled(contact_name, messages, account)
+                self.scheduler.observe(len(fresh))
+                if not fresh:
+                    logging.info("%s 的未读消息都已处理过，跳过: %s", contact_name, messages)
+                    metrics.inc('skipped_contacts', reason='already_handled')
+                    continue
+            except Exception as e:
+                logging.error(f"打开会话 {contact_name} 时出错: {str(e)}")
+                continue
+
+            yield contact_name, fresh
+
+    def process_new_messages(self, wechat_window, pending: Optional[List[PendingConversation]] = None) -> int:
+        """串行模式下每轮处理所有新消息，返回发送的回复数"""
+        deadline = self.clock.time() + self.cycle_time_budget
+        replied = 0
+        account = self.account_key(wechat_window)
+        for contact_name, messages in self.iter_new_messages(wechat_window, deadline=deadline, pending=pending):
+            message_deadline = self.clock.time() + self.message_deadline
+            greetings, decided = self.select_greetings(messages, message_deadline)
+            if not greetings:
+                logging.info("不是拜年信息，跳过处理: %s", messages)
+                metrics.inc('skipped_contacts', reason='not_greeting')
+                self.reply_state.mark_handled(contact_name, decided, account)
+                continue
+            reply_message = self.compose_reply('\n'.join(greetings), message_deadline)
+            if self.type_and_send(wechat_window, contact_name, reply_message):
+                self.reply_state.mark_handled(contact_name, messages, account)
+                replied += 1
+        return replied
+
+    def dispatch_new_messages(self, wechat_window, pending: Optional[List[PendingConversation]] = None) -> int:
+        """流水线模式：把有新消息的会话交给工作线程，返回提交的会话数"""
+        submitted = 0
+        deadline = self.clock.time() + self.cycle_time_budget
+        account = self.account_key(wechat_window)
+        in_flight = {contact for key, contact in self.pipeline.in_flight() if key == account}
+        for contact_name, messages in self.iter_new_messages(wechat_window, in_flight, deadline, pending):
+            now = self.clock.time()
+            job = ReplyJob(wechat_window, contact_name, messages, now, now + self.message_deadline, account=account)
+            if self.pipeline.submit(job):
+                submitted += 1
+            self.pipeline.drain_sends()
+            if self.pipeline.full():
+                logging.info("处理队列已满，本轮暂停打开新的会话")
+                break
+        return submitted
+
+    def open_conversation(self, wechat_window, contact_name) -> Optional[List[str]]:
+        """在会话列表中找到并打开指定联系人的会话
+
+        点击会清除未读标记，因此按会话项上的未读数读取这期间新到的消息并返回（没有时为空列表）；
+        找不到会话或点击失败时返回None。
+        """
+        chat_list_panel = self.ui_automation.find_chat_list_panel(wechat_window)
+        if not chat_list_panel:
             return None
+        for item in self.ui_automation.get_chat_items(chat_list_panel):
+            try:
+                item_name = item.name
+                if self.message_handler.parse_contact_info(item_name)[0] == contact_name:
+                    unread_count = self.message_handler.parse_unread_count(item_name)
+                    previous = self.ui_automation.message_list_signature(wechat_window)
+                    if not self.click_chat_item(wechat_window, item.control, contact_name):
+                        return None
+                    if not unread_count:
+                        self.ui_automation.get_last_message(wechat_window, previous)
+                        return []
+                    return self.ui_automation.get_unread_messages(
+                        wechat_window, min(unread_count, self.max_unread_messages), previous)
+            except Exception:
+                continue
+        logging.error(f"会话列表中找不到联系人: {contact_name}")
+        return None
+
+    def deliver_reply(self, job: ReplyJob) -> bool:
+        """流水线模式：回到对应会话发送已生成的回复
 
+        打开会话时读到的生成期间新到的消息记在 job.followup 中，由流水线重新提交处理。
+        """
+        if not self.activate_window(job.window):
+            return False
+        unread = self.open_conversation(job.window, job.contact_name)
+        if unread is None:
+            return False
+        sent = self.type_and_send(job.window, job.contact_name, job.reply)
+        if sent:
+            self.reply_state.mark_handled(job.contact_name, job.messages, job.account)
+        job.followup = self.reply_state.unhandled(job.contact_name, unread, job.account)
+        return sent
+
+    @timed('click')
     def click_chat_item(self, wechat_window, item, contact_name):
         """点击会话项"""
         try:
-            self.ensure_operation_interval()
+            self.throttle('click', wechat_window, contact_name)
             
             wechat_window.SetFocus()
-            self.ui_automation.random_sleep(0.3, 0.8)
+            self.ui_automation.wait_until(lambda: self.backend.is_foreground(wechat_window), step='window_focus')
             
             item.SetFocus()
-            self.ui_automation.random_sleep(0.2, 0.5)
             
             click_success = False
             
+            # Click 没有返回值，不抛异常即视为成功；消息列表的刷新由 get_last_message 等待
             try:
-                if item.Click():
-                    click_success = True
-                    logging.info(f"成功点击会话(方法1): {contact_name}")
+                item.Click(waitTime=0)
+                click_success = True
+                logging.info("成功点击会话(方法1): %s", contact_name)
             except:
                 self.ui_automation.random_sleep(0.1, 0.3)
             
             if not click_success:
                 try:
-                    item.Click(simulateMove=True)
+                    item.Click(simulateMove=True, waitTime=0)
                     click_success = True
-                    logging.info(f"成功点击会话(方法2): {contact_name}")
+                    logging.info("成功点击会话(方法2): %s", contact_name)
                 except:
                     pass
             
             if click_success:
-                self.ui_automation.random_sleep(1.5, 2.5)
                 return True
             else:
                 logging.error(f"所有点击方法都失败: {contact_name}")
@@ -159,25 +443,58 @@ class WeChatAutoReply:
             logging.error(f"点击会话失败: {contact_name}, 错误: {str(e)}")
             return False
 
-    def send_auto_reply(self, wechat_window, contact_name):
-        """发送自动回复"""
-        try:
-            last_message = self.ui_automation.get_last_message(wechat_window)
-            if not last_message:
-                logging.error("无法获取最后一条消息")
-                return False
+    def send_auto_reply(self, wechat_window, contact_name, greetings: Optional[List[str]] = None,
+                        messages: Optional[List[str]] = None):
+        """发送自动回复；greetings 为已判定的拜年消息，为None时读取最后一条消息重新判断
 
-            if not self.llm_service.is_new_year_greeting(last_message):
+        messages 为同一批读到的全部未读消息，发送成功后一并记为已处理（默认只有 greetings）。
+        """
+        try:
+            message_deadline = self.clock.time() + self.message_deadline
+            if greetings is None:
+                last_message = self.ui_automation.get_last_message(wechat_window)
+                if not last_message:
+                    logging.error("无法获取最后一条消息")
+                    return False
+                messages = [last_message]
+                greetings = self.llm_service.select_greetings(messages, message_deadline)
+            if not greetings:
                 logging.info("不是拜年信息，跳过回复")
+                metrics.inc('skipped_contacts', reason='not_greeting')
                 return False
 
-            reply_message = self.llm_service.generate_greeting_reply(last_message)
+            reply_message = self.compose_reply('\n'.join(greetings), message_deadline)
+            if not self.type_and_send(wechat_window, contact_name, reply_message):
+                return False
+            self.reply_state.mark_handled(contact_name, messages or greetings, self.account_key(wechat_window))
+            return True
             
+        except Exception as e:
+            logging.error(f"发送自动回复时出错: {str(e)}")
+            return False
+
+    @timed('compose')
+    def compose_reply(self, message: str, deadline: Optional[float] = None) -> str:
+        """优先从预生成回复池取回复，取不到或需要单独生成时在截止时间内现场生成"""
+        if self.reply_pool:
+            reply = self.reply_pool.take(message)
+            if reply:
+                logging.info("使用预生成回复：%s", reply)
+                return reply
+        reply = self.llm_service.generate_greeting_reply(message, deadline)
+        if self.reply_pool:
+            self.reply_pool.record_sent(reply)
+        return reply
+
+    @timed('send')
+    def type_and_send(self, wechat_window, contact_name, reply_message):
+        """在当前会话中输入并发送回复"""
+        try:
+            self.throttle('send', wechat_window, contact_name)
             try:
-                window_pattern = wechat_window.GetWindowPattern()
-                if window_pattern and window_pattern.Current.WindowVisualState != auto.WindowVisualState.Maximized:
+                if not self.backend.is_maximized(wechat_window):
                     wechat_window.Maximize()
-                    self.ui_automation.random_sleep(0.5, 1)
+                    self.ui_automation.wait_until(lambda: self.backend.is_maximized(wechat_window), step='maximize')
             except:
                 wechat_window.Maximize()
                 self.ui_automation.random_sleep(0.5, 1)
@@ -188,15 +505,19 @@ class WeChatAutoReply:
                 rect = wechat_window.BoundingRectangle
                 x = rect.right - 100
                 y = rect.bottom - 100
-                auto.Click(x, y)
-                time.sleep(0.5)
+                self.backend.click(x, y)
                 
-                for char in reply_message:
-                    if char == '\n':
-                        auto.SendKeys('{ENTER}')
+                with metrics.timer('type', self.clock):
+                    if self.input_mode == 'paste':
+                        if not self.ui_automation.paste_text(reply_message):
+                            return False
                     else:
-                        auto.SendKeys(char)
-                    self.ui_automation.random_sleep(0.05, 0.15)
+                        for char in reply_message:
+                            if char == '\n':
+                                self.backend.send_keys('{ENTER}')
+                            else:
+                                self.backend.send_keys(char)
+                            self.ui_automation.random_sleep(0.05, 0.15)
                 
                 self.ui_automation.random_sleep(0.5, 1)
                 
@@ -207,22 +528,24 @@ class WeChatAutoReply:
                 cancel_key_pressed = False
                 check_times = 30
                 for _ in range(check_times):
-                    if auto.IsKeyPressed(auto.Keys.VK_Q) and auto.IsKeyPressed(auto.Keys.VK_CONTROL):
+                    if self.backend.is_cancel_pressed():
                         cancel_key_pressed = True
                         break
                     self.ui_automation.random_sleep(0.08, 0.12)
                 
                 if cancel_key_pressed:
                     logging.info("用户取消发送")
+                    metrics.inc('replies', outcome='cancelled')
                     print("已取消发送")
                     return False
                 
                 self.ui_automation.random_sleep(0.3, 0.8)
-                auto.SendKeys('{Enter}')
+                self.backend.send_keys('{Enter}')
                 logging.info("消息已发送")
+                metrics.inc('replies', outcome='sent')
                 print(f"消息已发送给 {contact_name}")
                 
-                self.last_reply_time[contact_name] = time.time()
+                self.reply_state.record_reply(contact_name, self.clock.time(), self.account_key(wechat_window))
                 return True
                 
             except Exception as e:
@@ -233,11 +556,77 @@ class WeChatAutoReply:
             logging.error(f"发送自动回复时出错: {str(e)}")
             return False
 
+    def wait_for_scan(self) -> bool:
+        """休眠到下一次轮询时间或被会话列表变化事件唤醒，期间发送流水线中已生成的回复
+
+        返回是否为定时轮询（False 表示由变化事件唤醒，只需扫描发生变化的窗口）。
+        """
+        while self.running:
+            if self.pipeline:
+                self.pipeline.drain_sends()
+            now = self.clock.monotonic()
+            if now >= self.scheduler.next_scan:
+                return True
+            wake_at = self.scheduler.next_scan
+            if self.ui_automation.change_event.is_set():
+                earliest = self.scheduler.last_scan + EVENT_MIN_SCAN_GAP
+                if now >= earliest:
+                    return False
+                wake_at = min(wake_at, earliest)
+            self.scheduler.wait(wake_at)
+        return False
+
+    def prefer_changed_window(self, wechat_windows, changed_handles):
+        """下一次切换到收到变化事件的窗口"""
+        for index, window in enumerate(wechat_windows):
+            try:
+                if self.ui_automation.window_handle(window) in changed_handles:
+                    self.current_window_index = index - 1
+                    return
+            except Exception:
+                continue
+
+    def run_scan_cycle(self, wechat_windows, only_handles=None) -> bool:
+        """先只读扫描所有窗口，只聚焦有待处理会话的窗口；返回是否处理了消息"""
+        with_work, unreachable = self.scan_windows(wechat_windows, only_handles)
+        handled = False
+        for wechat_window, pending in with_work:
+            if not self.running:
+                break
+            if self.activate_window(wechat_window):
+                handled = self.handle_window(wechat_window, pending) or handled
+        if not with_work and unreachable:
+            # 看不到会话列表的窗口仍按原来的方式轮流切换过去检查
+            current_window = self.switch_to_next_window(unreachable)
+            if current_window:
+                handled = self.handle_window(current_window)
+        return handled
+
+    def scan_once(self, poll_due: bool) -> bool:
+        """执行一次扫描，返回是否处理了消息；poll_due 为False时只扫描收到变化事件的窗口"""
+        self.ui_automation.change_event.clear()
+        changed_windows = self.ui_automation.pop_changed_windows()
+        wechat_windows = self.ui_automation.find_all_wechat_windows()
+        if not wechat_windows:
+            print("等待微信窗口...")
+            return False
+        
+        if self.multi_window_scan:
+            # 仅由事件唤醒时只需扫描发生变化的窗口
+            only_handles = None if poll_due else changed_windows
+            return self.run_scan_cycle(wechat_windows, only_handles)
+        if changed_windows:
+            self.prefer_changed_window(wechat_windows, changed_windows)
+        current_window = self.switch_to_next_window(wechat_windows)
+        if not current_window:
+            return False
+        return self.handle_window(current_window)
+
     def start(self):
         """启动自动回复程序"""
         print("\n=== 微信自动回复程序 ===")
         print("正在初始化...")
-        time.sleep(1)
+        self.clock.sleep(1)
         
         logging.info("正在启动自动回复程序...")
         print("\n使用说明：")
@@ -246,39 +635,26 @@ class WeChatAutoReply:
         print("3. 程序运行时请不要手动操作微信窗口")
         print("4. 按 Ctrl+C 可以退出程序\n")
         
-        check_interval = random.randint(8, 15)
-        last_check_time = 0
+        self.llm_service.warm_up()
         consecutive_errors = 0
+        if self.pipeline:
+            self.pipeline.start()
+        if self.reply_pool:
+            self.reply_pool.start()
+        if self.metrics_exporter:
+            self.metrics_exporter.start()
         
         while self.running:
             try:
-                current_time = time.time()
-                if current_time - last_check_time < check_interval:
-                    time.sleep(0.1)
-                    continue
-                
-                last_check_time = current_time
-                check_interval = random.randint(8, 15)
-                
-                wechat_windows = self.ui_automation.find_all_wechat_windows()
-                if not wechat_windows:
-                    print("等待微信窗口...")
-                    time.sleep(check_interval)
-                    continue
-                
-                current_window = self.switch_to_next_window(wechat_windows)
-                if not current_window:
-                    self.ui_automation.random_sleep(1, 2)
-                    continue
-                
-                contact_name = self.check_new_message(current_window)
-                if contact_name:
-                    self.send_auto_reply(current_window, contact_name)
-                    consecutive_errors = 0
-                else:
-                    self.ui_automation.random_sleep(1, 3)
-                
-                self.ui_automation.random_sleep(check_interval * 0.8, check_interval * 1.2)
+                poll_due = self.wait_for_scan()
+                if not self.running:
+                    break
+                try:
+                    if self.scan_once(poll_due):
+                        consecutive_errors = 0
+                finally:
+                    # 事件模式下变化会立即唤醒扫描，定时轮询只作兜底
+                    self.scheduler.record_scan(EVENT_POLL_INTERVAL if self.ui_automation.events_active() else None)
                 
             except KeyboardInterrupt:
                 print("\n正在停止程序...")
@@ -290,11 +666,25 @@ class WeChatAutoReply:
                 consecutive_errors += 1
                 
                 if consecutive_errors >= 3:
-                    wait_time = min(300, check_interval * consecutive_errors)
+                    wait_time = min(300, self.scheduler.max_interval * consecutive_errors)
                     logging.info(f"连续出错{consecutive_errors}次，等待{wait_time}秒后继续...")
-                    time.sleep(wait_time)
-                else:
-                    time.sleep(check_interval)
+                    self.clock.sleep(wait_time)
         
+        if self.pipeline:
+            self.pipeline.shutdown()
+        if self.reply_pool:
+            self.reply_pool.stop()
+            logging.info(f"回复池统计: {self.reply_pool.stats()}")
+        self.llm_service.close()
+        logging.info(f"模型路由统计: {self.llm_service.router.stats()}")
+        self.llm_service.classification_cache.save()
+        logging.info(f"拜年判断缓存统计: {self.llm_service.classification_cache.stats()}")
+        if self.llm_service.image_detector:
+            logging.info(f"图片判断统计: {self.llm_service.image_detector.stats()}")
+        logging.info(f"回复状态统计: {self.reply_state.stats()}")
+        logging.info(f"操作限速统计: {self.rate_limiter.stats()}")
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        self.reply_state.close()
         print("程序已退出。")
         logging.info("程序已退出")
\ No newline at end of file